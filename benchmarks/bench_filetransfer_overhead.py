@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""benchmark for per-push overhead of ``FileTransfer``, without the actual rsync call.
+
+It compares constructing ``FileTransfer`` with its config normalized from scratch every time (old behavior,
+emulated by invalidating the registry before each construction) against going through the registry of
+normalized configs.
+
+run it from the root of the repository, like ``python benchmarks/bench_filetransfer_overhead.py``.
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+from unittest import mock
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from datasmart.core import global_config
+from datasmart.core.filetransfer import FileTransfer
+
+
+def setup_project(project_root):
+    config_dir = os.path.join(project_root, 'config', 'core', 'filetransfer')
+    os.makedirs(config_dir)
+    config = {
+        "local_data_dir": "_data",
+        "site_mapping_push": [],
+        "site_mapping_fetch": [],
+        "remote_site_config": {"localhost": {"ssh_username": "nobody", "ssh_port": 22}},
+        "default_site": {"path": "default_local_site", "local": True},
+        "quiet": True,
+        "local_fetch_option": "copy"
+    }
+    with open(os.path.join(config_dir, 'config.json'), 'wt') as f:
+        json.dump(config, f)
+    os.makedirs(os.path.join(project_root, '_data'))
+    with open(os.path.join(project_root, '_data', 'a.txt'), 'wt') as f:
+        f.write('a')
+
+
+def push_once(invalidate):
+    if invalidate:
+        FileTransfer.invalidate_config()
+    FileTransfer().push(filelist=['a.txt'], dest_append_prefix=['bench'])
+
+
+def main(number=200):
+    project_root = tempfile.mkdtemp()
+    old_project_root = global_config['project_root']
+    try:
+        global_config['project_root'] = project_root
+        setup_project(project_root)
+        # no rsync (or the native engine, if any) is run; we only measure the Python side.
+        with mock.patch.object(FileTransfer, '_transfer', return_value=['bench/a.txt']):
+            for invalidate in (True, False):
+                FileTransfer.invalidate_config()
+                t = timeit.timeit(lambda: push_once(invalidate), number=number)
+                print('{:<28} {:8.3f} ms per push'.format(
+                    'normalize every time:' if invalidate else 'registry of configs:', t / number * 1000))
+    finally:
+        global_config['project_root'] = old_project_root
+        FileTransfer.invalidate_config()
+        shutil.rmtree(project_root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""import-time benchmark for datasmart, based on ``python -X importtime``.
+
+each module is imported in a fresh interpreter several times, and the best cumulative import time is compared against
+its budget. The script exits with 1 if any budget is exceeded, so it can be used in CI.
+
+run it from the root of the repository, like ``python benchmarks/bench_import_time.py``.
+"""
+
+import os
+import subprocess
+import sys
+
+repo_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# module -> budget of cumulative import time, in milliseconds.
+# heavy dependencies (pymongo, jsonschema, pytz, strict_rfc3339) are only imported on first use,
+# so none of these modules should pay for them. jsl is still imported eagerly, as schemas are declared as jsl
+# documents at module level (in datasmart.core.schemautil and datasmart.core.filetransfer); it takes ~15 ms, and is
+# within the budgets.
+import_budgets = {
+    'datasmart.core': 10,
+    'datasmart.core.util.datetime': 50,
+    'datasmart.core.util.registry': 50,
+    'datasmart.core.filetransfer': 150,
+    'datasmart.core.action': 200,
+}
+
+# these modules should never be imported by the modules above.
+deferred_modules = ('pymongo', 'bson', 'jsonschema', 'pytz', 'strict_rfc3339')
+
+
+def import_time_ms(module_name):
+    """ cumulative import time of a module in a fresh interpreter, in milliseconds, and all modules imported. """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module_name],
+                            cwd=repo_root, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, check=True)
+    cumulative_us = None
+    imported = set()
+    for line in result.stderr.decode().splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        imported.add(name)
+        if name == module_name:
+            cumulative_us = int(cumulative)
+    assert cumulative_us is not None, "can't find {} in the output".format(module_name)
+    return cumulative_us / 1000, imported
+
+
+def main(repeat=5):
+    over_budget = False
+    for module_name, budget in import_budgets.items():
+        times = []
+        imported = set()
+        for _ in range(repeat):
+            time_this, imported = import_time_ms(module_name)
+            times.append(time_this)
+        best = min(times)
+        heavy = sorted(m for m in imported if m.split('.')[0] in deferred_modules)
+        status = 'ok' if (best <= budget and not heavy) else 'OVER'
+        over_budget = over_budget or status != 'ok'
+        print('{:<32} {:8.2f} ms (budget {:4d} ms) {}'.format(module_name, best, budget, status))
+        if heavy:
+            print('    heavy modules imported eagerly: {}'.format(', '.join(heavy)))
+    return 1 if over_budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
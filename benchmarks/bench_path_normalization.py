@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""benchmark for normalizing large filelists, as done for every push and fetch.
+
+It compares the old implementation of ``normalize_filelist_relative`` (``joinpath_norm``, checking characters one by
+one, and ``filename_more_check`` for each path), reproduced below, against the bulk one in
+``datasmart.core.util.path``, and times ``get_rsync_filelist`` as well, for 10^4 to 10^6 paths shaped like files of
+recording sessions.
+
+run it from the root of the repository, like ``python benchmarks/bench_path_normalization.py``.
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from datasmart.core.util import path
+
+
+def joinpath_norm_old(p, *paths):
+    s = os.path.normpath(os.path.join(p, *paths))
+    assert s == os.path.normpath(s)
+    for c in s:
+        assert c in path._valid_chracters, "path {} has invalid character {}".format(s, c)
+    return s
+
+
+def normalize_filelist_relative_old(filelist, prefix=''):
+    ret_filelist = [joinpath_norm_old(prefix, p) for p in filelist]
+    for p in ret_filelist:
+        path.filename_more_check(p)
+    return ret_filelist
+
+
+def gen_filelist(n):
+    return ['session_{:03d}/channel_{:03d}/unit_{:06d}.mat'.format(i % 100, i % 96, i) for i in range(n)]
+
+
+def main():
+    for n in (10 ** 4, 10 ** 5, 10 ** 6):
+        filelist = gen_filelist(n)
+        number = max(10 ** 6 // n, 1)
+        assert normalize_filelist_relative_old(filelist, 'prefix') == path.normalize_filelist_relative(filelist,
+                                                                                                      'prefix')
+        for name, func in [('old normalize', lambda: normalize_filelist_relative_old(filelist, 'prefix')),
+                           ('bulk normalize', lambda: path.normalize_filelist_relative(filelist, 'prefix')),
+                           ('get_rsync_filelist', lambda: path.get_rsync_filelist(filelist, {'relative': True}))]:
+            t = timeit.timeit(func, number=number) / number
+            print('{:>8} paths, {:<20} {:9.3f} s, {:6.3f} us per path'.format(n, name + ':', t, t / n * 1e6))
+
+
+if __name__ == '__main__':
+    main()
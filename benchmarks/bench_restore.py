@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""benchmark for time to restore a backup of ``datasmart.core.dbbackup`` on synthetic records.
+
+It backs up a few collections of synthetic records (with nested file references, like those of actions, and a few
+indexes each), and restores them in three ways:
+
+* serial, with indexes built before loading, and so updated on every insert (the way a naive restore would do it).
+* :func:`datasmart.core.dbbackup.restore` with one worker, which builds indexes after loading.
+* :func:`datasmart.core.dbbackup.restore` with ``--jobs`` workers.
+
+It needs a local mongod, like tests working with the database, and uses (and drops) the database
+``datasmart_bench_restore``. run it from the root of the repository, like ``python benchmarks/bench_restore.py``.
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pymongo
+from bson.raw_bson import RawBSONDocument
+
+from datasmart.core import dbbackup
+
+DATABASE = 'datasmart_bench_restore'
+INDEXES = [[('trial', pymongo.ASCENDING)], [('subject', pymongo.ASCENDING), ('session', pymongo.DESCENDING)],
+           [('tags', pymongo.ASCENDING)]]
+
+
+def gen_records(collection_idx, num_records):
+    rng = random.Random(collection_idx)
+    for i in range(num_records):
+        yield {'subject': 'subject_{}'.format(rng.randrange(50)), 'session': rng.randrange(1000), 'trial': i,
+               'tags': [rng.choice(['good', 'bad', 'noisy', 'pilot']) for _ in range(3)],
+               'parameters': {'x': rng.random(), 'y': rng.random(), 'note': 'x' * rng.randrange(200)},
+               'uploaded_files': {'site': {'local': False, 'path': 'example.com', 'prefix': '/data',
+                                           'append_prefix': 'table_{}/{}'.format(collection_idx, i)},
+                                  'filelist': ['table_{}/{}/file_{}.dat'.format(collection_idx, i, j)
+                                               for j in range(5)]}}
+
+
+def setup(client, num_collections, num_records):
+    client.drop_database(DATABASE)
+    for collection_idx in range(num_collections):
+        collection = client[DATABASE]['records_{}'.format(collection_idx)]
+        batch = []
+        for record in gen_records(collection_idx, num_records):
+            batch.append(record)
+            if len(batch) >= 1000:
+                collection.insert_many(batch)
+                batch = []
+        if batch:
+            collection.insert_many(batch)
+        for keys in INDEXES:
+            collection.create_index(keys)
+
+
+def restore_naive(client, backup_root, name):
+    """ restore collections one by one, with indexes built first. """
+    manifest = dbbackup.load_manifest(backup_root, name)
+    for collection_key in sorted(manifest['collections']):
+        database, collection_name = collection_key.split('.', 1)
+        collection = client[database][collection_name]
+        for keys in INDEXES:
+            collection.create_index(keys)
+        batch = []
+        for raw in dbbackup.iter_documents(backup_root, name, collection_key):
+            batch.append(RawBSONDocument(raw))
+            if len(batch) >= 1000:
+                collection.insert_many(batch)
+                batch = []
+        if batch:
+            collection.insert_many(batch)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='benchmark time to restore a backup of synthetic records.')
+    parser.add_argument('--collections', type=int, default=4, help='number of collections (default 4)')
+    parser.add_argument('--records', type=int, default=50000, help='records in each collection (default 50000)')
+    parser.add_argument('--jobs', type=int, default=4, help='workers of the parallel restore (default 4)')
+    args = parser.parse_args(argv)
+
+    client = pymongo.MongoClient()
+    backup_root = tempfile.mkdtemp()
+    try:
+        setup(client, args.collections, args.records)
+        name = dbbackup.backup(client, backup_root, databases=[DATABASE], max_workers=args.jobs)['name']
+        num_docs = args.collections * args.records
+        print('{} collections, {} records in total'.format(args.collections, num_docs))
+        for label, func in [('serial, indexes first:', lambda: restore_naive(client, backup_root, name)),
+                            ('restore, 1 worker:', lambda: dbbackup.restore(client, backup_root, name,
+                                                                            max_workers=1)),
+                            ('restore, {} workers:'.format(args.jobs),
+                             lambda: dbbackup.restore(client, backup_root, name, max_workers=args.jobs))]:
+            client.drop_database(DATABASE)
+            start_time = time.monotonic()
+            func()
+            wall_time = time.monotonic() - start_time
+            print('{:<24} {:8.2f} s, {:10.0f} records/s'.format(label, wall_time, num_docs / wall_time))
+    finally:
+        client.drop_database(DATABASE)
+        client.close()
+        shutil.rmtree(backup_root)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
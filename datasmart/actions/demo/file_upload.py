@@ -51,14 +51,23 @@ class FileUploadAction(ManualDBActionWithSchema):
         return {}
 
     def before_insert_record(self, record):
-        """ upload files now!
+        """ upload files in the background, so that next record can be processed meanwhile.
 
         :param record:
         :return:
         """
         print("upload files begin...")
-        ret = self.push_files(record['_id'], record['uploaded_files']['filelist'],
+        self.push_files_async(record['_id'], record['uploaded_files']['filelist'],
                               site=record['uploaded_files']['site'], relative=True)
+
+    def after_push_files(self, record, push_results):
+        """ save where files are uploaded into the record.
+
+        :param record:
+        :param push_results:
+        :return:
+        """
+        ret, = push_results
         dest_site = ret['dest']
         print("upload files done... results saved in {} at {}/{}".format(
             dest_site['path'], dest_site['prefix'], dest_site['append_prefix']
@@ -12,4 +12,5 @@ keywords = ('_data',
             'default_local_site',  # default local site folder for file transfer. Again, this is a guess.
             'query_template.py',  # the query template file
             'prepare_result.p',  # the prepared result.
+            '_content_store_',  # content-addressed store of files under a site, see FileTransfer.push.
             )
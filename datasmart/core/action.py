@@ -1,17 +1,17 @@
+import functools
 import json
 import os
 import pickle
 from abc import abstractmethod
 
-from bson import ObjectId
-
 import datasmart.core.util.path
 from .base import Base
 from .db import DB, DBContextManager
 from .dbschema import DBSchema
-from .filetransfer import FileTransfer
+from .filetransfer import FileTransfer, LazyFetch, TransferQueue
 from .util.io import load_file, save_file
 from itertools import zip_longest
+from collections import deque
 from copy import deepcopy
 
 
@@ -106,6 +106,13 @@ class DBAction(Action):
         return '.'.join(self.config_path) + '.' + 'query_template.py'
 
     def post_perform(self):
+        if self.__transfer_stats:
+            stats = self.transfer_stats
+            print("transferred {} bytes of {} files ({} skipped) in {} transfers, {:.1f} s, {:.0f} bytes/s".format(
+                stats['total_bytes'], stats['files'], stats['skipped_files'], stats['transfers'], stats['wall_time'],
+                stats['throughput']))
+            if stats['retries']:
+                print("{} failed transfers were retried".format(stats['retries']))
         print("remember to rm {} and {} if you want to start over for new action!".format(self.prepare_result_name,
                                                                                           self.query_template_name))
 
@@ -134,6 +141,15 @@ class DBAction(Action):
         self.__prepare_result = None
         self.__result_ids = None
         self.force_finished = False  # useful for some Action without any __result_ids ([]) to make them finishable.
+        # stats of all (non dry run) pushes and fetches of this action.
+        self.__transfer_stats = []
+        # ``DBAction.fetch_files`` is static, and fetches through the action itself are counted in its stats.
+        if type(self).fetch_files is DBAction.fetch_files:
+            self.fetch_files = functools.partial(DBAction.fetch_files,
+                                                 on_fetch=lambda ret: self.__transfer_stats.append(ret['stats']))
+        # background pushes, created on first use, and futures of pushes for each _id not collected yet.
+        self.__transfer_queue = None
+        self.__pending_pushes = {}
         self.is_prepared()
 
     @staticmethod
@@ -155,6 +171,11 @@ class DBAction(Action):
     def result_ids(self):
         return self.__result_ids
 
+    @property
+    def transfer_stats(self) -> dict:
+        """ stats of all pushes and fetches done so far, see :func:`FileTransfer.aggregate_transfer_stats`. """
+        return FileTransfer.aggregate_transfer_stats(self.__transfer_stats)
+
     # def find_one_arbitrary(self, _id, table_path):
     #     """ check if a record exists in any arbitrary (db, collection).
     #
@@ -178,7 +199,7 @@ class DBAction(Action):
             for result in results:
                 self._insert_results_inner(result, collection_instance)
 
-    def push_files(self, _id: ObjectId, filelist: list, site: dict = None, relative: bool = True,
+    def push_files(self, _id: 'ObjectId', filelist: list, site: dict = None, relative: bool = True,
                    subdirs: list = None, dryrun: bool = False):
         assert _id in self.result_ids, "you can only push files related to you!"
         filetransfer_instance = FileTransfer()
@@ -192,13 +213,56 @@ class DBAction(Action):
             ret = filetransfer_instance.push(filelist=filelist, dest_site=site, relative=relative, subdirs=subdirs,
                                              dest_append_prefix=list(self.table_path + (str(_id),)),
                                              dryrun=dryrun)
+        if not dryrun:
+            self.__transfer_stats.append(ret['stats'])
         return ret
 
+    @property
+    def transfer_queue(self) -> TransferQueue:
+        if self.__transfer_queue is None:
+            self.__transfer_queue = TransferQueue()
+        return self.__transfer_queue
+
+    def close_transfer_queue(self, cancel: bool = False) -> None:
+        """ wait for background pushes, and close the queue. see :func:`TransferQueue.close`. """
+        if self.__transfer_queue is not None:
+            self.__transfer_queue.close(cancel=cancel)
+            self.__transfer_queue = None
+
+    def push_files_async(self, _id: 'ObjectId', filelist: list, site: dict = None, relative: bool = True,
+                         subdirs: list = None):
+        """ like :func:`DBAction.push_files`, but the push runs in the background through ``transfer_queue``.
+
+        :return: a ``Future`` of the push. It's also kept for ``_id``, to be collected by
+            :func:`DBAction.pop_pending_pushes`.
+        """
+        assert _id in self.result_ids, "you can only push files related to you!"
+        with self.db_context as db_instance:
+            collection_instance = db_instance.client_instance[self.table_path[0]][self.table_path[1]]
+            # make sure we don't push files after record is constructed.
+            assert collection_instance.count({"_id": _id}) == 0, "only push files before inserting the record!"
+        future = self.transfer_queue.push(filelist=filelist, dest_site=site, relative=relative, subdirs=subdirs,
+                                          dest_append_prefix=list(self.table_path + (str(_id),)))
+
+        def record_stats(future_this):
+            if not future_this.cancelled() and future_this.exception() is None:
+                self.__transfer_stats.append(future_this.result()['stats'])
+
+        future.add_done_callback(record_stats)
+        self.__pending_pushes.setdefault(_id, []).append(future)
+        return future
+
+    def pop_pending_pushes(self, _id: 'ObjectId') -> list:
+        """ futures of background pushes for ``_id``, in the order of submission. they are forgotten afterwards."""
+        return self.__pending_pushes.pop(_id, [])
+
     @staticmethod
     def fetch_files(filelist: list, site: dict = None, relative: bool = True,
                     subdirs: list = None, local_fetch_option=None, dryrun: bool = False,
-                    strip_append_prefix=True):  # remove strip prefix de
-
+                    strip_append_prefix=True, on_fetch=None):  # remove strip prefix de
+        """ fetch files of a record. ``on_fetch``, if given, is called with the return value unless it's a dry run.
+        called on an action, its stats are counted in ``transfer_stats``.
+        """
         if 'append_prefix' in site and strip_append_prefix:
             strip_prefix = site['append_prefix']
         else:
@@ -207,8 +271,27 @@ class DBAction(Action):
         ret = filetransfer_instance.fetch(filelist=filelist, src_site=site, relative=relative, subdirs=subdirs,
                                           local_fetch_option=local_fetch_option, dryrun=dryrun,
                                           strip_prefix=strip_prefix)
+        if not dryrun and on_fetch is not None:
+            on_fetch(ret)
         return ret
 
+    def fetch_files_lazy(self, filelist: list, site: dict = None, relative: bool = True,
+                         subdirs: list = None, local_fetch_option=None, strip_append_prefix=True,
+                         **kwargs) -> LazyFetch:
+        """ like :func:`DBAction.fetch_files`, but files are fetched on demand, see
+        :class:`datasmart.core.filetransfer.LazyFetch`. stats of fetches are counted in ``transfer_stats``.
+
+        :param kwargs: other arguments of :class:`datasmart.core.filetransfer.LazyFetch`, such as ``background``.
+        :return: a ``LazyFetch``, mapping canonical paths to file handles.
+        """
+        if 'append_prefix' in site and strip_append_prefix:
+            strip_prefix = site['append_prefix']
+        else:
+            strip_prefix = ''
+        return FileTransfer().fetch_lazy(filelist=filelist, src_site=site, relative=relative, subdirs=subdirs,
+                                         local_fetch_option=local_fetch_option, strip_prefix=strip_prefix,
+                                         on_fetch=lambda ret: self.__transfer_stats.append(ret['stats']), **kwargs)
+
     @abstractmethod
     def is_stale(self, record, db_instance) -> bool:
         """check if one record is no longer needed.
@@ -266,7 +349,9 @@ class DBAction(Action):
         correct_append_prefix = datasmart.core.util.path.joinpath_norm(*(self.table_path + (str(_id),)))
         for site in site_list:
             assert site['append_prefix'] == correct_append_prefix
-            filetransfer.remove_dir(site)
+        failed_sites = filetransfer.remove_dirs(site_list)
+        if failed_sites:
+            raise RuntimeError("failed to remove files of {} on sites {}".format(_id, failed_sites))
 
     def global_clean_up(self):
         """
@@ -394,6 +479,7 @@ class DBAction(Action):
         return post_prepare_result
 
     def _prepare_check_result_id(self, post_prepare_result):
+        from bson import ObjectId
         with self.db_context as db_instance:
             collection_instance = db_instance.client_instance[self.table_path[0]][self.table_path[1]]
             for _id in post_prepare_result['result_ids']:
@@ -450,18 +536,25 @@ class DBAction(Action):
         pass
 
     def check_file_exists(self, site, filelist, unique=True):
-        """ check that all files in filelist exist on site.
+        """ check that all files in filelist exist on site, with :func:`FileTransfer.stat`.
+
+        this used to run a dry-run fetch, and return its result. Now nothing is transferred, not even in a dry run,
+        and the stat records are returned instead. Call :func:`DBAction.fetch_files` with ``dryrun=True`` for the
+        old result.
 
         :param site:
         :param filelist:
         :param unique:
-        :return:
+        :return: result of :func:`FileTransfer.stat`, with size and mtime of each file. An ``AssertionError`` is
+            raised if any file is missing, as before.
         """
         # here, case is normalized.
         filelist_base = [os.path.basename(f).lower().strip() for f in filelist]
         if unique:
             assert len(set(filelist_base)) == len(filelist), "all file names must be unique!"
-        ret = self.fetch_files(filelist, site=site, relative=True, local_fetch_option='copy', dryrun=True)
+        ret = FileTransfer().stat(filelist, site=site)
+        missing_files = [x['path'] for x in ret if not x['exists']]
+        assert not missing_files, "files {} don't exist on site {}!".format(missing_files, site)
         return ret
 
     # useless.
@@ -537,6 +630,7 @@ class ManualDBActionWithSchema(DBActionWithSchema):
 
     def prepare_post(self, query_result) -> dict:
         # ignore the query result, simply return a ID to go.
+        from bson import ObjectId
         if self._batch:
             result_ids = [ObjectId() for _ in range(self._batch_length)]
             # return {'result_ids': [ObjectId()]}
@@ -550,7 +644,20 @@ class ManualDBActionWithSchema(DBActionWithSchema):
     def before_insert_record(self, record):
         """ this can be used to upload files, etc.
 
+        files can be pushed in the background with :func:`DBAction.push_files_async`, so that later records are
+        processed meanwhile. Then modify the record based on push results in :func:`after_push_files`.
+
+        :param record:
+        :return: None if nothing happens. throw exception if bad thing happens.
+        """
+        pass
+
+    def after_push_files(self, record, push_results):
+        """ called after all background pushes for this record finish, right before inserting it.
+
         :param record:
+        :param push_results: return values of the pushes submitted by :func:`DBAction.push_files_async` for this
+            record, in the order of submission.
         :return: None if nothing happens. throw exception if bad thing happens.
         """
         pass
@@ -572,28 +679,49 @@ class ManualDBActionWithSchema(DBActionWithSchema):
             savepath = datasmart.core.util.path.joinpath_norm(self.global_config['project_root'],
                                                               self.config['savepath'])
             template_text = self.dbschema_instance.get_template()
-        for result_idx, (result_id, potential_record) in enumerate(zip_longest(self.result_ids,
-                                                                               self.config['batch_records'],
-                                                                               fillvalue=None), start=1):
-            # check if it's already there.
-            if self.is_inserted_one(result_id):
-                print("done before {}/{}!".format(result_idx, len(self.result_ids)))
-                continue
-
-            if not self._batch:
-                record = save_wait_and_load(template_text, savepath,
-                                            "{} Step 1 Enter to continue after editing and saving the template...".format(
-                                                self.class_identifier),
-                                            load_json=True, overwrite=False)
-            else:
-                record = deepcopy(potential_record)
-
-            record = self.import_record_template(record, result_id)
-            self.before_insert_record(record)
-            self.insert_results([record])
-            print("done {}/{}!".format(result_idx, len(self.result_ids)))
+        # records whose files may still be pushed in the background, in order, as (result_idx, record, futures).
+        # records are inserted in order, each one waiting only for its own pushes.
+        pending_records = deque()
+        try:
+            for result_idx, (result_id, potential_record) in enumerate(zip_longest(self.result_ids,
+                                                                                   self.config['batch_records'],
+                                                                                   fillvalue=None), start=1):
+                # check if it's already there.
+                if self.is_inserted_one(result_id):
+                    print("done before {}/{}!".format(result_idx, len(self.result_ids)))
+                    continue
+
+                if not self._batch:
+                    record = save_wait_and_load(template_text, savepath,
+                                                "{} Step 1 Enter to continue after editing and saving the template...".format(
+                                                    self.class_identifier),
+                                                load_json=True, overwrite=False)
+                else:
+                    record = deepcopy(potential_record)
+
+                record = self.import_record_template(record, result_id)
+                self.before_insert_record(record)
+                pending_records.append((result_idx, record, self.pop_pending_pushes(result_id)))
+                # insert whatever is ready, without waiting.
+                while pending_records and all(future.done() for future in pending_records[0][2]):
+                    self._insert_pending_record(*pending_records.popleft())
+            while pending_records:
+                self._insert_pending_record(*pending_records.popleft())
+        except BaseException:
+            # the first failure stops everything. pushes not started yet are cancelled, and running ones are waited
+            # for, so there's nothing running in the background after this. Records not inserted can be redone later.
+            self.close_transfer_queue(cancel=True)
+            raise
+        self.close_transfer_queue()
         print("done!")
 
+    def _insert_pending_record(self, result_idx, record, futures):
+        # raise the error of the first failed push, if any.
+        push_results = [future.result() for future in futures]
+        self.after_push_files(record, push_results)
+        self.insert_results([record])
+        print("done {}/{}!".format(result_idx, len(self.result_ids)))
+
     def import_record_template(self, record, result_id):
         record = self.dbschema_instance.generate_record(record)
         assert '_id' not in record
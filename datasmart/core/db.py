@@ -2,7 +2,6 @@
 The module for database handling in DataSMART.
 """
 
-from pymongo import MongoClient
 from .base import Base
 
 
@@ -33,6 +32,8 @@ class DB(Base):
         """
         # we can't reconnect.
         assert self.client_instance is None
+        # pymongo is slow to import, so import it only when we actually connect.
+        from pymongo import MongoClient
         # step 3. connect to database
         client = MongoClient(self.config['url'], self.config['port'], j=True)  # force journaling.
         # oldTODO: MongoClient is nonblocking, and auth is blocking. So if there's no auth, we don't discover bug
@@ -0,0 +1,464 @@
+"""
+online backup of MongoDB databases, taken while the server keeps running.
+
+a backup is a directory under a backup root, named by the UTC time it starts (like ``20170301_120000Z``), holding a
+manifest (``manifest.json``) and, for each collection, its documents as concatenated BSON in gzip compressed chunks,
+``_id`` of all its documents in the same format, and its options and index specs (in the manifest). Collections are
+dumped in parallel, and chunks are compressed in parallel as well, since zlib releases the GIL.
+
+a backup is either full, or incremental over the latest backup under the same root (its parent). In an incremental
+backup, a collection only gets documents whose ``_id`` are not in the parent, no matter when their ``_id`` are made
+(records of DataSMART get their ``_id`` when they are prepared, and may be inserted long after that). Collections not
+in the parent are dumped in full. As ``_id`` of all documents are recorded in every backup, a collection can be
+restored to the point of any backup, going back along the chain of parents to its full dump (see
+:func:`iter_documents`). Documents changed in place after they are dumped are not picked up by incremental backups.
+This is fine for records of DataSMART, as they are only inserted and removed, but take a full backup now and then
+anyway.
+
+a backup is restored into a running server by :func:`restore`, which loads collections in parallel, and builds their
+indexes only after all documents are in.
+"""
+import collections
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_MANIFEST_NAME = 'manifest.json'
+_MANIFEST_VERSION = 1
+# documents are compressed in chunks of about this size (before compression), each being a gzip file.
+CHUNK_SIZE = 16 * 1024 * 1024
+COMPRESS_LEVEL = 6
+# databases of the server itself, which are not backed up.
+SYSTEM_DATABASES = ('admin', 'config', 'local')
+_BATCH_SIZE = 1000
+
+
+def get_backup_name(time_this: datetime.datetime) -> str:
+    """ name of a backup started at ``time_this`` (in UTC), same as archives by ``backup_restore_db.sh``. """
+    return time_this.strftime('%Y%m%d_%H%M%SZ')
+
+
+def list_backups(backup_root: str) -> list:
+    """ names of complete backups under ``backup_root``, from old to new. """
+    if not os.path.isdir(backup_root):
+        return []
+    return sorted(x for x in os.listdir(backup_root) if os.path.isfile(os.path.join(backup_root, x, _MANIFEST_NAME)))
+
+
+def load_manifest(backup_root: str, name: str) -> dict:
+    """ manifest of a backup. JSON objects in it are ``OrderedDict``, as keys of index specs are ordered. """
+    with open(os.path.join(backup_root, name, _MANIFEST_NAME), 'rt', encoding='utf-8') as f:
+        manifest = json.loads(f.read(), object_pairs_hook=collections.OrderedDict)
+    assert manifest['version'] == _MANIFEST_VERSION, 'unknown manifest version {}'.format(manifest['version'])
+    return manifest
+
+
+def _format_time(time_this: datetime.datetime) -> str:
+    return time_this.astimezone(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def _write_chunk(path: str, data: bytes, count: int) -> dict:
+    compressed = gzip.compress(data, compresslevel=COMPRESS_LEVEL)
+    with open(path, 'wb') as f:
+        f.write(compressed)
+    return {'file': os.path.basename(path), 'count': count, 'bytes': len(data), 'compressed_bytes': len(compressed),
+            'sha1': hashlib.sha1(compressed).hexdigest()}
+
+
+def read_chunk(collection_dir: str, chunk: dict) -> bytes:
+    """ content of a chunk written by a backup, as concatenated BSON documents. its checksum is verified. """
+    with open(os.path.join(collection_dir, chunk['file']), 'rb') as f:
+        compressed = f.read()
+    assert hashlib.sha1(compressed).hexdigest() == chunk['sha1'], 'chunk {} is corrupted'.format(
+        os.path.join(collection_dir, chunk['file']))
+    return gzip.decompress(compressed)
+
+
+def iter_raw_documents(data: bytes):
+    """ split concatenated BSON documents. """
+    offset = 0
+    while offset < len(data):
+        size = struct.unpack_from('<i', data, offset)[0]
+        yield data[offset:offset + size]
+        offset += size
+
+
+def _get_id_key(raw: bytes) -> bytes:
+    """ encoded ``{'_id': ...}`` of a raw BSON document, the same as documents in ``ids_`` chunks. """
+    from bson import encode
+    from bson.raw_bson import RawBSONDocument
+    return encode({'_id': RawBSONDocument(raw)['_id']})
+
+
+def _load_ids(backup_root: str, name: str, collection_key: str) -> set:
+    """ encoded ``{'_id': ...}`` of all documents of a collection at the point of a backup. """
+    collection_dir = get_collection_dir(backup_root, name, collection_key)
+    ids = set()
+    for chunk in load_manifest(backup_root, name)['collections'][collection_key]['id_chunks']:
+        ids.update(iter_raw_documents(read_chunk(collection_dir, chunk)))
+    return ids
+
+
+class _ChunkWriter:
+    """ collects documents of a cursor into chunks, and compresses and writes them in an executor. """
+
+    def __init__(self, collection_dir: str, prefix: str, executor, slots: threading.Semaphore,
+                 chunk_size: int) -> None:
+        self.collection_dir = collection_dir
+        self.prefix = prefix
+        self.executor = executor
+        # bounds chunks in memory, waiting to be compressed, when reading is faster than compressing.
+        self.slots = slots
+        self.chunk_size = chunk_size
+        self.futures = []
+        self.count = 0
+        self.__buffer = []
+        self.__buffer_size = 0
+
+    def add(self, raw: bytes) -> None:
+        self.__buffer.append(raw)
+        self.__buffer_size += len(raw)
+        self.count += 1
+        if self.__buffer_size >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.__buffer:
+            return
+        path = os.path.join(self.collection_dir, '{}{:06d}.bson.gz'.format(self.prefix, len(self.futures)))
+        self.slots.acquire()
+        future = self.executor.submit(_write_chunk, path, b''.join(self.__buffer), len(self.__buffer))
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+        self.__buffer = []
+        self.__buffer_size = 0
+
+    def get_chunks(self) -> list:
+        self.flush()
+        return [future.result() for future in self.futures]
+
+
+def _to_json(value):
+    """ BSON values (such as index specs) as plain JSON, in MongoDB extended JSON.
+
+    documents become ``OrderedDict``, so that their keys keep the order, even where ``dict`` is not ordered.
+    """
+    from bson import json_util
+    return json.loads(json_util.dumps(value), object_pairs_hook=collections.OrderedDict)
+
+
+def from_json(value):
+    """ inverse of :func:`_to_json`. documents become ``SON``, which keeps the order of keys. """
+    from bson import json_util
+    from bson.son import SON
+    return json_util.loads(json.dumps(value), json_options=json_util.JSONOptions(document_class=SON))
+
+
+def _backup_collection(collection, collection_dir: str, parent_ids, executor, slots, chunk_size: int) -> dict:
+    """ dump one collection.
+
+    :param collection: a pymongo collection.
+    :param collection_dir: where to write chunks.
+    :param parent_ids: ``_id`` of documents in the parent backup (see :func:`_load_ids`), so that only other documents
+        are dumped, or None to dump all.
+    :return: its entry in manifest.
+    """
+    # bson comes with pymongo, which is slow to import, so import it only when we actually back up.
+    from bson.codec_options import CodecOptions
+    from bson.raw_bson import RawBSONDocument
+    os.makedirs(collection_dir)
+    # documents are dumped as they are, without being decoded.
+    raw_collection = collection.with_options(codec_options=CodecOptions(document_class=RawBSONDocument))
+    # ``_id`` first, so that documents inserted during the backup, which may or may not be dumped, are left out
+    # when restoring. they will be in the next backup.
+    ids = [doc.raw for doc in raw_collection.find({}, {'_id': 1}, batch_size=_BATCH_SIZE * 10)]
+    data_writer = _ChunkWriter(collection_dir, 'data_', executor, slots, chunk_size)
+    dumped = set()
+    if parent_ids is None:
+        cursors = [raw_collection.find({}, batch_size=_BATCH_SIZE)]
+    else:
+        new_ids = [x for x in ids if x not in parent_ids]
+        cursors = (raw_collection.find({'_id': {'$in': [RawBSONDocument(x)['_id'] for x in
+                                                        new_ids[start:start + _BATCH_SIZE]]}}, batch_size=_BATCH_SIZE)
+                   for start in range(0, len(new_ids), _BATCH_SIZE))
+    for cursor in cursors:
+        for doc in cursor:
+            data_writer.add(doc.raw)
+            dumped.add(_get_id_key(doc.raw))
+    # documents removed after their ``_id`` are read are left out as well, so that every ``_id`` recorded has its
+    # document in this backup or its ancestors.
+    id_writer = _ChunkWriter(collection_dir, 'ids_', executor, slots, chunk_size)
+    for raw in ids:
+        if raw in dumped or (parent_ids is not None and raw in parent_ids):
+            id_writer.add(raw)
+    return {'mode': 'full' if parent_ids is None else 'incremental',
+            'count': data_writer.count, 'num_ids': id_writer.count,
+            'chunks': data_writer.get_chunks(), 'id_chunks': id_writer.get_chunks(),
+            'options': _to_json(collection.options()), 'indexes': _to_json(list(collection.list_indexes()))}
+
+
+def list_collections(client, databases: list = None) -> list:
+    """ ``(database, collection)`` of all collections to back up, excluding views and system collections.
+
+    :param client: a ``MongoClient``.
+    :param databases: databases to back up. By default, all except ``SYSTEM_DATABASES``.
+    """
+    if databases is None:
+        databases = [x for x in client.list_database_names() if x not in SYSTEM_DATABASES]
+    result = []
+    for database in sorted(databases):
+        for collection in sorted(client[database].list_collection_names(filter={'type': 'collection'})):
+            if not collection.startswith('system.'):
+                result.append((database, collection))
+    return result
+
+
+def backup(client, backup_root: str, databases: list = None, full: bool = False, max_workers: int = 4,
+           chunk_size: int = CHUNK_SIZE, quiet: bool = True) -> dict:
+    """ back up databases while the server is running.
+
+    :param client: a connected ``MongoClient``.
+    :param backup_root: directory holding all backups. created if needed.
+    :param databases: databases to back up. By default, all except ``SYSTEM_DATABASES``.
+    :param full: take a full backup, even if there are backups already under ``backup_root``.
+    :param max_workers: number of collections dumped concurrently, and number of chunks compressed concurrently.
+    :param chunk_size: size of chunks (before compression) in bytes.
+    :param quiet: don't print progress.
+    :return: manifest of the backup, whose ``name`` is the name of the directory of the backup under ``backup_root``.
+    """
+    start_time = datetime.datetime.now(datetime.timezone.utc)
+    wall_start = time.monotonic()
+    name = get_backup_name(start_time)
+    backups = list_backups(backup_root)
+    assert name not in backups, 'backup {} exists already'.format(name)
+    parent = None if full or not backups else backups[-1]
+    parent_collections = {} if parent is None else load_manifest(backup_root, parent)['collections']
+
+    # written under a temp name, and renamed when it's complete.
+    partial_dir = os.path.join(backup_root, '.' + name + '.partial')
+    os.makedirs(partial_dir)
+    try:
+        collections = list_collections(client, databases)
+        slots = threading.BoundedSemaphore(2 * max_workers)
+
+        def backup_one(database, collection, compress_executor):
+            collection_key = '{}.{}'.format(database, collection)
+            parent_ids = (_load_ids(backup_root, parent, collection_key) if collection_key in parent_collections
+                          else None)
+            return _backup_collection(client[database][collection], os.path.join(partial_dir, database, collection),
+                                      parent_ids, compress_executor, slots, chunk_size)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as compress_executor, \
+                ThreadPoolExecutor(max_workers=max_workers) as collection_executor:
+            futures = [collection_executor.submit(backup_one, database, collection, compress_executor)
+                       for database, collection in collections]
+            # wait for all of them, then raise the first error if any.
+            for future in futures:
+                future.exception()
+            entries = [future.result() for future in futures]
+        manifest = {'version': _MANIFEST_VERSION, 'name': name, 'checkpoint': _format_time(start_time),
+                    'parent': parent, 'wall_time': time.monotonic() - wall_start,
+                    'collections': {'{}.{}'.format(*x): entry for x, entry in zip(collections, entries)}}
+        with open(os.path.join(partial_dir, _MANIFEST_NAME), 'wt', encoding='utf-8') as f:
+            # keys are not sorted, as order matters in BSON documents such as keys of compound indexes.
+            f.write(json.dumps(manifest, indent=2))
+        os.rename(partial_dir, os.path.join(backup_root, name))
+    except BaseException:
+        # left chunks would never be removed, as list_backups ignores partial backups.
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        raise
+    if not quiet:
+        print(format_summary(manifest))
+    return manifest
+
+
+def format_summary(manifest: dict) -> str:
+    """ a summary of a backup, with one line for each collection. """
+    lines = ['backup {} ({}), checkpoint {}, {:.1f} seconds'.format(
+        manifest['name'], 'full' if manifest['parent'] is None else 'incremental over ' + manifest['parent'],
+        manifest['checkpoint'], manifest['wall_time'])]
+    for key, entry in sorted(manifest['collections'].items()):
+        lines.append('  {}: {} {} documents of {}, {} bytes, {} compressed'.format(
+            key, entry['mode'], entry['count'], entry['num_ids'], sum(x['bytes'] for x in entry['chunks']),
+            sum(x['compressed_bytes'] for x in entry['chunks'])))
+    return '\n'.join(lines)
+
+
+def get_chain(backup_root: str, name: str, collection_key: str) -> list:
+    """ backups needed to restore a collection to the point of a backup.
+
+    :param backup_root: directory holding all backups.
+    :param name: name of the backup.
+    :param collection_key: ``database.collection``.
+    :return: a list of manifests, from the backup ``name`` back to the one with the full dump of the collection.
+    """
+    chain = []
+    while True:
+        manifest = load_manifest(backup_root, name)
+        assert collection_key in manifest['collections'], '{} is not in backup {}'.format(collection_key, name)
+        chain.append(manifest)
+        if manifest['collections'][collection_key]['mode'] == 'full':
+            return chain
+        assert manifest['parent'] is not None
+        name = manifest['parent']
+
+
+def get_collection_dir(backup_root: str, name: str, collection_key: str) -> str:
+    database, collection = collection_key.split('.', 1)
+    return os.path.join(backup_root, name, database, collection)
+
+
+def iter_documents(backup_root: str, name: str, collection_key: str):
+    """ documents of a collection at the point of a backup, going back along its chain of backups.
+
+    :param backup_root: directory holding all backups.
+    :param name: name of the backup.
+    :param collection_key: ``database.collection``.
+    :return: a generator of documents as raw BSON, each once.
+    """
+    chain = get_chain(backup_root, name, collection_key)
+    # encoded ``{'_id': ...}`` of documents at that point, not yet found.
+    wanted = _load_ids(backup_root, name, collection_key)
+    # newer dumps first, as they have newer versions of documents.
+    for manifest in chain:
+        collection_dir = get_collection_dir(backup_root, manifest['name'], collection_key)
+        for chunk in manifest['collections'][collection_key]['chunks']:
+            for raw in iter_raw_documents(read_chunk(collection_dir, chunk)):
+                key = _get_id_key(raw)
+                if key in wanted:
+                    wanted.remove(key)
+                    yield raw
+    assert not wanted, '{} documents of {} are not found in backup {} and its parents'.format(
+        len(wanted), collection_key, name)
+
+
+def _load_collection(client, backup_root: str, name: str, collection_key: str, entry: dict, drop: bool,
+                     executor, slots, batch_size: int) -> int:
+    """ create a collection with its options, and insert its documents at the point of a backup, without indexes.
+
+    :param entry: entry of the collection in the manifest of the backup.
+    :param executor: where batches are inserted, so that reading chunks and inserting overlap.
+    :return: number of documents inserted.
+    """
+    from bson.raw_bson import RawBSONDocument
+    database, collection_name = collection_key.split('.', 1)
+    if drop:
+        client[database].drop_collection(collection_name)
+    assert collection_name not in client[database].list_collection_names(), \
+        '{} exists already, drop it first'.format(collection_key)
+    collection = client[database].create_collection(collection_name, **from_json(entry['options']))
+    futures = []
+
+    def insert(batch):
+        slots.acquire()
+        # documents go to the server as they are, and ``_id`` index is the only one to update.
+        future = executor.submit(collection.insert_many, batch, ordered=False, bypass_document_validation=True)
+        future.add_done_callback(lambda _: slots.release())
+        futures.append(future)
+
+    batch = []
+    count = 0
+    for raw in iter_documents(backup_root, name, collection_key):
+        batch.append(RawBSONDocument(raw))
+        count += 1
+        if len(batch) >= batch_size:
+            insert(batch)
+            batch = []
+    if batch:
+        insert(batch)
+    # wait for all of them, then raise the first error if any.
+    for future in futures:
+        future.exception()
+    for future in futures:
+        future.result()
+    return count
+
+
+def _create_indexes(client, collection_key: str, entry: dict) -> int:
+    """ build all indexes of a collection (except that of ``_id``) recorded in a backup, in one command.
+
+    :return: number of indexes built.
+    """
+    from bson.son import SON
+    database, collection_name = collection_key.split('.', 1)
+    # ``v`` (version) and ``ns`` are chosen by the server.
+    specs = [SON((k, v) for k, v in spec.items() if k not in ('v', 'ns')) for spec in from_json(entry['indexes'])
+             if spec['name'] != '_id_']
+    if specs:
+        # the server builds indexes of one command in a single scan of the collection.
+        client[database].command('createIndexes', collection_name, indexes=specs)
+    return len(specs)
+
+
+def restore(client, backup_root: str, name: str = None, collections: list = None, drop: bool = False,
+            max_workers: int = 4, batch_size: int = _BATCH_SIZE, quiet: bool = True) -> dict:
+    """ restore collections to the point of a backup, while the server is running.
+
+    collections are loaded in parallel, and inserts of each collection are run in parallel as well. Indexes are
+    built after all documents are loaded, as building them once is much faster than updating them on every insert,
+    and then collections are indexed in parallel.
+
+    :param client: a connected ``MongoClient``.
+    :param backup_root: directory holding all backups.
+    :param name: name of the backup. By default, the latest.
+    :param collections: ``database.collection`` to restore. By default, all in the backup.
+    :param drop: drop collections that exist already. Otherwise, they must not exist.
+    :param max_workers: number of collections loaded concurrently, and number of concurrent inserts.
+    :param batch_size: number of documents in each insert.
+    :param quiet: don't print progress.
+    :return: a dict with ``name`` of the backup, ``load_time`` and ``index_time`` and ``wall_time`` in seconds,
+        and ``collections``, from ``database.collection`` to the ``count`` of documents and ``num_indexes`` built.
+    """
+    wall_start = time.monotonic()
+    if name is None:
+        backups = list_backups(backup_root)
+        assert backups, 'no backup in {}'.format(backup_root)
+        name = backups[-1]
+    manifest = load_manifest(backup_root, name)
+    if collections is None:
+        collections = sorted(manifest['collections'])
+    for collection_key in collections:
+        assert collection_key in manifest['collections'], '{} is not in backup {}'.format(collection_key, name)
+    entries = [manifest['collections'][x] for x in collections]
+
+    slots = threading.BoundedSemaphore(2 * max_workers)
+    with ThreadPoolExecutor(max_workers=max_workers) as insert_executor, \
+            ThreadPoolExecutor(max_workers=max_workers) as collection_executor:
+        futures = [collection_executor.submit(_load_collection, client, backup_root, name, collection_key, entry,
+                                              drop, insert_executor, slots, batch_size)
+                   for collection_key, entry in zip(collections, entries)]
+        for future in futures:
+            future.exception()
+        counts = [future.result() for future in futures]
+    load_time = time.monotonic() - wall_start
+
+    index_start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_create_indexes, client, collection_key, entry)
+                   for collection_key, entry in zip(collections, entries)]
+        for future in futures:
+            future.exception()
+        num_indexes = [future.result() for future in futures]
+    result = {'name': name, 'load_time': load_time, 'index_time': time.monotonic() - index_start,
+              'wall_time': time.monotonic() - wall_start,
+              'collections': {x: {'count': count, 'num_indexes': n} for x, count, n in
+                              zip(collections, counts, num_indexes)}}
+    if not quiet:
+        print(format_restore_summary(result))
+    return result
+
+
+def format_restore_summary(result: dict) -> str:
+    """ a summary of what :func:`restore` did, with one line for each collection. """
+    lines = ['restored backup {}, {:.1f} seconds ({:.1f} loading, {:.1f} indexing)'.format(
+        result['name'], result['wall_time'], result['load_time'], result['index_time'])]
+    for key, entry in sorted(result['collections'].items()):
+        lines.append('  {}: {} documents, {} indexes'.format(key, entry['count'], entry['num_indexes']))
+    return '\n'.join(lines)
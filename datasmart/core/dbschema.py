@@ -1,8 +1,6 @@
 import json
 from abc import ABC, abstractmethod
 
-from jsonschema import Draft4Validator
-
 import datasmart.core.util.config
 from . import schemautil
 
@@ -22,6 +20,7 @@ class DBSchema(ABC):
         assert self.schema_path is not DBSchema.schema_path
         # validate the schema
         # if fail, will raise Error.
+        from jsonschema import Draft4Validator
         Draft4Validator.check_schema(self.get_schema())
         self.config = config
 
@@ -3,15 +3,34 @@ The module for file transfer in DataSmart
 
 """
 
+import collections
+import collections.abc
+import heapq
+import itertools
 import os
+import random
 import shlex
+import shutil
+import stat
 import subprocess
+import sys
+import tarfile
 import tempfile
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 import jsl
 from datasmart.core.util.path import (normalize_site, normalize_site_mapping,
                                       get_rsync_filelist, get_site_mapping, reformat_subdirs, joinpath_norm,
                                       normalize_filelist_relative)
 from datasmart.core.util.func import replace_none_args
+from datasmart.core.util.io import get_file_sha1
+import datasmart.core.util.bandwidth
+import datasmart.core.util.compression
+import datasmart.core.util.config
+import datasmart.core.util.fetchcache
+import datasmart.core.util.localcopy
+import datasmart.core.util.ssh
 from . import global_config
 from . import schemautil
 from .base import Base
@@ -26,16 +45,101 @@ class _SiteMappingSchema(jsl.Document):
     _to = jsl.DocumentField(schemautil.filetransfer.FileTransferSiteLocal, name='to', required=True)
 
 
+# when to compress data in transfer with remote sites.
+# ``auto`` compresses only compressible files, by extension, and by sampling their content when pushing.
+_COMPRESS_POLICIES = ["auto", "always", "never"]
+# how files go from this site to another remote site in ``FileTransfer.relay``, see there.
+_RELAY_MODES = ["tar", "rsync"]
+
+
 class _RemoteSiteConfigSchema(jsl.Document):
     """ schema for remote site mapping. should contain ssh username and ssh port.
     """
     ssh_username = jsl.StringField(required=True)
     # valid port is 1-65535, 0 usually meaning random port.
     ssh_port = jsl.IntField(required=True, minimum=1, maximum=65535)
+    # whether to keep a persistent, multiplexed ssh master connection to this site. default true.
+    ssh_multiplex = jsl.BooleanField()
+    # how long (in seconds) the master connection stays after last use. default 600.
+    ssh_control_persist = jsl.IntField(minimum=0)
+    # how many rsync processes to run concurrently for one transfer to / from this site. default 1.
+    rsync_parallel = jsl.IntField(minimum=1)
+    # whether to deduplicate pushed files through a content-addressed store on this site. default false.
+    content_store = jsl.BooleanField()
+    # how many pushes to this site can run at the same time in a ``TransferQueue``. default 2.
+    transfer_concurrency = jsl.IntField(minimum=1)
+    # when to compress data in transfer to / from this site, see ``_COMPRESS_POLICIES``. default auto.
+    compress = jsl.StringField(enum=_COMPRESS_POLICIES)
+    # compression level for rsync. default is rsync's default.
+    compress_level = jsl.IntField(minimum=1, maximum=9)
+    # bandwidth budget (KiB/s) shared by all transfers with this site on this host. default unlimited.
+    bwlimit = jsl.IntField(minimum=1)
+    # how to relay files from this site to another remote site, see ``_RELAY_MODES``. default tar.
+    relay = jsl.StringField(enum=_RELAY_MODES)
+    # files smaller than this (in bytes) are bundled into tar streams in transfer with this site. default no bundling.
+    bundle_threshold = jsl.IntField(minimum=1)
+    # how many bytes of small files go into one tar stream. default ``_BUNDLE_CHUNK_SIZE``.
+    bundle_chunk_size = jsl.IntField(minimum=1)
+    # how many times rsync may run for the same files in transfer with this site, if it fails midway. default 3.
+    retry_attempts = jsl.IntField(minimum=1)
+    # delay (in seconds) before the first retry, doubled for each later one, with jitter. default 1.
+    retry_backoff = jsl.NumberField(minimum=0)
 
 
 # what options are available for ``local_fetch_option``.
 _LOCAL_FETCH_OPTIONS = ["copy", "nocopy", "ask"]
+# what engines are available for transfer between two local sites, see ``local_engine``.
+_LOCAL_ENGINES = ["native", "rsync"]
+
+# rsync prints one line in this format for each transferred item: itemized changes, bytes transferred, and name.
+# names go last, since they can have spaces.
+_RSYNC_STAT_PREFIX = 'DSSTAT '
+_RSYNC_OUT_FORMAT = _RSYNC_STAT_PREFIX + '%i %b %n'
+# rsync exit codes worth retrying: errors in socket or file I/O, in the protocol data stream (usually a dropped link),
+# timeouts, and ssh failures (255). Others, such as syntax errors or missing files, fail the same way every time.
+_RSYNC_RETRYABLE_EXIT_CODES = frozenset((10, 11, 12, 30, 35, 255))
+# partial files are kept in this dir (under the dest dir of each file) by failed rsync, and resumed by the next one.
+_RSYNC_PARTIAL_DIR = '.rsync-partial'
+# max delay (in seconds) before retrying rsync.
+_RETRY_MAX_BACKOFF = 60.0
+# errors of tar streams worth retrying, besides exit codes above of both ends: a stream cut short, or a closed pipe.
+_TAR_RETRYABLE_ERRORS = (tarfile.ReadError, EOFError, ConnectionError)
+
+# remove directories read from stdin, one per line, and print 0 (removed) or 1 (failed) for each one.
+_REMOVE_DIRS_SCRIPT = 'while IFS= read -r d; do if rm -rf -- "$d"; then echo 0; else echo 1; fi; done'
+
+# name of the content-addressed store under the root of a site, and a grace period (minutes) before GC can remove
+# unreferenced content, which prevents removing content that is uploaded but not yet linked by a concurrent push.
+_CONTENT_STORE_NAME = '_content_store_'
+_CONTENT_STORE_GC_GRACE = 60
+
+# default budget (MiB) of the fetch cache, see ``fetch_cache_dir``.
+_FETCH_CACHE_SIZE = 10240
+
+# default size (bytes) of each tar chunk of small files, see ``bundle_threshold`` in remote site config.
+_BUNDLE_CHUNK_SIZE = 64 * 1024 * 1024
+
+# check paths read from stdin, and print 1 (regular file exists) or 0 for each one.
+_CHECK_FILES_SCRIPT = 'while IFS= read -r p; do if [ -f "$p" ]; then echo 1; else echo 0; fi; done'
+# read pairs of lines (store, dest), make store read-only, and hard link it to dest, creating dirs if needed.
+_LINK_FILES_SCRIPT = ('while IFS= read -r s && IFS= read -r d; do '
+                      'chmod a-w -- "$s" && mkdir -p -- "$(dirname -- "$d")" && ln -f -- "$s" "$d" || exit 1; done')
+
+# for each path read from stdin, print its size and mtime if it's a regular file (following symlinks), or ``-``.
+# GNU stat first, then BSD stat.
+_STAT_FILES_SCRIPT = ('while IFS= read -r p; do if [ -f "$p" ]; then '
+                      'stat -L -c "%s %Y" -- "$p" 2>/dev/null || stat -L -f "%z %m" -- "$p" || echo -; '
+                      'else echo -; fi; done')
+
+# results of ``FileTransfer.stat``, keyed by ``(host or None for local, root of site, path)``.
+# cleared whenever files may have changed through push or removal.
+_stat_cache = {}
+
+# normalized configs loaded from disk, keyed by ``(project_root, config_path)``.
+# ``normalize_config`` validates the config twice and touches the file system, so we only do it once per key,
+# and share the (read-only) result among all ``FileTransfer`` instances. Call ``FileTransfer.invalidate_config``
+# after changing config files on disk.
+_normalized_config_registry = {}
 
 
 class FileTransferConfigSchema(jsl.Document):
@@ -56,18 +160,63 @@ class FileTransferConfigSchema(jsl.Document):
     # this stuff provides a default on whether copy or not for local fetch.
     local_fetch_option = jsl.StringField(enum=_LOCAL_FETCH_OPTIONS, required=True)
 
+    # how to transfer between two local sites. default native.
+    local_engine = jsl.StringField(enum=_LOCAL_ENGINES)
+    # whether local fetch creates hard links instead of copies, with native engine. default false.
+    local_fetch_hardlink = jsl.BooleanField()
+    # how many files are copied concurrently by native engine. default 4.
+    local_workers = jsl.IntField(minimum=1)
+    # how many pushes can be submitted to a ``TransferQueue`` and not finished yet. default 4.
+    transfer_queue_size = jsl.IntField(minimum=1)
+    # bandwidth budget (KiB/s) shared by all native transfers between local sites on this host. default unlimited.
+    local_bwlimit = jsl.IntField(minimum=1)
+    # directory of the cache of files fetched from remote sites, shared by all fetches on this host. default no cache.
+    fetch_cache_dir = jsl.StringField(pattern=schemautil.StringPatterns.absOrRelativePathPattern)
+    # budget of the fetch cache, in MiB. default ``_FETCH_CACHE_SIZE``.
+    fetch_cache_size = jsl.IntField(minimum=1)
+    # how many fetches can run at the same time for a ``LazyFetch``. default 4.
+    lazy_fetch_workers = jsl.IntField(minimum=1)
+
 
 class FileTransfer(Base):
     """ class for file transfer.
 
-    Currently, file transfer is handled via ``rsync``.
+    Currently, file transfer is handled via ``rsync``, or natively between two local sites.
     """
 
     config_path = ('core', 'filetransfer')
 
     def __init__(self, config=None) -> None:
+        if config is None:
+            config = self.__class__.get_normalized_config()
         super().__init__(config)
 
+    @classmethod
+    def get_normalized_config(cls) -> dict:
+        """ get the normalized config from disk, going through the registry of normalized configs.
+
+        only the first call for each project root actually loads and normalizes the config; later calls are O(1).
+        The returned config is shared, so don't modify it in place.
+
+        :return: validated and normalized config dictionary.
+        """
+        key = (global_config['project_root'], cls.config_path)
+        if key not in _normalized_config_registry:
+            _normalized_config_registry[key] = cls.normalize_config(
+                datasmart.core.util.config.load_config(cls.config_path))
+        return _normalized_config_registry[key]
+
+    @staticmethod
+    def invalidate_config(project_root: str = None) -> None:
+        """ drop normalized configs from the registry, so that they will be loaded again on next construction.
+
+        :param project_root: only drop configs for this project root. By default, drop all of them.
+        :return: None
+        """
+        for key in list(_normalized_config_registry):
+            if project_root is None or key[0] == project_root:
+                del _normalized_config_registry[key]
+
     @staticmethod
     def normalize_config(config: dict) -> dict:
         """ normalize and validate paths in config.
@@ -88,6 +237,8 @@ class FileTransfer(Base):
         # create local dir
         if not os.path.exists(config['local_data_dir']):
             os.makedirs(config['local_data_dir'], exist_ok=True)
+        if 'fetch_cache_dir' in config:
+            config['fetch_cache_dir'] = joinpath_norm(global_config['project_root'], config['fetch_cache_dir'])
 
         # normalize site mapping.
         config['site_mapping_push'] = normalize_site_mapping(config['site_mapping_push'])
@@ -116,29 +267,68 @@ class FileTransfer(Base):
         :param site: a site with 'append_prefix'. I won't do checking on this one, since it should be normalized.
         :return: None if everything is fine; otherwise throw Exception.
         """
-        assert schemautil.validate(schemautil.filetransfer.FileTransferSiteAuto.get_schema(), site)
-        append_prefix = site['append_prefix']
-        # remove is conceptually a push. so use mapping for push.
-        site = normalize_site(site)
-        site_mapped = self._site_mapping_push(site)
+        failed_sites = self.remove_dirs([site])
+        if failed_sites:
+            raise RuntimeError("failed to remove {}".format(failed_sites[0]))
 
-        if site_mapped['local']:
-            rm_site_spec = joinpath_norm(site_mapped['path'], append_prefix)
-            full_command = ['rm', '-rf', rm_site_spec]
-        else:
-            rm_site_spec_remote = joinpath_norm(site_mapped['prefix'], append_prefix)
+    def remove_dirs(self, sites: list) -> list:
+        """ remove many automatically generated directories by push, in batch.
 
-            site_info = self.config['remote_site_config'][site_mapped['path']]
+        sites are grouped by their actual sites after push mapping. For each remote host, only one ssh command is
+        issued for all its directories, and different hosts are worked on concurrently.
 
-            rm_command = " ".join(['rm', '-rf', shlex.quote(rm_site_spec_remote)])
-            full_command = ['ssh', site_info['ssh_username'] + '@' + site_mapped['path'],
-                            '-p', str(site_info['ssh_port']), rm_command]
-        if not self.config['quiet']:
-            print(" ".join(full_command))
-            stdout_arg = None
+        :param sites: a list of sites with 'append_prefix'. the ``append_prefix`` must stay inside the site,
+            and it can't be ``.`` (that would remove everything under the site).
+        :return: a list of sites (in the order of ``sites``) whose directories failed to be removed.
+            empty if everything is fine.
+        """
+        FileTransfer.invalidate_stat_cache()
+        # actual host (None for local) -> list of (index in sites, directory to remove)
+        dirs_by_host = collections.OrderedDict()
+        for idx, site in enumerate(sites):
+            assert schemautil.validate(schemautil.filetransfer.FileTransferSiteAuto.get_schema(), site)
+            append_prefix = FileTransfer._check_append_prefix(site['append_prefix'])
+            assert append_prefix != joinpath_norm(''), "can't remove the whole site {}!".format(site)
+            # remove is conceptually a push. so use mapping for push.
+            site_mapped = self._site_mapping_push(normalize_site(site))
+            if site_mapped['local']:
+                dirs_by_host.setdefault(None, []).append((idx, joinpath_norm(site_mapped['path'], append_prefix)))
+            else:
+                dirs_by_host.setdefault(site_mapped['path'], []).append(
+                    (idx, joinpath_norm(site_mapped['prefix'], append_prefix)))
+
+        failed_idx = set()
+        with ThreadPoolExecutor(max_workers=max(len(dirs_by_host), 1)) as executor:
+            futures = [(dirs_this, executor.submit(self._remove_dirs_one_host, host, [d for _, d in dirs_this]))
+                       for host, dirs_this in dirs_by_host.items()]
+            for dirs_this, future in futures:
+                for (idx, _), removed in zip(dirs_this, future.result()):
+                    if not removed:
+                        failed_idx.add(idx)
+        return [sites[idx] for idx in sorted(failed_idx)]
+
+    def _remove_dirs_one_host(self, host, dirs: list) -> list:
+        """ remove directories on one host with one command.
+
+        directories are passed through stdin, one per line, so there's no quoting issue, nor limit on their number.
+
+        :param host: remote host, or None for local.
+        :param dirs: absolute paths of directories on the host.
+        :return: a list of bools, whether each directory is removed.
+        """
+        if host is None:
+            full_command = ['sh', '-c', _REMOVE_DIRS_SCRIPT]
         else:
-            stdout_arg = subprocess.PIPE
-        subprocess.run(full_command, check=True, stdout=stdout_arg)
+            # the login shell on remote side may not be sh.
+            full_command = self._get_ssh_command(host) + ['sh -c ' + shlex.quote(_REMOVE_DIRS_SCRIPT)]
+        if not self.config['quiet']:
+            print(" ".join(full_command) + " <<< " + " ".join(shlex.quote(d) for d in dirs))
+        result = subprocess.run(full_command, input=''.join(d + '\n' for d in dirs).encode(), stdout=subprocess.PIPE)
+        status = result.stdout.decode().split()
+        if result.returncode != 0 or len(status) != len(dirs):
+            # something went wrong before or in the middle. removal can be safely done again, so report all as failed.
+            return [False] * len(dirs)
+        return [x == '0' for x in status]
 
     @staticmethod
     def _fetch_parse_copy(local_fetch_option):
@@ -191,6 +381,7 @@ class FileTransfer(Base):
         :return: throw Exception if anything wrong happens;
             otherwise a dict containing src, dest sites, filelist, and actual src and dest sites for dest.
             For fetch, actual src can be different from src due to mapping, and dest and actual dest are the same.
+            It also has ``stats`` of the transfer, see :func:`FileTransfer._make_transfer_stats`.
         """
         src_site, subdirs, local_fetch_option, strip_prefix = self._process_default_pars_fetch(src_site, subdirs,
                                                                                                local_fetch_option,
@@ -215,29 +406,194 @@ class FileTransfer(Base):
 
         if copy_flag:
             dest_site = normalize_site({"path": savepath, "local": True})
-            ret_filelist = self._transfer(src_actual_site, dest_site,
-                                          filelist, {"relative": relative, 'dryrun': dryrun,
-                                                     'strip_prefix': strip_prefix})
+            transfer_options = {"relative": relative, 'dryrun': dryrun, 'strip_prefix': strip_prefix,
+                                # the user is usually waiting for fetched files.
+                                'priority': 'interactive',
+                                'hardlink': self.config.get('local_fetch_hardlink', False)}
+            if self._use_fetch_cache(src_actual_site) and not dryrun:
+                ret_filelist, stats = self._fetch_cached(src_actual_site, dest_site, filelist, transfer_options)
+            else:
+                ret_filelist, stats = self._transfer(src_actual_site, dest_site, filelist, transfer_options)
         else:
             dest_site = src_actual_site
             # use actual filelist, since there's no fetch.
             ret_filelist = filelist
+            stats = FileTransfer._make_transfer_stats(ret_filelist, [None] * len(ret_filelist), 0, 0.0)
 
         return {'src': src_site, 'dest': dest_site, 'filelist': ret_filelist,
-                'src_actual': src_actual_site, 'dest_actual': dest_site}
+                'src_actual': src_actual_site, 'dest_actual': dest_site, 'stats': stats}
+
+    def _use_fetch_cache(self, src_site: dict) -> bool:
+        """ whether fetching from this actual site goes through the fetch cache. """
+        return (not src_site['local']) and self.config.get('fetch_cache_dir') is not None
+
+    def _fetch_cached(self, src: dict, dest: dict, filelist: list, options: dict) -> tuple:
+        """ fetch files through the fetch cache, see :mod:`datasmart.core.util.fetchcache`.
+
+        files are checked on the remote site first (one ssh command). cached ones are served locally, hard linked
+        with ``local_fetch_hardlink`` and copied otherwise, and the rest are fetched into the cache in one transfer.
+
+        :param src: actual remote source site.
+        :param dest: local destination site.
+        :param filelist: normalized filelist.
+        :param options: same as ``_transfer``.
+        :return: the canonical filelist, and stats of the transfer, same as ``_transfer``.
+            files served from the cache are reported as skipped.
+        """
+        start_time = time.monotonic()
+        options = self._process_default_pars_transfer(options, src, dest)
+        _, rsync_filelist_to = get_rsync_filelist(filelist, options)
+        ret_filelist = normalize_filelist_relative(rsync_filelist_to, prefix=options['dest_append_prefix'])
+        dest_files = [joinpath_norm(dest['path'], p) for p in ret_filelist]
+        checked = self._stat_remote(src, filelist)
+        missing = [p for p, size_mtime in zip(filelist, checked) if size_mtime is None]
+        assert not missing, "files {} must exist!".format(missing)
+        keys = [datasmart.core.util.fetchcache.get_key(src['path'], src['prefix'], p, *size_mtime)
+                for p, size_mtime in zip(filelist, checked)]
+
+        cache = datasmart.core.util.fetchcache.FetchCache(
+            self.config['fetch_cache_dir'], self.config.get('fetch_cache_size', _FETCH_CACHE_SIZE) * 1024 * 1024)
+        hits = cache.checkout(list(zip(keys, dest_files)), hardlink=options['hardlink'])
+        misses = [idx for idx, hit in enumerate(hits) if not hit]
+        bytes_list = [None] * len(filelist)
+        attempts_list = [1] * len(filelist)
+        wire_bytes = literal_bytes = retries = 0
+        if misses:
+            staging_dir = cache.make_staging_dir()
+            try:
+                staging_site = normalize_site({'path': staging_dir, 'local': True})
+                _, stats_misses = self._transfer(src, staging_site, [filelist[idx] for idx in misses],
+                                                 {'relative': True, 'dryrun': False,
+                                                  'priority': options['priority']})
+                staged_files = [joinpath_norm(staging_dir, filelist[idx]) for idx in misses]
+                datasmart.core.util.localcopy.copy_files([(p, dest_files[idx]) for p, idx in zip(staged_files, misses)],
+                                                         hardlink=options['hardlink'],
+                                                         workers=self.config.get('local_workers', 4))
+                for idx, file_stats in zip(misses, stats_misses['files']):
+                    bytes_list[idx] = file_stats['bytes']
+                    attempts_list[idx] = file_stats['attempts']
+                wire_bytes, literal_bytes = stats_misses['wire_bytes'], stats_misses['literal_bytes']
+                retries = stats_misses['retries']
+                # only cache files not changed on the remote site since they were checked.
+                to_add = []
+                for p, idx in zip(staged_files, misses):
+                    stat_result = os.stat(p)
+                    if (stat_result.st_size, int(stat_result.st_mtime)) == checked[idx]:
+                        to_add.append((keys[idx], p))
+                cache.add(to_add)
+            finally:
+                shutil.rmtree(staging_dir)
+        return ret_filelist, FileTransfer._make_transfer_stats(ret_filelist, bytes_list, wire_bytes,
+                                                               time.monotonic() - start_time,
+                                                               literal_bytes=literal_bytes,
+                                                               attempts_list=attempts_list, retries=retries)
+
+    @staticmethod
+    def get_fetch_cache_stats() -> dict:
+        """ hits and misses of the fetch cache, see :func:`datasmart.core.util.fetchcache.get_stats`.
+        """
+        return datasmart.core.util.fetchcache.get_stats()
+
+    def fetch_lazy(self, filelist: list, src_site: dict = None, **kwargs) -> 'LazyFetch':
+        """ like :func:`FileTransfer.fetch`, but files are fetched on demand, see :class:`LazyFetch`.
+
+        :param filelist: see :func:`FileTransfer.fetch`.
+        :param src_site: see :func:`FileTransfer.fetch`.
+        :param kwargs: other arguments of :class:`LazyFetch`.
+        :return: a :class:`LazyFetch`, mapping canonical paths to file handles.
+        """
+        return LazyFetch(filelist, filetransfer=self, src_site=src_site, **kwargs)
+
+    def stat(self, filelist: list, site: dict = None, use_cache: bool = True) -> list:
+        """ check existence, size and modification time of files on a site, without transferring anything.
+
+        fetch mapping is applied to the site, as files are checked typically before fetching them. For a remote site,
+        only one ssh command is run for the whole filelist; for a local one, files are checked in process.
+
+        :param filelist: a list of files on the site, as for fetch.
+        :param site: the site. default is ``_config['default_site']``.
+        :param use_cache: whether to reuse results of earlier calls. the cache is cleared by any push or removal
+            through :class:`FileTransfer`, but not by changes made by others.
+        :return: a list of dicts, one for each file in filelist, with ``path`` (normalized), ``exists`` (whether it's
+            a regular file, following symlinks), and ``size`` and ``mtime`` (in seconds, integral for remote sites),
+            which are None if it doesn't exist.
+        """
+        if site is None:
+            site = self.config['default_site']
+        filelist = normalize_filelist_relative(filelist)
+        site_actual = self._site_mapping_fetch(normalize_site(site))
+        if site_actual['local']:
+            cache_site = (None, site_actual['path'])
+        else:
+            cache_site = (site_actual['path'], site_actual['prefix'])
+
+        results = {}
+        if use_cache:
+            for p in filelist:
+                if cache_site + (p,) in _stat_cache:
+                    results[p] = _stat_cache[cache_site + (p,)]
+        to_check = sorted(set(filelist) - set(results))
+        if to_check:
+            if site_actual['local']:
+                checked = [FileTransfer._stat_local(joinpath_norm(site_actual['path'], p)) for p in to_check]
+            else:
+                checked = self._stat_remote(site_actual, to_check)
+            for p, size_mtime in zip(to_check, checked):
+                results[p] = size_mtime
+                _stat_cache[cache_site + (p,)] = size_mtime
+
+        return [{'path': p, 'exists': results[p] is not None,
+                 'size': results[p][0] if results[p] is not None else None,
+                 'mtime': results[p][1] if results[p] is not None else None} for p in filelist]
+
+    @staticmethod
+    def _stat_local(path: str):
+        """ size and mtime of a regular file, or None if it's not there. """
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(stat_result.st_mode):
+            return None
+        return stat_result.st_size, stat_result.st_mtime
+
+    def _stat_remote(self, site: dict, filelist: list) -> list:
+        """ size and mtime of regular files on a remote site, or None for those not there, with one ssh command.
+
+        :param site: an actual (mapped) remote site.
+        :param filelist: normalized paths relative to the site.
+        """
+        result = self._run_site_script(site, _STAT_FILES_SCRIPT, filelist)
+        lines = result.stdout.decode().splitlines()
+        assert result.returncode == 0 and len(lines) == len(filelist), "failed to stat files on {}!".format(site)
+        return [None if line.strip() == '-' else tuple(int(x) for x in line.split()) for line in lines]
+
+    @staticmethod
+    def invalidate_stat_cache() -> None:
+        """ drop all cached results of :func:`FileTransfer.stat`. """
+        _stat_cache.clear()
 
     def _process_default_pars_push(self, dest_site, subdirs, dest_append_prefix):
         dest_site, subdirs, dest_append_prefix = replace_none_args([dest_site, subdirs, dest_append_prefix],
                                                                    [self.config['default_site'], [''], ['']])
-        dest_append_prefix = joinpath_norm(*dest_append_prefix)
+        dest_append_prefix = FileTransfer._check_append_prefix(joinpath_norm(*dest_append_prefix))
+        return dest_site, subdirs, dest_append_prefix
+
+    @staticmethod
+    def _check_append_prefix(append_prefix: str) -> str:
+        """ check that an append prefix stays inside the site.
+
+        :param append_prefix: append prefix as a string.
+        :return: normalized append prefix.
+        """
+        append_prefix = joinpath_norm(append_prefix)
         # append prefix must be relative path.
-        assert not (os.path.isabs(dest_append_prefix))
+        assert not (os.path.isabs(append_prefix))
         # it should not go over current level, that is, not start with '..'
         # if it does, then `aaa` should disappear.
-        if dest_append_prefix != joinpath_norm(*['']):  # special case for `.`
-            assert 'aaa' + os.path.sep + dest_append_prefix == joinpath_norm('aaa', dest_append_prefix)
-
-        return dest_site, subdirs, dest_append_prefix
+        if append_prefix != joinpath_norm(*['']):  # special case for `.`
+            assert 'aaa' + os.path.sep + append_prefix == joinpath_norm('aaa', append_prefix)
+        return append_prefix
 
     def push(self, filelist: list, dest_site: dict = None, relative: bool = True, subdirs: list = None,
              dest_append_prefix: list = None, dryrun: bool = False) -> dict:
@@ -257,6 +613,7 @@ class FileTransfer(Base):
         :return: throw Exception if anything wrong happens;
             otherwise a dict containing src, dest sites, filelist, and actual src and dest sites for dest.
             For push, actual dest can be different from dest due to mapping, and src and actual src are the same.
+            It also has ``stats`` of the transfer, see :func:`FileTransfer._make_transfer_stats`.
         """
         dest_site, subdirs, dest_append_prefix = self._process_default_pars_push(dest_site, subdirs, dest_append_prefix)
         # normalize the filelist first.
@@ -274,42 +631,419 @@ class FileTransfer(Base):
         dest_site = normalize_site(dest_site)
         dest_actual_site = self._site_mapping_push(dest_site)
         src_site = normalize_site({"path": savepath, "local": True})
-        ret_filelist = self._transfer(src_site, dest_actual_site,
-                                      filelist, {"relative": relative,
-                                                 "dryrun": dryrun,
-                                                 "dest_append_prefix": dest_append_prefix})
+        transfer_options = {"relative": relative, "dryrun": dryrun, "dest_append_prefix": dest_append_prefix}
+        if not dryrun:
+            FileTransfer.invalidate_stat_cache()
+        if self._use_content_store(dest_site, dest_actual_site) and not dryrun:
+            ret_filelist, stats = self._push_content_addressed(src_site, dest_actual_site, filelist, transfer_options)
+        else:
+            ret_filelist, stats = self._transfer(src_site, dest_actual_site, filelist, transfer_options)
         dest_site['append_prefix'] = dest_append_prefix
         dest_actual_site['append_prefix'] = dest_append_prefix
         return {'src': src_site, 'dest': dest_site, 'filelist': ret_filelist,
-                'src_actual': src_site, 'dest_actual': dest_actual_site}
+                'src_actual': src_site, 'dest_actual': dest_actual_site, 'stats': stats}
+
+    def _use_content_store(self, dest_site: dict, dest_actual_site: dict) -> bool:
+        """ whether pushing to a site goes through a content-addressed store, by ``content_store`` of the actual site,
+        or of the site itself if it's mapped to a local one (which is then a mount of it).
+
+        :param dest_site: the normalized site.
+        :param dest_actual_site: the site after push mapping.
+        """
+        site = dest_site if dest_actual_site['local'] else dest_actual_site
+        return (not site['local']) and self.config['remote_site_config'].get(site['path'], {}).get('content_store',
+                                                                                                   False)
+
+    def _push_content_addressed(self, src: dict, dest: dict, filelist: list, options: dict) -> tuple:
+        """ push files through the content-addressed store ``_content_store_`` under the root of dest.
+
+        files are hashed locally, and only content not yet in the store is transferred (into the store).
+        Then files under ``append_prefix`` are created as hard links to the store, so the layout is exactly the same
+        as a normal push, and :func:`FileTransfer.remove_dir` works as usual. The number of links of a file in the
+        store is its reference count, which is used by :func:`FileTransfer.collect_content_store_garbage`.
+
+        :param src: local source site.
+        :param dest: actual destination site.
+        :param filelist: files to push, relative to src.
+        :param options: options for ``_transfer``, without dry run.
+        :return: the canonical filelist and stats, same as ``_transfer``. Files whose content is already in the store
+            are reported as skipped.
+        """
+        start_time = time.monotonic()
+        options = self._process_default_pars_transfer(options, src, dest)
+        rsync_filelist_from, rsync_filelist_to = get_rsync_filelist(filelist, options)
+        ret_filelist = normalize_filelist_relative(rsync_filelist_to, prefix=options['dest_append_prefix'])
+
+        # ab/cdef... for sha1 abcdef...
+        store_paths = [joinpath_norm(_CONTENT_STORE_NAME, h[:2], h[2:]) for h in
+                       (get_file_sha1(os.path.join(src['path'], p)) for p in rsync_filelist_from)]
+        unique_store_paths = sorted(set(store_paths))
+        result = self._run_site_script(dest, _CHECK_FILES_SCRIPT, unique_store_paths)
+        existing = result.stdout.decode().split()
+        assert result.returncode == 0 and len(existing) == len(unique_store_paths), "can't check content store!"
+        new_content = {p for p, e in zip(unique_store_paths, existing) if e == '0'}
+        if not self.config['quiet']:
+            print("{} of {} files have new content".format(len(new_content), len(unique_store_paths)))
+
+        staged_bytes = {}
+        staged_compressed = {}
+        staged_attempts = {}
+        wire_bytes = literal_bytes = retries = 0
+        if new_content:
+            # stage new content locally under their store paths, by hard links if possible, and transfer them.
+            staging_dir = tempfile.mkdtemp(prefix='.ds_staging_', dir=src['path'])
+            try:
+                staged = set()
+                for p_from, p_store in zip(rsync_filelist_from, store_paths):
+                    if p_store in new_content and p_store not in staged:
+                        staged_path = os.path.join(staging_dir, p_store)
+                        os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+                        try:
+                            os.link(os.path.join(src['path'], p_from), staged_path)
+                        except OSError:
+                            shutil.copy2(os.path.join(src['path'], p_from), staged_path)
+                        staged.add(p_store)
+                staged_filelist, staged_stats = self._transfer(
+                    normalize_site({'path': staging_dir, 'local': True}), dest, sorted(staged),
+                    {'relative': True, 'dryrun': False})
+                staged_bytes = {p: None if stat_this['skipped'] else stat_this['bytes'] for p, stat_this in
+                                zip(staged_filelist, staged_stats['files'])}
+                staged_compressed = {p: stat_this['compressed'] for p, stat_this in
+                                     zip(staged_filelist, staged_stats['files'])}
+                staged_attempts = {p: stat_this['attempts'] for p, stat_this in
+                                   zip(staged_filelist, staged_stats['files'])}
+                wire_bytes = staged_stats['wire_bytes']
+                literal_bytes = staged_stats['literal_bytes']
+                retries = staged_stats['retries']
+            finally:
+                shutil.rmtree(staging_dir)
+
+        # link files into place. content in store is read-only, since it's shared among records.
+        link_input = []
+        for p_store, p_dest in zip(store_paths, ret_filelist):
+            link_input += [p_store, p_dest]
+        result = self._run_site_script(dest, _LINK_FILES_SCRIPT, link_input)
+        assert result.returncode == 0, "failed to link files from content store!"
+
+        # only the first file with some new content is counted as transferred.
+        bytes_list = [staged_bytes.pop(p_store, None) for p_store in store_paths]
+        compressed_list = [staged_compressed.get(p_store, False) for p_store in store_paths]
+        attempts_list = [staged_attempts.get(p_store, 1) for p_store in store_paths]
+        return ret_filelist, FileTransfer._make_transfer_stats(ret_filelist, bytes_list, wire_bytes,
+                                                               time.monotonic() - start_time,
+                                                               literal_bytes=literal_bytes,
+                                                               compressed_list=compressed_list,
+                                                               attempts_list=attempts_list, retries=retries)
+
+    def collect_content_store_garbage(self, site: dict) -> int:
+        """ remove content in the store of a site that is no longer referenced by any pushed file.
+
+        content is unreferenced when it has only one link (the one in the store), and it's older than a grace period,
+        so content just uploaded by a concurrent push is not removed.
+
+        :param site: a site pushed with content store, without ``append_prefix``. push mapping applies.
+        :return: number of files removed.
+        """
+        site_mapped = self._site_mapping_push(normalize_site(site))
+        script = 'if [ -d {0} ]; then find {0} -type f -links 1 -cmin +{1} -print -exec rm -f {{}} +; fi'.format(
+            _CONTENT_STORE_NAME, _CONTENT_STORE_GC_GRACE)
+        result = self._run_site_script(site_mapped, script, [])
+        assert result.returncode == 0, "failed to collect garbage in content store!"
+        return len(result.stdout.decode().splitlines())
+
+    def relay(self, filelist: list, src_site: dict, dest_site: dict, relative: bool = True,
+              dest_append_prefix: list = None, strip_prefix: str = '', dryrun: bool = False,
+              link_dest: str = None) -> dict:
+        """ transfer files between two sites, without staging them on local disk.
+
+        it will copy src_site/{prefix}/filelist{i} to
+        dest_site/{prefix}/{dest_append_prefix}/(filelist{i} if relative else basename(filelist{i})),
+        with ``strip_prefix`` stripped off first in relative mode, as in fetch.
+
+        src_site is mapped with ``site_mapping_fetch``, and dest_site with ``site_mapping_push``. If any actual site
+        is local, this is an ordinary transfer. Otherwise, files go directly between the two remote sites,
+        by the ``relay`` mode of the source site in ``remote_site_config``:
+
+        * ``tar`` (default): a tar stream is piped from an ssh session on the source to one on the destination,
+          passing through memory of this host only. Files are always sent in full.
+        * ``rsync``: rsync runs on the source host, and pushes to the destination host (using username and port
+          of the destination in ``remote_site_config``) by itself, so the source host must be able to ssh into
+          the destination. Up to date files are skipped, and data doesn't pass through this host at all.
+
+        :param filelist: a list of files on the source site.
+        :param src_site: the site to copy from.
+        :param dest_site: the site to copy to.
+        :param relative: copy full directory structure or just last part of each file path,
+            like the same-named option in ``rsync``.
+        :param dest_append_prefix: a list of path components to append to usual dest dir
+            see :ref:`filetransfer-site`.
+        :param strip_prefix: strip off one part of the path for files. must be in relative mode.
+        :param dryrun: whether only perform a dry-run, without actual copying. Default to false.
+        :param link_dest: an absolute local directory laid out like the dest site, such as an earlier snapshot of it.
+            files in it with the same size and modification time as the source are hard linked into the dest site
+            instead of transferred, like ``rsync --link-dest``. The actual dest site must be local.
+        :return: throw Exception if anything wrong happens;
+            otherwise a dict containing src, dest sites, filelist, and actual src and dest sites, like push.
+            dest sites have ``append_prefix``, and the filelist is the canonical one in the same format as push.
+            It also has ``stats`` of the transfer, see :func:`FileTransfer._make_transfer_stats`.
+        """
+        if dest_append_prefix is None:
+            dest_append_prefix = ['']
+        dest_append_prefix = FileTransfer._check_append_prefix(joinpath_norm(*dest_append_prefix))
+        if strip_prefix:
+            strip_prefix = FileTransfer._check_append_prefix(strip_prefix)
+        filelist = normalize_filelist_relative(filelist)
+
+        src_site = normalize_site(src_site)
+        src_actual_site = self._site_mapping_fetch(src_site)
+        dest_site = normalize_site(dest_site)
+        dest_actual_site = self._site_mapping_push(dest_site)
+        transfer_options = {"relative": relative, "dryrun": dryrun, "dest_append_prefix": dest_append_prefix,
+                            "strip_prefix": strip_prefix, "link_dest": link_dest}
+        if not dryrun:
+            FileTransfer.invalidate_stat_cache()
+        if src_actual_site['local'] or dest_actual_site['local']:
+            ret_filelist, stats = self._transfer(src_actual_site, dest_actual_site, filelist, transfer_options)
+        else:
+            ret_filelist, stats = self._relay_remote(src_actual_site, dest_actual_site, filelist, transfer_options)
+        dest_site['append_prefix'] = dest_append_prefix
+        dest_actual_site['append_prefix'] = dest_append_prefix
+        return {'src': src_site, 'dest': dest_site, 'filelist': ret_filelist,
+                'src_actual': src_actual_site, 'dest_actual': dest_actual_site, 'stats': stats}
+
+    def _relay_remote(self, src: dict, dest: dict, filelist: list, options: dict) -> tuple:
+        """ transfer between two remote sites, see :func:`FileTransfer.relay`.
+
+        :param src: actual source site.
+        :param dest: actual destination site.
+        :param filelist:
+        :param options: same as ``_transfer``.
+        :return: the canonical filelist, and stats of the transfer, same as ``_transfer``.
+        """
+        start_time = time.monotonic()
+        options = self._process_default_pars_transfer(options, src, dest)
+        rsync_filelist_from, rsync_filelist_to = get_rsync_filelist(filelist, options)
+        ret_filelist = normalize_filelist_relative(rsync_filelist_to, prefix=options['dest_append_prefix'])
+        if options['dryrun']:
+            # like rsync, fail on missing source files even for dry run.
+            result = self._run_site_script(src, _CHECK_FILES_SCRIPT, [joinpath_norm(p) for p in rsync_filelist_from])
+            lines = result.stdout.decode().splitlines()
+            assert result.returncode == 0 and len(lines) == len(rsync_filelist_from), "failed to check files!"
+            missing = [p for p, line in zip(rsync_filelist_from, lines) if line.strip() != '1']
+            assert not missing, "files {} must exist!".format(missing)
+            return ret_filelist, FileTransfer._make_transfer_stats(ret_filelist, [0] * len(ret_filelist), 0,
+                                                                   time.monotonic() - start_time)
+
+        self._make_dest_dir(dest, options['dest_append_prefix'])
+        lease = self._acquire_bandwidth(src, dest, options)
+        max_attempts, backoff = self._get_retry_policy(src, dest)
+        try:
+            if self.config['remote_site_config'][src['path']].get('relay', 'tar') == 'rsync':
+                relay_stats = self._relay_rsync(src, dest, rsync_filelist_from, rsync_filelist_to, options, lease,
+                                                max_attempts, backoff)
+            else:
+                relay_stats = self._run_tar(src, dest, rsync_filelist_from, rsync_filelist_to, options, lease,
+                                            max_attempts, backoff)
+        finally:
+            if lease is not None:
+                lease.release()
+        return ret_filelist, FileTransfer._make_transfer_stats(ret_filelist,
+                                                               [relay_stats['files'].get(p) for p in rsync_filelist_to],
+                                                               relay_stats['wire_bytes'],
+                                                               time.monotonic() - start_time,
+                                                               literal_bytes=relay_stats['literal_bytes'],
+                                                               attempts_list=[relay_stats['attempts'].get(p, 1) for p
+                                                                              in rsync_filelist_to],
+                                                               retries=relay_stats['retries'])
+
+    def _relay_rsync(self, src: dict, dest: dict, rsync_filelist_from: list, rsync_filelist_to: list, options: dict,
+                     lease, max_attempts: int = 1, backoff: float = 1.0) -> dict:
+        """ run rsync on the source site, pushing to the destination site, retrying as :func:`FileTransfer._run_rsync`.
+
+        :return: stats as :func:`FileTransfer._run_rsync`.
+        """
+        dest_dir = joinpath_norm(dest['prefix'], options['dest_append_prefix']) + os.path.sep
+        rsync_command = ["rsync", "-avP", "--stats", "--out-format=" + _RSYNC_OUT_FORMAT,
+                         "--partial-dir=" + _RSYNC_PARTIAL_DIR,
+                         "--relative" if options['relative'] else "--no-relative", "--files-from=-"]
+        if lease is not None:
+            rsync_command.append(lease.get_bwlimit_arg())
+        if src['path'] == dest['path']:
+            rsync_command += ['./', dest_dir]
+        else:
+            # ssh from the source host, without the master connection of this host.
+            dest_info = self.config['remote_site_config'][dest['path']]
+            rsync_command += ['-e', 'ssh -p {}'.format(dest_info['ssh_port']), './',
+                              dest_info['ssh_username'] + '@' + dest['path'] + ':' + shlex.quote(dest_dir)]
+        full_command, cwd = self._get_site_command(src, ' '.join(shlex.quote(x) for x in rsync_command))
+        # add '/' in front in case we have file names starting with '#' or ';', as in ``_run_rsync_once``.
+        return self._retry_rsync(lambda filelist: self._run_rsync_command(
+            full_command, cwd=cwd, input_lines=(os.sep + p for p in filelist)), rsync_filelist_from,
+            rsync_filelist_to, max_attempts, backoff)
+
+    def _run_tar(self, src: dict, dest: dict, rsync_filelist_from: list, rsync_filelist_to: list, options: dict,
+                 lease, max_attempts: int = 1, backoff: float = 1.0) -> dict:
+        """ send files in a tar stream (see :func:`FileTransfer._relay_tar`), retrying on failures worth retrying
+        with the same backoff as :func:`FileTransfer._run_rsync`: exit codes of both ends in
+        ``_RSYNC_RETRYABLE_EXIT_CODES`` (ssh failures, mostly), or ``_TAR_RETRYABLE_ERRORS``. Files in an interrupted
+        stream may be partly written, so each retry sends all files again.
+
+        :return: stats as :func:`FileTransfer._run_rsync`.
+        """
+        for attempt in itertools.count(1):
+            try:
+                bytes_list = self._relay_tar(src, dest, rsync_filelist_from, rsync_filelist_to, options, lease)
+                break
+            except (subprocess.CalledProcessError,) + _TAR_RETRYABLE_ERRORS as error:
+                if (isinstance(error, subprocess.CalledProcessError) and error.returncode not in
+                        _RSYNC_RETRYABLE_EXIT_CODES) or attempt >= max_attempts:
+                    raise
+                self._wait_retry('tar stream', error, len(rsync_filelist_from), attempt, backoff)
+        return {'files': dict(zip(rsync_filelist_to, bytes_list)), 'wire_bytes': sum(bytes_list),
+                'literal_bytes': sum(bytes_list),
+                'attempts': {p: attempt for p in rsync_filelist_to} if attempt > 1 else {}, 'retries': attempt - 1}
+
+    def _wait_retry(self, what: str, error: Exception, num_files: int, attempt: int, backoff: float) -> None:
+        """ sleep before a retry. The delay before the n-th retry is ``backoff * 2 ** (n - 1)`` (at most
+        ``_RETRY_MAX_BACKOFF``), randomly shortened by up to half, so that concurrent transfers don't retry together.
+        """
+        delay = min(backoff * 2 ** (attempt - 1), _RETRY_MAX_BACKOFF) * random.uniform(0.5, 1.0)
+        if not self.config['quiet']:
+            if isinstance(error, subprocess.CalledProcessError):
+                reason = 'exit code {}'.format(error.returncode)
+            else:
+                reason = repr(error)
+            print("{} failed with {}, retrying {} files in {:.1f} seconds".format(what, reason, num_files, delay))
+        time.sleep(delay)
+
+    def _relay_tar(self, src: dict, dest: dict, rsync_filelist_from: list, rsync_filelist_to: list, options: dict,
+                   lease) -> list:
+        """ pipe a tar stream from the source site to the destination site.
+
+        member names are rewritten on the fly (in memory) from their paths in the source to their paths in the
+        destination, so strip prefix and non-relative mode work as in rsync, with plain ``tar`` on both sides.
+
+        :return: bytes sent for each file.
+        """
+        # './' in front, so that no name is taken as an option by tar.
+        names_from = ['./' + joinpath_norm(p) for p in rsync_filelist_from]
+        index_from = {joinpath_norm(p): idx for idx, p in enumerate(rsync_filelist_from)}
+        # names are separated by NUL, otherwise GNU tar would unquote backslashes in them.
+        src_command, src_cwd = self._get_site_command(src, 'tar --null -cf - -T -')
+        # './' in front, so that an append prefix starting with '-' is not taken as an option by cd.
+        dest_command, dest_cwd = self._get_site_command(
+            dest, ' '.join(shlex.quote(x) for x in ['cd', './' + options['dest_append_prefix']]) + ' && tar -xf -')
+        if not self.config['quiet']:
+            print(" ".join(src_command) + " | " + " ".join(dest_command))
+
+        bytes_list = [None] * len(rsync_filelist_from)
+        with subprocess.Popen(src_command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=src_cwd) as src_process, \
+                subprocess.Popen(dest_command, stdin=subprocess.PIPE, cwd=dest_cwd) as dest_process:
+            feeder = threading.Thread(target=FileTransfer._feed_lines, args=(src_process.stdin, names_from, '\0'))
+            feeder.start()
+            try:
+                with tarfile.open(fileobj=src_process.stdout, mode='r|') as tar_in, \
+                        tarfile.open(fileobj=dest_process.stdin, mode='w|', format=tarfile.PAX_FORMAT) as tar_out:
+                    for member in tar_in:
+                        idx = index_from.get(joinpath_norm(member.name))
+                        assert idx is not None, "unexpected entry {} in tar stream!".format(member.name)
+                        member.name = rsync_filelist_to[idx]
+                        if member.islnk():
+                            # hard links between files in the list.
+                            member.linkname = rsync_filelist_to[index_from[joinpath_norm(member.linkname)]]
+                        if lease is not None:
+                            lease.throttle(member.size)
+                        tar_out.addfile(member, tar_in.extractfile(member) if member.isreg() else None)
+                        bytes_list[idx] = member.size
+            except BaseException:
+                # otherwise, waiting for them may never end.
+                src_process.kill()
+                dest_process.kill()
+                raise
+            finally:
+                feeder.join()
+        for process, command in ((src_process, src_command), (dest_process, dest_command)):
+            if process.returncode != 0:
+                raise subprocess.CalledProcessError(process.returncode, command)
+        assert None not in bytes_list, "some files are not sent!"
+        return bytes_list
+
+    def _run_site_script(self, site: dict, script: str, input_lines: list):
+        """ run a sh script under the root of an actual site (local or remote), feeding lines through stdin.
+
+        :param site: an actual (mapped) site.
+        :param script: sh script.
+        :param input_lines: lines for stdin.
+        :return: the ``CompletedProcess``, with stdout captured. Return code is not checked.
+        """
+        full_command, cwd = self._get_site_command(site, script)
+        if not self.config['quiet']:
+            print(" ".join(full_command))
+        return subprocess.run(full_command, input=''.join(x + '\n' for x in input_lines).encode(),
+                              stdout=subprocess.PIPE, cwd=cwd)
+
+    def _get_site_command(self, site: dict, script: str) -> tuple:
+        """ command to run a sh script under the root of an actual site (local or remote).
+
+        :param site: an actual (mapped) site.
+        :param script: sh script.
+        :return: the command as a list, and the working directory to run it in (None for remote sites).
+        """
+        if site['local']:
+            return ['sh', '-c', script], site['path']
+        # the login shell on remote side may not be sh.
+        return self._get_ssh_command(site['path']) + [
+            ' '.join(shlex.quote(x) for x in ['cd', site['prefix']]) + ' && ' + ' '.join(
+                shlex.quote(x) for x in ['sh', '-c', script])], None
 
     def _process_default_pars_transfer(self, options, src, dest):
         new_options = {
             'dest_append_prefix': '',
             'strip_prefix': '',
+            'hardlink': False,
+            'priority': 'bulk',
+            'link_dest': None,
         }
         new_options.update(options)
+        assert new_options['priority'] in datasmart.core.util.bandwidth.PRIORITIES
 
         if new_options['strip_prefix']:
             assert new_options['relative'], "with non trivial strip prefix, must be in relative mode!"
+        if new_options['link_dest'] is not None:
+            assert dest['local'], "link_dest only works for a local destination!"
+            assert os.path.isabs(new_options['link_dest']), "link_dest must be an absolute path!"
 
-        # one of them must be local.
-        assert src['local'] or dest['local'], 'one of source and dest must be local'
         return new_options
 
-    def _transfer(self, src: dict, dest: dict, filelist: list, options: dict) -> list:
-        """ core function for data transfer. Currently implemented in ``rsync``.
+    def _transfer(self, src: dict, dest: dict, filelist: list, options: dict) -> tuple:
+        """ core function for data transfer. Implemented in ``rsync``, or natively when both sites are local.
+
+        if the remote site has ``bundle_threshold`` in ``remote_site_config``, small files are sent in chunks of tar
+        streams instead, see :func:`FileTransfer._get_bundles`.
+        other files are split into groups with different compression options by the ``compress`` policy of the remote
+        site, see :func:`FileTransfer._get_compression_groups`.
+        if the remote site has ``rsync_parallel`` > 1 in ``remote_site_config``, each group is split into that many
+        shards (balanced by file size when the source is local), and up to that many rsync (or tar streams) are run
+        concurrently.
 
         :param src: source site.
         :param dest: destination site.
         :param filelist:
         :param options:
-        :return: the canonical filelist.
-            this will return the normalized absolute path for remote site, and normalized relative path for local.
+        :return: the canonical filelist, and stats of the transfer (see :func:`FileTransfer._make_transfer_stats`).
+            the filelist is the normalized absolute path for remote site, and normalized relative path for local.
             Basically, ``dest['path'] + return value`` should give absolute path for files.
         """
-
+        start_time = time.monotonic()
         options = self._process_default_pars_transfer(options, src, dest)
+        # one of them must be local. use ``_relay_remote`` otherwise.
+        assert src['local'] or dest['local'], 'one of source and dest must be local'
+        if src['local'] and dest['local'] and self.config.get('local_engine', 'native') == 'native':
+            ret_filelist, bytes_list = self._transfer_local(src, dest, filelist, options)
+            copied_bytes = sum(b for b in bytes_list if b is not None)
+            return ret_filelist, FileTransfer._make_transfer_stats(ret_filelist, bytes_list, copied_bytes,
+                                                                   time.monotonic() - start_time,
+                                                                   literal_bytes=copied_bytes)
         # construct the rsync command.
         # since I use -from-file option in rsync,  by default, it's relative without ``rsync_relative_arg``.
         rsync_relative_arg = "--relative" if options['relative'] else "--no-relative"
@@ -323,40 +1057,528 @@ class FileTransfer(Base):
         # run the actual rsync if not dryrun.
         rsync_dryrun_arg = self._get_rysnc_dryrun_spec(options)
 
-        # create temp file for rsync_filelist_value.
-        with tempfile.NamedTemporaryFile(mode='wt', delete=False) as rsync_filelist_handle:
-            rsync_filelist_path = rsync_filelist_handle.name
-            # add '/' in front in case we have file names starting with '#' or ';'
-            # see http://samba.2283325.n4.nabble.com/comments-with-in-files-from-td2510187.html
-            rsync_filelist_handle.writelines([os.sep + p + '\n' for p in rsync_filelist_from])
+        # get the full rsync command, except for the filelist and compression options.
+        rsync_command = ["rsync", "-avP", "--stats", "--out-format=" + _RSYNC_OUT_FORMAT,
+                         "--partial-dir=" + _RSYNC_PARTIAL_DIR,
+                         rsync_relative_arg] + rsync_dryrun_arg + rsync_ssh_arg + [rsync_src_spec, rsync_dest_spec]
+        if options['link_dest'] is not None:
+            # unchanged files are hard linked to those in it. it's laid out like the dest site.
+            rsync_command[-2:-2] = ['--link-dest=' + joinpath_norm(options['link_dest'],
+                                                                   options['dest_append_prefix'])]
+
+        # one job for each chunk of small files, and one for each shard of each compression group of other files.
+        bundles, rsync_indices = self._get_bundles(src, dest, rsync_filelist_from, rsync_filelist_to, options)
+        jobs = [('tar', bundle) for bundle in bundles]
+        num_worker = max(min(self._get_rsync_parallel(src, dest), len(bundles)), 1)
+        compressed_list = [False] * len(rsync_filelist_from)
+        if rsync_indices:
+            groups = self._get_compression_groups(src, dest, [rsync_filelist_from[i] for i in rsync_indices])
+            # whether each file is compressed is the same in all groups.
+            for idx_this, idx in enumerate(rsync_indices):
+                compressed_list[idx] = groups[0][1][idx_this]
+            for compress_args, _, group in groups:
+                group = [rsync_indices[i] for i in group]
+                shards = self._get_transfer_shards(src, dest, [rsync_filelist_from[i] for i in group])
+                num_worker = max(num_worker, len(shards))
+                for shard in shards:
+                    jobs.append((rsync_command[:2] + compress_args + rsync_command[2:], [group[i] for i in shard]))
+        lease = self._acquire_bandwidth(src, dest, options)
+        max_attempts, backoff = self._get_retry_policy(src, dest)
+
+        def run_job(rsync_command_this, indices):
+            if rsync_command_this == 'tar':
+                return self._run_tar(src, dest, FileTransfer._take(rsync_filelist_from, indices),
+                                     FileTransfer._take(rsync_filelist_to, indices), options, lease, max_attempts,
+                                     backoff)
+            if lease is not None:
+                # the share is read when each rsync starts, and split among concurrent ones.
+                rsync_command_this = (rsync_command_this[:2] + [lease.get_bwlimit_arg(num_worker)] +
+                                      rsync_command_this[2:])
+            return self._run_rsync(rsync_command_this, FileTransfer._take(rsync_filelist_from, indices),
+                                   FileTransfer._take(rsync_filelist_to, indices), max_attempts, backoff)
+
+        try:
+            if len(jobs) == 1 and not bundles:
+                rsync_stats = [run_job(*jobs[0])]
+            else:
+                if not options['dryrun']:
+                    # otherwise, jobs would race to create the dest dir, and rsync fails if it loses.
+                    # tar streams need it as well.
+                    self._make_dest_dir(dest, options['dest_append_prefix'])
+                with ThreadPoolExecutor(max_workers=num_worker) as executor:
+                    futures = [executor.submit(run_job, *job) for job in jobs]
+                    # wait for all of them, then raise the first error if any.
+                    for future in futures:
+                        future.exception()
+                    rsync_stats = [future.result() for future in futures]
+        finally:
+            if lease is not None:
+                lease.release()
+
+        # return the canonical filelist on the dest. This should be relative for local dest, and absolute for remote.
+        # it's in the order of the original filelist, no matter how shards were formed.
+        # ``rsync_filelist_to`` is normalized already, so it's used as is without a prefix, instead of copied.
+        if options['dest_append_prefix'] in ('', '.'):
+            ret_filelist = rsync_filelist_to
+        else:
+            ret_filelist = normalize_filelist_relative(rsync_filelist_to, prefix=options['dest_append_prefix'])
+
+        # files not reported by rsync are skipped, since they are up to date.
+        transferred_bytes = {}
+        attempts = {}
+        for rsync_stats_this in rsync_stats:
+            transferred_bytes.update(rsync_stats_this['files'])
+            attempts.update(rsync_stats_this.get('attempts', {}))
+        bytes_list = [transferred_bytes.get(p) for p in rsync_filelist_to]
+        return ret_filelist, FileTransfer._make_transfer_stats(ret_filelist, bytes_list,
+                                                               sum(x['wire_bytes'] for x in rsync_stats),
+                                                               time.monotonic() - start_time,
+                                                               literal_bytes=sum(x['literal_bytes'] for x in
+                                                                                 rsync_stats),
+                                                               compressed_list=compressed_list,
+                                                               attempts_list=[attempts.get(p, 1) for p in
+                                                                              rsync_filelist_to],
+                                                               retries=sum(x.get('retries', 0) for x in rsync_stats))
+
+    @staticmethod
+    def _take(items: list, indices: list) -> list:
+        """ ``[items[i] for i in indices]``, but ``items`` itself if ``indices`` are all of them in order, which is the
+        usual case of a single job, so that a huge filelist is not copied.
+        """
+        if len(indices) == len(items) and all(i == j for i, j in enumerate(indices)):
+            return items
+        return [items[i] for i in indices]
+
+    def _get_retry_policy(self, src: dict, dest: dict) -> tuple:
+        """ ``retry_attempts`` and ``retry_backoff`` of the remote site in a transfer, or defaults if both are local.
+        """
+        remote_site = dest if src['local'] else src
+        site_info = {} if remote_site['local'] else self.config['remote_site_config'][remote_site['path']]
+        return site_info.get('retry_attempts', 3), site_info.get('retry_backoff', 1.0)
+
+    def _acquire_bandwidth(self, src: dict, dest: dict, options: dict):
+        """ get a lease on the bandwidth budget for a transfer, see :mod:`datasmart.core.util.bandwidth`.
+
+        the budget is ``bwlimit`` of the remote site, or ``local_bwlimit`` if both sites are local.
+
+        :return: a lease, or None if there's no budget, or it's a dry run.
+        """
+        if options['dryrun']:
+            return None
+        remote_site = dest if src['local'] else src
+        if remote_site['local']:
+            site_key, budget = 'local', self.config.get('local_bwlimit')
+        else:
+            site_key = remote_site['path']
+            budget = self.config['remote_site_config'][remote_site['path']].get('bwlimit')
+        if budget is None:
+            return None
+        return datasmart.core.util.bandwidth.acquire(site_key, budget * 1024, options['priority'])
+
+    def _get_compression_groups(self, src: dict, dest: dict, rsync_filelist_from: list) -> list:
+        """ split files into groups with the same compression options, by the ``compress`` policy of the remote site.
+
+        * ``never`` (or both sites local): no compression.
+        * ``always``: compress everything.
+        * ``auto`` (default): when pushing, compress files that are compressible by
+          :func:`datasmart.core.util.compression.is_compressible`, and not others; when fetching, content can't be
+          sampled, so compress everything except for files with incompressible extensions (``--skip-compress``).
+
+        :param src: source site.
+        :param dest: destination site.
+        :param rsync_filelist_from: the files to transfer, as they are in the source site.
+        :return: a list of non-empty groups, each being ``(rsync args, whether each file is compressed, indices)``,
+            where whether each file is compressed is a list over all files.
+        """
+        num_file = len(rsync_filelist_from)
+        remote_site = dest if src['local'] else src
+        if remote_site['local']:
+            policy, level_args = 'never', []
+        else:
+            site_info = self.config['remote_site_config'][remote_site['path']]
+            policy = site_info.get('compress', 'auto')
+            level_args = ['--compress-level={}'.format(site_info['compress_level'])] if (
+                'compress_level' in site_info) else []
+
+        if policy == 'never':
+            return [([], [False] * num_file, list(range(num_file)))]
+        if policy == 'always':
+            return [(['-z'] + level_args, [True] * num_file, list(range(num_file)))]
+        if not src['local']:
+            compressed_list = [datasmart.core.util.compression.is_compressible(p, sample=False)
+                               for p in rsync_filelist_from]
+            skip_compress_arg = '--skip-compress=' + datasmart.core.util.compression.get_skip_compress_arg()
+            return [(['-z'] + level_args + [skip_compress_arg], compressed_list, list(range(num_file)))]
+        compressed_list = [datasmart.core.util.compression.is_compressible(joinpath_norm(src['path'], p))
+                           for p in rsync_filelist_from]
+        groups = [(['-z'] + level_args, compressed_list, [i for i in range(num_file) if compressed_list[i]]),
+                  ([], compressed_list, [i for i in range(num_file) if not compressed_list[i]])]
+        return [group for group in groups if group[2]]
 
-        rsync_filelist_arg = "--files-from={}".format(rsync_filelist_path)
+    @staticmethod
+    def _make_transfer_stats(filelist: list, bytes_list: list, wire_bytes: int, wall_time: float,
+                             literal_bytes: int = None, compressed_list: list = None, attempts_list: list = None,
+                             retries: int = 0) -> dict:
+        """ stats of one transfer, as returned by push and fetch under ``stats``.
+
+        :param filelist: canonical filelist.
+        :param bytes_list: bytes transferred for each file, or None if it's skipped as up to date.
+        :param wire_bytes: bytes actually sent and received, including protocol overhead and after compression.
+            For native local transfer, it's the same as bytes transferred.
+        :param wall_time: wall time of the transfer, in seconds.
+        :param literal_bytes: bytes of file data to be sent, before compression. By default, same as ``wire_bytes``.
+        :param compressed_list: whether each file is compressed in transfer. By default, none of them.
+        :param attempts_list: how many times each file is attempted. By default, once.
+        :param retries: how many times a failed rsync is run again.
+        :return: a dict with ``files`` (a list of ``{'path', 'bytes', 'skipped', 'compressed', 'attempts'}`` in the
+            order of filelist), ``retries``, ``total_bytes``, ``wire_bytes``, ``literal_bytes``, ``compression_ratio``
+            (wire bytes over literal bytes, or None if nothing is sent), ``wall_time``, and ``throughput`` (total
+            bytes per second).
+        """
+        if literal_bytes is None:
+            literal_bytes = wire_bytes
+        if compressed_list is None:
+            compressed_list = [False] * len(filelist)
+        if attempts_list is None:
+            attempts_list = [1] * len(filelist)
+        files = [{'path': p, 'bytes': b if b is not None else 0, 'skipped': b is None, 'compressed': c,
+                  'attempts': a} for p, b, c, a in zip(filelist, bytes_list, compressed_list, attempts_list)]
+        total_bytes = sum(x['bytes'] for x in files)
+        return {
+            'files': files,
+            'retries': retries,
+            'total_bytes': total_bytes,
+            'wire_bytes': wire_bytes,
+            'literal_bytes': literal_bytes,
+            'compression_ratio': wire_bytes / literal_bytes if literal_bytes > 0 else None,
+            'wall_time': wall_time,
+            'throughput': total_bytes / wall_time if wall_time > 0 else 0.0,
+        }
 
-        # get the full rsync command.
-        rsync_command = ["rsync", "-azvP",
-                         rsync_relative_arg] + rsync_dryrun_arg + rsync_ssh_arg + [rsync_filelist_arg, rsync_src_spec,
-                                                                                   rsync_dest_spec]
+    @staticmethod
+    def aggregate_transfer_stats(stats_list: list) -> dict:
+        """ aggregate stats of several transfers, such as all pushes and fetches of an action.
 
+        :param stats_list: a list of ``stats`` returned by push and fetch.
+        :return: a dict with number of ``transfers``, ``files`` and ``skipped_files``, and ``retries``,
+            ``total_bytes``, ``wire_bytes``, ``literal_bytes``, ``wall_time`` summed over transfers, and overall
+            ``compression_ratio`` and ``throughput``.
+        """
+        total_bytes = sum(x['total_bytes'] for x in stats_list)
+        wall_time = sum(x['wall_time'] for x in stats_list)
+        wire_bytes = sum(x['wire_bytes'] for x in stats_list)
+        literal_bytes = sum(x['literal_bytes'] for x in stats_list)
+        return {
+            'transfers': len(stats_list),
+            'files': sum(len(x['files']) for x in stats_list),
+            'skipped_files': sum(sum(f['skipped'] for f in x['files']) for x in stats_list),
+            'retries': sum(x['retries'] for x in stats_list),
+            'total_bytes': total_bytes,
+            'wire_bytes': wire_bytes,
+            'literal_bytes': literal_bytes,
+            'compression_ratio': wire_bytes / literal_bytes if literal_bytes > 0 else None,
+            'wall_time': wall_time,
+            'throughput': total_bytes / wall_time if wall_time > 0 else 0.0,
+        }
+
+    def _transfer_local(self, src: dict, dest: dict, filelist: list, options: dict) -> list:
+        """ transfer between two local sites with :mod:`datasmart.core.util.localcopy`, without spawning ``rsync``.
+
+        :param src: local source site.
+        :param dest: local destination site.
+        :param filelist:
+        :param options: normalized options of ``_transfer``. With ``hardlink``, files are hard linked if possible.
+            With ``link_dest``, files up to date with those in it are hard linked to them.
+        :return: the canonical filelist, same as ``rsync``, and bytes copied for each file (None if skipped).
+        """
+        rsync_filelist_from, rsync_filelist_to = get_rsync_filelist(filelist, options)
+        ret_filelist = normalize_filelist_relative(rsync_filelist_to, prefix=options['dest_append_prefix'])
+        pairs = [(joinpath_norm(src['path'], p_from), joinpath_norm(dest['path'], p_to))
+                 for p_from, p_to in zip(rsync_filelist_from, ret_filelist)]
+        # like rsync, fail on missing source files even for dry run.
+        for p_src, _ in pairs:
+            assert os.path.lexists(p_src), "the file {} must exist!".format(p_src)
+        if options['dryrun']:
+            return ret_filelist, [None if datasmart.core.util.localcopy.is_up_to_date(
+                p_src, p_dest, options['hardlink']) else 0 for p_src, p_dest in pairs]
+
+        # like rsync, only the last level of dest dir is created.
+        self._make_dest_dir(dest, options['dest_append_prefix'])
+        link_dests = None
+        if options['link_dest'] is not None:
+            link_dests = [joinpath_norm(options['link_dest'], p) for p in ret_filelist]
+        lease = self._acquire_bandwidth(src, dest, options)
+        try:
+            bytes_list = datasmart.core.util.localcopy.copy_files(
+                pairs, hardlink=options['hardlink'], workers=self.config.get('local_workers', 4),
+                throttle=lease.throttle if lease is not None else None, link_dests=link_dests)
+        finally:
+            if lease is not None:
+                lease.release()
+        if not self.config['quiet']:
+            print("{} files ({} bytes copied) from {} to {}".format(
+                len(pairs), sum(b for b in bytes_list if b is not None), src['path'],
+                joinpath_norm(dest['path'], options['dest_append_prefix'])))
+        return ret_filelist, bytes_list
+
+    def _run_rsync(self, rsync_command: list, rsync_filelist_from: list, rsync_filelist_to: list,
+                   max_attempts: int = 1, backoff: float = 1.0) -> dict:
+        """ run rsync over a filelist, retrying on failures worth retrying (see ``_RSYNC_RETRYABLE_EXIT_CODES``).
+
+        each retry only covers files not reported as transferred by earlier attempts, and resumes partial files kept
+        in ``_RSYNC_PARTIAL_DIR``. The delay before each retry is given by :func:`FileTransfer._wait_retry`.
+
+        :param rsync_command: the full rsync command, except for ``--files-from``.
+        :param rsync_filelist_from: the files to transfer, as they are in the source site.
+        :param rsync_filelist_to: the same files, as they are named by rsync in the dest site.
+        :param max_attempts: max number of times rsync is run.
+        :param backoff: delay (in seconds) before the first retry.
+        :return: stats as :func:`FileTransfer._run_rsync_once`, plus ``attempts``, how many times each file (by its
+            name in dest) attempted more than once is attempted, and ``retries``. throw ``CalledProcessError`` of the
+            last attempt if all fail.
+        """
+        return self._retry_rsync(lambda filelist: self._run_rsync_once(rsync_command, filelist), rsync_filelist_from,
+                                 rsync_filelist_to, max_attempts, backoff)
+
+    def _retry_rsync(self, run_once, rsync_filelist_from: list, rsync_filelist_to: list, max_attempts: int,
+                     backoff: float) -> dict:
+        """ the retry loop of :func:`FileTransfer._run_rsync`.
+
+        :param run_once: run rsync once over an iterable of files, as :func:`FileTransfer._run_rsync_once`.
+        """
+        stats = {'files': {}, 'wire_bytes': 0, 'literal_bytes': 0, 'attempts': {}, 'retries': 0}
+        # the first attempt streams the whole filelist as is. later ones keep indices of files still pending.
+        pending = None
+        for attempt in itertools.count(1):
+            if pending is None:
+                filelist_this = rsync_filelist_from
+            else:
+                filelist_this = (rsync_filelist_from[i] for i in pending)
+                for i in pending:
+                    stats['attempts'][rsync_filelist_to[i]] = attempt
+            try:
+                stats_this = run_once(filelist_this)
+                error = None
+            except subprocess.CalledProcessError as e:
+                stats_this, error = e.stats, e
+            stats['files'].update(stats_this['files'])
+            stats['wire_bytes'] += stats_this['wire_bytes']
+            stats['literal_bytes'] += stats_this['literal_bytes']
+            if error is None:
+                return stats
+            if error.returncode not in _RSYNC_RETRYABLE_EXIT_CODES or attempt >= max_attempts:
+                raise error
+            # files not reported are either not done yet, or up to date, which the next rsync would skip again.
+            pending = [i for i in (range(len(rsync_filelist_to)) if pending is None else pending)
+                       if rsync_filelist_to[i] not in stats_this['files']]
+            if not pending:
+                return stats
+            stats['retries'] += 1
+            self._wait_retry('rsync', error, len(pending), attempt, backoff)
+
+    def _run_rsync_once(self, rsync_command: list, rsync_filelist_from) -> dict:
+        """ run rsync over a filelist.
+
+        :param rsync_command: the full rsync command, except for ``--files-from``.
+        :param rsync_filelist_from: the files to transfer, as they are in the source site. any iterable, which is
+            streamed to rsync through stdin, without writing a temp file or making another list.
+        :return: stats parsed from rsync output if rsync succeeds, otherwise throw ``CalledProcessError``, with the
+            stats as its ``stats`` attribute. a dict with ``files``, bytes transferred for each transferred file (by
+            its name in dest), and ``wire_bytes``, bytes sent and received in total, and ``literal_bytes``, file data
+            to be sent before compression.
+        """
+        # files-from must come before src and dest specs.
+        rsync_command = rsync_command[:-2] + ["--files-from=-"] + rsync_command[-2:]
+        # add '/' in front in case we have file names starting with '#' or ';'
+        # see http://samba.2283325.n4.nabble.com/comments-with-in-files-from-td2510187.html
+        return self._run_rsync_command(rsync_command, input_lines=(os.sep + p for p in rsync_filelist_from))
+
+    def _run_rsync_command(self, rsync_command: list, cwd: str = None, input_lines=None) -> dict:
+        """ run a command running rsync, and parse its output.
+
+        :param rsync_command: the full command, which can also be rsync run remotely through ssh.
+        :param cwd: working directory of the command.
+        :param input_lines: lines fed through stdin, such as the filelist for ``--files-from=-``. any iterable,
+            consumed lazily.
+        :return: stats parsed from rsync output, see :func:`FileTransfer._run_rsync_once`.
+        """
         # print the rsync command. this printed one may not work if you directly copy it, since special characters,
         # like spaces are not quoted properly.
         if not self.config['quiet']:
             print(" ".join(rsync_command))
-            stdout_arg = None
-        else:
-            stdout_arg = subprocess.PIPE
+        # stats lines are parsed, and other output is passed through as it comes, unless quiet.
+        stats = {'files': {}, 'wire_bytes': 0, 'literal_bytes': 0}
+        with subprocess.Popen(rsync_command, stdout=subprocess.PIPE, cwd=cwd,
+                              stdin=subprocess.PIPE if input_lines is not None else None) as process:
+            if input_lines is not None:
+                feeder = threading.Thread(target=FileTransfer._feed_lines, args=(process.stdin, input_lines))
+                feeder.start()
+            for line in process.stdout:
+                line = line.decode(errors='replace')
+                if not FileTransfer._parse_rsync_line(line, stats) and not self.config['quiet']:
+                    sys.stdout.write(line)
+                    sys.stdout.flush()
+            if input_lines is not None:
+                feeder.join()
+        if process.returncode != 0:
+            error = subprocess.CalledProcessError(process.returncode, rsync_command)
+            error.stats = stats
+            raise error
+        return stats
+
+    @staticmethod
+    def _feed_lines(stream, lines, terminator: str = '\n') -> None:
+        """ write lines to stdin of a process and close it. run it in a thread, as the process may write a lot of
+        output before reading all input. a process exiting early is reported by its return code, not here.
+        """
         try:
-            subprocess.run(rsync_command, check=True, stdout=stdout_arg)  # if not return 0, if fails.
-        finally:
-            # delete the filelist no matter what happens.
-            os.remove(rsync_filelist_path)
+            for line in lines:
+                stream.write((line + terminator).encode())
+            stream.close()
+        except BrokenPipeError:
+            pass
 
-        # return the canonical filelist on the dest. This should be relative for local dest, and absolute for remote.
-        ret_filelist = normalize_filelist_relative(rsync_filelist_to,
-                                                   prefix=options['dest_append_prefix'])
+    @staticmethod
+    def _parse_rsync_line(line: str, stats: dict) -> bool:
+        """ parse one line of rsync output into stats.
 
-        # strip prefix.
+        :return: whether the line is a per-file stats line, which is not meant to be shown.
+        """
+        if line.startswith(_RSYNC_STAT_PREFIX):
+            _, _, transferred, name = line.rstrip('\n').split(' ', 3)
+            # skip directories.
+            if not name.endswith('/'):
+                stats['files'][name] = int(transferred)
+            return True
+        for key in ('Total bytes sent:', 'Total bytes received:'):
+            if line.startswith(key):
+                stats['wire_bytes'] += int(line[len(key):].strip().replace(',', ''))
+        if line.startswith('Literal data:'):
+            stats['literal_bytes'] += int(line[len('Literal data:'):].split()[0].replace(',', ''))
+        return False
+
+    def _get_transfer_shards(self, src: dict, dest: dict, rsync_filelist_from: list) -> list:
+        """ split the filelist into shards for parallel rsync.
+
+        :param src: source site.
+        :param dest: destination site.
+        :param rsync_filelist_from: the files to transfer, as they are in the source site.
+        :return: a list of shards, each being a sorted list of indices into ``rsync_filelist_from``.
+            shards are balanced by file size if the source is local, otherwise by file count.
+        """
+        num_shard = max(min(self._get_rsync_parallel(src, dest), len(rsync_filelist_from)), 1)
+        if num_shard == 1:
+            return [list(range(len(rsync_filelist_from)))]
+
+        if src['local']:
+            sizes = []
+            for p in rsync_filelist_from:
+                try:
+                    sizes.append(os.stat(os.path.join(src['path'], p)).st_size)
+                except OSError:
+                    # left to rsync, which reports missing files as usual.
+                    sizes.append(0)
+        else:
+            sizes = [1] * len(rsync_filelist_from)
+        # greedy: largest file first, into the shard with least bytes so far. ties broken by index for determinism.
+        heap = [(0, shard_idx) for shard_idx in range(num_shard)]
+        shards = [[] for _ in range(num_shard)]
+        for file_idx in sorted(range(len(sizes)), key=lambda i: (-sizes[i], i)):
+            total, shard_idx = heapq.heappop(heap)
+            shards[shard_idx].append(file_idx)
+            heapq.heappush(heap, (total + sizes[file_idx], shard_idx))
+        return [sorted(shard) for shard in shards]
+
+    def _get_rsync_parallel(self, src: dict, dest: dict) -> int:
+        """ ``rsync_parallel`` of the remote site in a transfer, or 1 if both sites are local. """
+        remote_site = dest if src['local'] else src
+        if remote_site['local']:
+            return 1
+        return self.config['remote_site_config'][remote_site['path']].get('rsync_parallel', 1)
+
+    def _get_bundles(self, src: dict, dest: dict, rsync_filelist_from: list, rsync_filelist_to: list,
+                     options: dict) -> tuple:
+        """ pick small files to be sent in tar streams, by ``bundle_threshold`` of the remote site.
+
+        per file overhead of rsync (and of each round trip over ssh) dominates for many tiny files, which go faster
+        as a few tar streams (see :func:`FileTransfer._relay_tar`). They are always sent in full, without compression,
+        so small files with the same size and modification time on the destination are left out first, as rsync would
+        skip them. the rest of small files are packed in order into chunks of about ``bundle_chunk_size`` bytes.
+        Dry runs are not bundled.
 
-        return ret_filelist
+        :param src: source site.
+        :param dest: destination site.
+        :param rsync_filelist_from: the files to transfer, as they are in the source site.
+        :param rsync_filelist_to: the files to transfer, as they are in the destination site.
+        :param options: normalized options of ``_transfer``.
+        :return: a list of chunks with more than one file, and the rest of files for rsync,
+            all as indices into ``rsync_filelist_from``. small files up to date on the destination are in neither.
+        """
+        all_indices = list(range(len(rsync_filelist_from)))
+        remote_site = dest if src['local'] else src
+        # tar streams always write files in full, which defeats ``link_dest``.
+        if remote_site['local'] or options['dryrun'] or options.get('link_dest') is not None:
+            return [], all_indices
+        site_info = self.config['remote_site_config'][remote_site['path']]
+        if 'bundle_threshold' not in site_info:
+            return [], all_indices
+        chunk_size = site_info.get('bundle_chunk_size', _BUNDLE_CHUNK_SIZE)
+
+        if src['local']:
+            src_stats = [FileTransfer._stat_local(joinpath_norm(src['path'], p)) for p in rsync_filelist_from]
+        else:
+            src_stats = self._stat_remote(src, [joinpath_norm(p) for p in rsync_filelist_from])
+        # anything but regular files (including missing ones) is left to rsync.
+        small = [idx for idx, size_mtime in enumerate(src_stats) if
+                 size_mtime is not None and size_mtime[0] < site_info['bundle_threshold']]
+        if not small:
+            return [], all_indices
+
+        # mtime is compared in integral seconds, as tar keeps, and remote stat gives.
+        dest_paths = [joinpath_norm(options['dest_append_prefix'], rsync_filelist_to[idx]) for idx in small]
+        if dest['local']:
+            dest_stats = [FileTransfer._stat_local(joinpath_norm(dest['path'], p)) for p in dest_paths]
+        else:
+            try:
+                dest_stats = self._stat_remote(dest, dest_paths)
+            except AssertionError:
+                # the root of the dest site is not created yet.
+                dest_stats = [None] * len(dest_paths)
+        up_to_date = set(idx for idx, dest_stat in zip(small, dest_stats) if dest_stat is not None and
+                         (dest_stat[0], int(dest_stat[1])) == (src_stats[idx][0], int(src_stats[idx][1])))
+
+        chunks = [[]]
+        chunk_bytes = 0
+        for idx in small:
+            if idx in up_to_date:
+                continue
+            size = src_stats[idx][0]
+            if chunks[-1] and chunk_bytes + size > chunk_size:
+                chunks.append([])
+                chunk_bytes = 0
+            chunks[-1].append(idx)
+            chunk_bytes += size
+        # a single file is not worth a tar stream.
+        chunks = [chunk for chunk in chunks if len(chunk) > 1]
+        bundled = set(idx for chunk in chunks for idx in chunk)
+        return chunks, [idx for idx in all_indices if idx not in bundled and idx not in up_to_date]
+
+    def _make_dest_dir(self, dest: dict, append_prefix: str) -> None:
+        """ create the dest dir for rsync, if it's not there. just like rsync, only the last level is created.
+
+        :param dest: destination site.
+        :param append_prefix: additional prefix of dest.
+        :return: None
+        """
+        if dest['local']:
+            try:
+                os.mkdir(joinpath_norm(dest['path'], append_prefix))
+            except FileExistsError:
+                pass
+        else:
+            dest_dir = shlex.quote(joinpath_norm(dest['prefix'], append_prefix))
+            subprocess.run(self._get_ssh_command(dest['path']) + ['test -d {0} || mkdir {0}'.format(dest_dir)],
+                           check=True, stdout=subprocess.PIPE)
 
     def _site_mapping_push(self, site: dict) -> dict:
         """ map site to the actual site used using ``_config['site_mapping_push']``
@@ -404,10 +1626,34 @@ class FileTransfer(Base):
                 joinpath_norm(prefix, append_prefix) + os.path.sep)
             # must quote since this string after ``:`` is parsed by remote shell. quote it to remove all wildcard
             # expansion... should test wild card to see if it works...
-            rsync_ssh_arg_site = ['-e', "ssh -p {}".format(site_info['ssh_port'])]
+            rsync_ssh_arg_site = ['-e', datasmart.core.util.ssh.get_rsync_rsh(self._get_ssh_args(site['path']))]
 
         return rsync_site_spec, rsync_ssh_arg_site
 
+    def _get_ssh_args(self, host: str) -> list:
+        """ ssh command (without destination) for a remote site, going through a persistent master connection
+        unless ``ssh_multiplex`` is false for this site in ``remote_site_config``.
+
+        :param host: ``path`` of a normalized remote site.
+        :return: a list of command line arguments, starting with ``ssh``.
+        """
+        assert host in self.config['remote_site_config'], "this remote site must have config!"
+        site_info = self.config['remote_site_config'][host]
+        return datasmart.core.util.ssh.get_ssh_args(site_info['ssh_username'], host, site_info['ssh_port'],
+                                                    multiplex=site_info.get('ssh_multiplex', True),
+                                                    control_persist=site_info.get('ssh_control_persist', 600))
+
+    def _get_ssh_command(self, host: str) -> list:
+        """ like ``_get_ssh_args``, with destination appended. append a remote command to run it.
+        """
+        return self._get_ssh_args(host) + [self.config['remote_site_config'][host]['ssh_username'] + '@' + host]
+
+    @staticmethod
+    def get_ssh_stats() -> dict:
+        """ reuse statistics of persistent ssh connections, see :func:`datasmart.core.util.ssh.get_ssh_stats`.
+        """
+        return datasmart.core.util.ssh.get_ssh_stats()
+
     def _get_rysnc_ssh_spec(self, src, dest, options):
         rsync_ssh_arg = []
 
@@ -430,3 +1676,333 @@ class FileTransfer(Base):
         else:
             rsync_dryrun_arg = []
         return rsync_dryrun_arg
+
+
+class TransferQueue:
+    """ bounded queue of pushes running in the background.
+
+    each push is submitted as a ``concurrent.futures.Future``, whose result is the return value of
+    :func:`FileTransfer.push`, and whose exception is whatever ``push`` raises. At most ``transfer_queue_size`` pushes
+    can be pending (queued or running); submitting more blocks until one finishes. Pushes to the same actual site
+    (after push mapping) are further limited by ``transfer_concurrency`` of that site (2 by default for remote sites,
+    and 1 for local ones, where the disk is the bottleneck).
+
+    :func:`TransferQueue.cancel` cancels pushes not started yet; running pushes are never interrupted, so no half
+    pushed directory is left behind by cancellation. Use it as a context manager to always wait for running pushes,
+    and cancel the rest if an exception is raised in the ``with`` block.
+    """
+
+    def __init__(self, filetransfer: FileTransfer = None, max_pending: int = None) -> None:
+        """
+        :param filetransfer: the instance to push files with. By default, ``FileTransfer()``.
+        :param max_pending: max number of pending pushes. By default, ``transfer_queue_size`` in config.
+        """
+        if filetransfer is None:
+            filetransfer = FileTransfer()
+        if max_pending is None:
+            max_pending = filetransfer.config.get('transfer_queue_size', 4)
+        assert max_pending >= 1
+        self.__filetransfer = filetransfer
+        self.__executor = ThreadPoolExecutor(max_workers=max_pending)
+        self.__pending = threading.BoundedSemaphore(max_pending)
+        # actual site -> semaphore limiting pushes to it.
+        self.__site_semaphores = {}
+        self.__futures = []
+        self.__lock = threading.Lock()
+
+    def _get_site_semaphore(self, dest_site: dict) -> threading.Semaphore:
+        dest_actual_site = self.__filetransfer._site_mapping_push(normalize_site(dest_site))
+        if dest_actual_site['local']:
+            key, limit = (None, dest_actual_site['path']), 1
+        else:
+            key = (dest_actual_site['path'], dest_actual_site['prefix'])
+            limit = self.__filetransfer.config['remote_site_config'][dest_actual_site['path']].get(
+                'transfer_concurrency', 2)
+        with self.__lock:
+            if key not in self.__site_semaphores:
+                self.__site_semaphores[key] = threading.Semaphore(limit)
+            return self.__site_semaphores[key]
+
+    def push(self, filelist: list, dest_site: dict = None, **kwargs):
+        """ submit a push. blocks if there are too many pending pushes already.
+
+        :param filelist: see :func:`FileTransfer.push`.
+        :param dest_site: see :func:`FileTransfer.push`.
+        :param kwargs: other arguments of :func:`FileTransfer.push`.
+        :return: a ``Future`` of the push.
+        """
+        if dest_site is None:
+            dest_site = self.__filetransfer.config['default_site']
+        site_semaphore = self._get_site_semaphore(dest_site)
+        self.__pending.acquire()
+        try:
+            future = self.__executor.submit(self._run_push, site_semaphore, filelist, dest_site, kwargs)
+        except BaseException:
+            self.__pending.release()
+            raise
+        # this is called when the push finishes, fails, or gets cancelled.
+        future.add_done_callback(lambda _: self.__pending.release())
+        with self.__lock:
+            self.__futures = [x for x in self.__futures if not x.done()] + [future]
+        return future
+
+    def _run_push(self, site_semaphore, filelist, dest_site, kwargs) -> dict:
+        with site_semaphore:
+            return self.__filetransfer.push(filelist=filelist, dest_site=dest_site, **kwargs)
+
+    def cancel(self) -> int:
+        """ cancel all pushes not started yet.
+
+        :return: number of pushes cancelled.
+        """
+        with self.__lock:
+            futures, self.__futures = self.__futures, []
+        return sum(future.cancel() for future in futures)
+
+    def close(self, cancel: bool = False) -> None:
+        """ wait for pushes to finish, and release the threads.
+
+        :param cancel: cancel pushes not started yet first.
+        :return: None. Errors of pushes are not raised here; get them from their futures.
+        """
+        if cancel:
+            self.cancel()
+        self.__executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(cancel=exc_type is not None)
+        return False
+
+
+class LazyFetch(collections.abc.Mapping):
+    """ fetch on demand, as a mapping from canonical paths (same as ``filelist`` returned by
+    :func:`FileTransfer.fetch`) to :class:`LazyFile` handles.
+
+    nothing is transferred when it's created. A file is fetched the first time its handle is opened (or its local path
+    is asked for), and a subset can be prefetched in the background with :func:`LazyFetch.prefetch`. Fetches run in
+    batches through :func:`FileTransfer.fetch`, at most ``lazy_fetch_workers`` at the same time, so exploring a large
+    session can start right away, and only files actually used are transferred.
+
+    Use it as a context manager, so that background fetches not started yet are cancelled at the end.
+    """
+
+    def __init__(self, filelist: list, filetransfer: FileTransfer = None, src_site: dict = None,
+                 relative: bool = False, subdirs: list = None, local_fetch_option=None, strip_prefix='',
+                 workers: int = None, background: bool = False, on_fetch=None) -> None:
+        """
+        :param filelist: see :func:`FileTransfer.fetch`.
+        :param filetransfer: the instance to fetch files with. By default, ``FileTransfer()``.
+        :param src_site: see :func:`FileTransfer.fetch`.
+        :param relative: see :func:`FileTransfer.fetch`.
+        :param subdirs: see :func:`FileTransfer.fetch`.
+        :param local_fetch_option: see :func:`FileTransfer.fetch`. with ``ask``, the user is asked only once here.
+        :param strip_prefix: see :func:`FileTransfer.fetch`.
+        :param workers: max number of fetches at the same time. By default, ``lazy_fetch_workers`` in config.
+        :param background: prefetch all files in the background right away.
+        :param on_fetch: called with the return value of each :func:`FileTransfer.fetch`, from any thread.
+        """
+        if filetransfer is None:
+            filetransfer = FileTransfer()
+        if workers is None:
+            workers = filetransfer.config.get('lazy_fetch_workers', 4)
+        assert workers >= 1
+        self.__filetransfer = filetransfer
+        self.__on_fetch = on_fetch
+        src_site, subdirs, local_fetch_option, strip_prefix = filetransfer._process_default_pars_fetch(
+            src_site, subdirs, local_fetch_option, strip_prefix)
+        self.__filelist = normalize_filelist_relative(filelist)
+        savepath = joinpath_norm(filetransfer.config['local_data_dir'],
+                                 reformat_subdirs(subdirs, filetransfer.config['local_data_dir']))
+        src_site = normalize_site(src_site)
+        src_actual_site = filetransfer._site_mapping_fetch(src_site)
+        # decide about copying for local mapping only once, as in ``FileTransfer.fetch``.
+        copy_flag = True
+        if src_actual_site['local'] and (not src_site['local']):
+            copy_flag = FileTransfer._fetch_parse_copy(local_fetch_option)
+        if copy_flag:
+            self.__dest_site = normalize_site({"path": savepath, "local": True})
+            _, rsync_filelist_to = get_rsync_filelist(self.__filelist, {'relative': relative,
+                                                                        'strip_prefix': strip_prefix})
+            ret_filelist = normalize_filelist_relative(rsync_filelist_to)
+        else:
+            self.__dest_site = src_actual_site
+            ret_filelist = self.__filelist
+        assert len(set(ret_filelist)) == len(ret_filelist), "fetched files must have distinct paths!"
+        self.__fetch_kwargs = {'src_site': src_site, 'relative': relative, 'subdirs': subdirs,
+                               'local_fetch_option': 'copy', 'strip_prefix': strip_prefix}
+
+        self.__files = collections.OrderedDict(
+            (p, LazyFile(self, idx, p, joinpath_norm(self.__dest_site['path'], p))) for idx, p in
+            enumerate(ret_filelist))
+        self.__handles = list(self.__files.values())
+        # future of each file, once it's claimed by some fetch.
+        self.__futures = [None] * len(ret_filelist)
+        # whether the fetch of each file has started. files claimed by a background fetch not started yet can be
+        # taken over by an on-demand fetch.
+        self.__started = [False] * len(ret_filelist)
+        if not copy_flag:
+            for idx, handle in enumerate(self.__handles):
+                self.__futures[idx] = Future()
+                self.__futures[idx].set_result(handle.local_path)
+                self.__started[idx] = True
+        self.__stats = []
+        self.__executor = ThreadPoolExecutor(max_workers=workers)
+        self.__slots = threading.BoundedSemaphore(workers)
+        # background fetches, with indices of their files.
+        self.__jobs = []
+        self.__lock = threading.Lock()
+        if background:
+            self.prefetch()
+
+    def __getitem__(self, path: str) -> 'LazyFile':
+        return self.__files[path]
+
+    def __iter__(self):
+        return iter(self.__files)
+
+    def __len__(self) -> int:
+        return len(self.__files)
+
+    @property
+    def dest_site(self) -> dict:
+        """ the local site files are fetched into, same as ``dest`` returned by :func:`FileTransfer.fetch`. """
+        return self.__dest_site
+
+    @property
+    def stats(self) -> dict:
+        """ stats of fetches done so far, see :func:`FileTransfer.aggregate_transfer_stats`. """
+        return FileTransfer.aggregate_transfer_stats(self.__stats)
+
+    def _claim(self, indices: list) -> list:
+        """ claim files not claimed by other fetches yet, and return them. """
+        with self.__lock:
+            claimed = [idx for idx in indices if self.__futures[idx] is None]
+            for idx in claimed:
+                self.__futures[idx] = Future()
+        return claimed
+
+    def _start(self, indices: list) -> list:
+        """ mark claimed files as started, and return those not started by other fetches yet. """
+        with self.__lock:
+            started = [idx for idx in indices if not self.__started[idx]]
+            for idx in started:
+                self.__started[idx] = True
+        return started
+
+    def _run(self, indices: list) -> None:
+        """ fetch claimed files not started by other fetches, and resolve their futures.
+        errors are set on the futures, not raised.
+        """
+        indices = self._start(indices)
+        if not indices:
+            return
+        try:
+            with self.__slots:
+                ret = self.__filetransfer.fetch([self.__filelist[idx] for idx in indices], **self.__fetch_kwargs)
+            self.__stats.append(ret['stats'])
+            if self.__on_fetch is not None:
+                self.__on_fetch(ret)
+        except BaseException as e:
+            for idx in indices:
+                self.__futures[idx].set_exception(e)
+            return
+        for idx in indices:
+            self.__futures[idx].set_result(self.__handles[idx].local_path)
+
+    def _fetch_one(self, idx: int) -> str:
+        """ fetch one file in this thread if it's not claimed yet, or claimed by a background fetch not started yet
+        (which then skips it), otherwise wait for the fetch running it.
+        """
+        self._claim([idx])
+        self._run([idx])
+        return self.__futures[idx].result()
+
+    def _is_fetched(self, idx: int) -> bool:
+        future = self.__futures[idx]
+        return future is not None and future.done() and future.exception() is None
+
+    def prefetch(self, paths: list = None, batch_size: int = 16) -> list:
+        """ fetch files in the background.
+
+        :param paths: canonical paths of files to fetch. By default, all files.
+        :param batch_size: number of files in each fetch. smaller batches make files available sooner.
+        :return: a ``Future`` of the local path of each file. files claimed already keep their futures.
+        """
+        if paths is None:
+            paths = list(self.__files)
+        indices = [self.__files[p].index for p in paths]
+        claimed = self._claim(indices)
+        for start in range(0, len(claimed), batch_size):
+            batch = claimed[start:start + batch_size]
+            with self.__lock:
+                self.__jobs.append((self.__executor.submit(self._run, batch), batch))
+        return [self.__futures[idx] for idx in indices]
+
+    def wait(self) -> None:
+        """ wait for all fetches started so far, and raise the first error if any. """
+        futures = [future for future in self.__futures if future is not None]
+        for future in futures:
+            future.exception()
+        for future in futures:
+            future.result()
+
+    def close(self) -> None:
+        """ cancel background fetches not started yet, wait for running ones, and release the threads.
+
+        files in cancelled fetches fail with ``concurrent.futures.CancelledError`` when opened afterwards.
+        """
+        with self.__lock:
+            jobs, self.__jobs = self.__jobs, []
+        for job, batch in jobs:
+            if job.cancel():
+                # files taken over by on-demand fetches are left alone.
+                for idx in self._start(batch):
+                    self.__futures[idx].cancel()
+        self.__executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+class LazyFile:
+    """ handle of one file in a :class:`LazyFetch`. It's path-like (with Python 3.6 or later), so it can be passed to
+    ``open``, ``numpy.load``, etc., which fetches the file first if needed. With Python 3.5, use :func:`LazyFile.fetch`
+    or :func:`LazyFile.open` instead.
+    """
+
+    def __init__(self, lazy_fetch: LazyFetch, index: int, path: str, local_path: str) -> None:
+        self.__lazy_fetch = lazy_fetch
+        self.index = index
+        # canonical path relative to the dest site.
+        self.path = path
+        # where the file is (or will be) after fetch.
+        self.local_path = local_path
+
+    @property
+    def fetched(self) -> bool:
+        """ whether the file is fetched already. """
+        return self.__lazy_fetch._is_fetched(self.index)
+
+    def fetch(self) -> str:
+        """ fetch the file if it's not there yet, waiting for a background fetch of it if any.
+
+        :return: the local path.
+        """
+        return self.__lazy_fetch._fetch_one(self.index)
+
+    def open(self, mode: str = 'rb', *args, **kwargs):
+        """ fetch the file if needed, and open it, with the same arguments as ``open``. """
+        return open(self.fetch(), mode, *args, **kwargs)
+
+    def __fspath__(self) -> str:
+        return self.fetch()
+
+    def __repr__(self) -> str:
+        return '<LazyFile {} fetched={}>'.format(self.path, self.fetched)
@@ -1,3 +1,5 @@
+# jsl is imported eagerly by the schemas below, unlike jsonschema, which is only imported by validate. it's light
+# compared to jsonschema, and schemas are declared as classes at module level throughout datasmart.
 from .stringpatterns import StringPatterns
 from .misc import GitRepoRef
 from . import filetransfer
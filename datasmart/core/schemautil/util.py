@@ -1,9 +1,10 @@
 import json
-import jsonschema
-from jsonschema import FormatChecker, Draft4Validator
 
 
 def validate(schema, record):
+    # jsonschema is slow to import, so only import it when we really validate something.
+    import jsonschema
+    from jsonschema import FormatChecker, Draft4Validator
     jsonschema.validate(instance=record, schema=schema, format_checker=FormatChecker(),
                         cls=Draft4Validator)
 
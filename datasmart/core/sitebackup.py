@@ -0,0 +1,343 @@
+"""
+backup of files on sites referenced by records, consistent with a backup of the database.
+
+files pushed by actions live under ``prefix/table_path/_id`` of their sites, and records reference them by a site and a
+filelist (``{'site': ..., 'filelist': [...]}``, anywhere in a record). A site backup, or snapshot, copies all files
+referenced by records in one database backup (see :mod:`datasmart.core.dbbackup`) into a directory under a backup
+root, named after that database backup, with one tree for each site (see :func:`get_site_key`). Records are read
+from the database backup, not from the live database, so the snapshot has exactly the files of records at the
+checkpoint of that backup, and restoring both gives records and files that agree.
+
+each snapshot is taken against the previous one under the same root with ``rsync --link-dest`` (or its equivalent in
+the native local engine, see :func:`datasmart.core.util.localcopy.copy_file`): files unchanged since then are hard
+links to the previous snapshot, and only new or changed files are copied, while every snapshot is a complete tree.
+Sites are transferred in parallel, each by :func:`datasmart.core.filetransfer.FileTransfer.relay`, so remote sites
+are mapped by ``site_mapping_fetch`` as usual. Files referenced by records but missing on their sites are listed in
+the manifest of the snapshot (``manifest.json``) instead of failing the backup.
+
+the other way round, :func:`verify_database` checks that files referenced by records in the database, say after
+:func:`datasmart.core.dbbackup.restore`, exist on their sites.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import dbbackup
+from .util.path import normalize_site
+
+_MANIFEST_NAME = 'manifest.json'
+_MANIFEST_VERSION = 1
+_BATCH_SIZE = 1000
+
+
+def list_snapshots(backup_root: str) -> list:
+    """ names of complete snapshots under ``backup_root``, from old to new. """
+    if not os.path.isdir(backup_root):
+        return []
+    return sorted(x for x in os.listdir(backup_root) if os.path.isfile(os.path.join(backup_root, x, _MANIFEST_NAME)))
+
+
+def load_manifest(backup_root: str, name: str) -> dict:
+    with open(os.path.join(backup_root, name, _MANIFEST_NAME), 'rt', encoding='utf-8') as f:
+        manifest = json.loads(f.read())
+    assert manifest['version'] == _MANIFEST_VERSION, 'unknown manifest version {}'.format(manifest['version'])
+    return manifest
+
+
+def get_site_key(site: dict) -> str:
+    """ name of the directory holding files of a site in a snapshot.
+
+    it's readable (from the host and prefix, or the path of a local site), and made unique by a hash of the site.
+
+    :param site: a site, as in records. ``append_prefix`` is ignored.
+    :return: a file name.
+    """
+    site = normalize_site(site)
+    identity = [site['local'], site['path'], None if site['local'] else site['prefix']]
+    readable = site['path'] if site['local'] else site['path'] + '_' + site['prefix']
+    readable = ''.join(c if c.isalnum() or c in '-.' else '_' for c in readable).strip('_.')
+    return '{}-{}'.format(readable or 'site', hashlib.sha1(json.dumps(identity).encode()).hexdigest()[:8])
+
+
+def find_file_refs(record) -> list:
+    """ site and filelist pairs referenced anywhere in a record.
+
+    :param record: a decoded record, or any part of it.
+    :return: a list of ``(site, filelist)``, for each dict with a ``site`` (a dict with ``path`` and ``local``) and a
+        ``filelist`` (a list).
+    """
+    refs = []
+    stack = [record]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            site = value.get('site')
+            if isinstance(site, dict) and 'path' in site and 'local' in site and isinstance(value.get('filelist'),
+                                                                                             list):
+                refs.append((site, value['filelist']))
+            else:
+                stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+    return refs
+
+
+def collect_site_files(records) -> dict:
+    """ files referenced by records, grouped by site.
+
+    :param records: an iterable of decoded records.
+    :return: site key (see :func:`get_site_key`) -> ``{'site', 'filelist'}``, where the filelist is sorted and has no
+        duplicates, and the site is normalized, without ``append_prefix``.
+    """
+    site_files = {}
+    # sites are normalized once for each distinct one, not once for each record.
+    keys = {}
+    for record in records:
+        for site, filelist in find_file_refs(record):
+            site_json = json.dumps(site, sort_keys=True)
+            if site_json not in keys:
+                keys[site_json] = get_site_key(site)
+                if keys[site_json] not in site_files:
+                    site_files[keys[site_json]] = {'site': normalize_site(site), 'filelist': set()}
+            site_files[keys[site_json]]['filelist'].update(filelist)
+    for entry in site_files.values():
+        entry['filelist'] = sorted(entry['filelist'])
+    return site_files
+
+
+def iter_backup_records(db_backup_root: str, name: str, collections: list = None, batch_size: int = _BATCH_SIZE):
+    """ records in a database backup that may reference files, decoded in batches.
+
+    documents are read as raw BSON, and only those with a ``filelist`` field somewhere are decoded, a batch at a time.
+
+    :param db_backup_root: directory holding all database backups.
+    :param name: name of the database backup.
+    :param collections: ``database.collection`` to read. By default, all in the backup.
+    :param batch_size: number of documents decoded together.
+    :return: a generator of decoded records.
+    """
+    if collections is None:
+        collections = sorted(dbbackup.load_manifest(db_backup_root, name)['collections'])
+    for collection_key in collections:
+        yield from _decode_with_files(dbbackup.iter_documents(db_backup_root, name, collection_key), batch_size)
+
+
+def _decode_with_files(raw_documents, batch_size: int):
+    """ decode raw BSON documents with a ``filelist`` field somewhere, a batch at a time, skipping others. """
+    from bson import decode_all
+    batch = []
+    for raw in raw_documents:
+        # BSON has field names as C strings after a type byte, so this never misses one.
+        if b'filelist\x00' in raw:
+            batch.append(raw)
+            if len(batch) >= batch_size:
+                yield from decode_all(b''.join(batch))
+                batch = []
+    if batch:
+        yield from decode_all(b''.join(batch))
+
+
+def _snapshot_site(filetransfer, site: dict, filelist: list, site_dir: str, link_dest: str) -> dict:
+    """ copy existing files of one site into ``site_dir``, hard linking unchanged ones to ``link_dest`` if given. """
+    stats = filetransfer.stat(filelist, site, use_cache=False)
+    existing = [x['path'] for x in stats if x['exists']]
+    entry = {'site': site, 'num_files': len(existing), 'missing': [x['path'] for x in stats if not x['exists']]}
+    if existing:
+        ret = filetransfer.relay(existing, site, {'local': True, 'path': site_dir}, relative=True,
+                                 link_dest=link_dest)
+        entry['stats'] = {k: v for k, v in ret['stats'].items() if k != 'files'}
+        entry['stats']['skipped'] = sum(x['skipped'] for x in ret['stats']['files'])
+    else:
+        os.makedirs(site_dir)
+    return entry
+
+
+def snapshot_sites(site_files: dict, backup_root: str, name: str, filetransfer=None, max_workers: int = 4,
+                   extra: dict = None, quiet: bool = True) -> dict:
+    """ take a snapshot of files on sites, incrementally over the latest snapshot under ``backup_root``.
+
+    :param site_files: files to back up, as returned by :func:`collect_site_files`.
+    :param backup_root: directory holding all snapshots. created if needed.
+    :param name: name of the snapshot, usually that of the database backup the files are from.
+    :param filetransfer: a :class:`datasmart.core.filetransfer.FileTransfer`. By default, one with the global config.
+    :param max_workers: number of sites transferred concurrently.
+    :param extra: more fields of the manifest.
+    :param quiet: don't print progress.
+    :return: manifest of the snapshot, with ``link_dest`` (the previous snapshot, or None), and for each site key,
+        the ``site``, ``num_files`` copied or linked, ``missing`` files and ``stats`` of the transfer.
+    """
+    if filetransfer is None:
+        from .filetransfer import FileTransfer
+        filetransfer = FileTransfer()
+    start_time = time.monotonic()
+    snapshots = list_snapshots(backup_root)
+    assert name not in snapshots, 'snapshot {} exists already'.format(name)
+    previous = snapshots[-1] if snapshots else None
+
+    # written under a temp name, and renamed when it's complete. one left by a killed run is taken again from scratch.
+    partial_dir = os.path.join(os.path.abspath(backup_root), '.' + name + '.partial')
+    if os.path.lexists(partial_dir):
+        shutil.rmtree(partial_dir)
+    os.makedirs(partial_dir)
+
+    def snapshot_one(key):
+        link_dest = None
+        if previous is not None and os.path.isdir(os.path.join(backup_root, previous, key)):
+            link_dest = os.path.join(os.path.abspath(backup_root), previous, key)
+        return _snapshot_site(filetransfer, site_files[key]['site'], site_files[key]['filelist'],
+                              os.path.join(partial_dir, key), link_dest)
+
+    keys = sorted(site_files)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(snapshot_one, key) for key in keys]
+            # wait for all of them, then raise the first error if any.
+            for future in futures:
+                future.exception()
+            entries = [future.result() for future in futures]
+        manifest = {'version': _MANIFEST_VERSION, 'name': name, 'link_dest': previous,
+                    'wall_time': time.monotonic() - start_time, 'sites': dict(zip(keys, entries))}
+        manifest.update(extra or {})
+        with open(os.path.join(partial_dir, _MANIFEST_NAME), 'wt', encoding='utf-8') as f:
+            f.write(json.dumps(manifest, indent=2, sort_keys=True))
+        os.rename(partial_dir, os.path.join(backup_root, name))
+    except BaseException:
+        # so that the snapshot can be taken again under the same name.
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        raise
+    if not quiet:
+        print(format_summary(manifest))
+    return manifest
+
+
+def backup_sites(db_backup_root: str, backup_root: str, db_backup_name: str = None, collections: list = None,
+                 filetransfer=None, max_workers: int = 4, batch_size: int = _BATCH_SIZE, quiet: bool = True) -> dict:
+    """ take a snapshot of files referenced by records in a database backup.
+
+    :param db_backup_root: directory holding all database backups.
+    :param backup_root: directory holding all snapshots. created if needed.
+    :param db_backup_name: name of the database backup, also used as the name of the snapshot. By default, the latest.
+    :param collections: ``database.collection`` to read records from. By default, all in the database backup.
+    :param filetransfer: see :func:`snapshot_sites`.
+    :param max_workers: see :func:`snapshot_sites`.
+    :param batch_size: see :func:`iter_backup_records`.
+    :param quiet: don't print progress.
+    :return: manifest of the snapshot, see :func:`snapshot_sites`. it also has ``db_backup`` and ``db_checkpoint``,
+        name and checkpoint of the database backup.
+    """
+    if db_backup_name is None:
+        db_backups = dbbackup.list_backups(db_backup_root)
+        assert db_backups, 'no database backup in {}'.format(db_backup_root)
+        db_backup_name = db_backups[-1]
+    db_manifest = dbbackup.load_manifest(db_backup_root, db_backup_name)
+    site_files = collect_site_files(iter_backup_records(db_backup_root, db_backup_name, collections, batch_size))
+    return snapshot_sites(site_files, backup_root, db_backup_name, filetransfer=filetransfer, max_workers=max_workers,
+                          extra={'db_backup': db_backup_name, 'db_checkpoint': db_manifest['checkpoint']},
+                          quiet=quiet)
+
+
+def format_summary(manifest: dict) -> str:
+    """ a summary of a snapshot, with one line for each site. """
+    lines = ['snapshot {} ({}), {:.1f} seconds'.format(
+        manifest['name'], 'full' if manifest['link_dest'] is None else 'linked to ' + manifest['link_dest'],
+        manifest['wall_time'])]
+    for key, entry in sorted(manifest['sites'].items()):
+        stats = entry.get('stats', {'total_bytes': 0, 'skipped': 0})
+        lines.append('  {}: {} files, {} unchanged, {} bytes copied, {} missing'.format(
+            key, entry['num_files'], stats['skipped'], stats['total_bytes'], len(entry['missing'])))
+        for p in entry['missing']:
+            lines.append('    missing {}'.format(p))
+    return '\n'.join(lines)
+
+
+def check_records(records, filetransfer=None, max_workers: int = 4) -> dict:
+    """ check that files referenced by records exist on their sites.
+
+    files of each site are checked by one :func:`datasmart.core.filetransfer.FileTransfer.stat`, which takes one
+    ssh command for a remote site, and sites are checked in parallel.
+
+    :param records: an iterable of ``(owner, record)``, where ``owner`` tells which record it is in the report,
+        such as ``(collection, _id)``, and the record is decoded.
+    :param filetransfer: see :func:`snapshot_sites`.
+    :param max_workers: number of sites checked concurrently.
+    :return: a dict with ``num_records`` checked, ``num_files`` (distinct files of all sites), and ``mismatches``,
+        a list of ``{'owner', 'site', 'path'}``, one for each missing file of each record referencing it.
+    """
+    if filetransfer is None:
+        from .filetransfer import FileTransfer
+        filetransfer = FileTransfer()
+    # site key -> {'site', 'files': {path: [owner, ...]}}.
+    site_files = {}
+    keys = {}
+    num_records = 0
+    for owner, record in records:
+        num_records += 1
+        for site, filelist in find_file_refs(record):
+            site_json = json.dumps(site, sort_keys=True)
+            if site_json not in keys:
+                keys[site_json] = get_site_key(site)
+                if keys[site_json] not in site_files:
+                    site_files[keys[site_json]] = {'site': normalize_site(site), 'files': {}}
+            files = site_files[keys[site_json]]['files']
+            for p in filelist:
+                files.setdefault(p, []).append(owner)
+
+    def check_one(key):
+        filelist = sorted(site_files[key]['files'])
+        return [x['path'] for x in filetransfer.stat(filelist, site_files[key]['site'], use_cache=False)
+                if not x['exists']]
+
+    keys_sorted = sorted(site_files)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(check_one, key) for key in keys_sorted]
+        for future in futures:
+            future.exception()
+        missing_list = [future.result() for future in futures]
+    mismatches = []
+    for key, missing in zip(keys_sorted, missing_list):
+        for p in missing:
+            for owner in site_files[key]['files'][p]:
+                mismatches.append({'owner': owner, 'site': site_files[key]['site'], 'path': p})
+    return {'num_records': num_records, 'num_files': sum(len(x['files']) for x in site_files.values()),
+            'mismatches': mismatches}
+
+
+def verify_database(client, collections: list, filetransfer=None, max_workers: int = 4,
+                    batch_size: int = _BATCH_SIZE) -> dict:
+    """ check that files referenced by records in the database exist on their sites, such as after a restore.
+
+    records are read by batched cursors as raw BSON, and only those with a ``filelist`` field are decoded.
+
+    :param client: a connected ``MongoClient``.
+    :param collections: ``database.collection`` to check.
+    :param filetransfer: see :func:`snapshot_sites`.
+    :param max_workers: see :func:`check_records`.
+    :param batch_size: number of documents in each batch of cursors.
+    :return: see :func:`check_records`. owners are ``(database.collection, _id)``.
+    """
+    from bson.codec_options import CodecOptions
+    from bson.raw_bson import RawBSONDocument
+
+    def iter_records():
+        for collection_key in collections:
+            database, collection_name = collection_key.split('.', 1)
+            collection = client[database][collection_name].with_options(
+                codec_options=CodecOptions(document_class=RawBSONDocument))
+            raw_documents = (doc.raw for doc in collection.find({}, batch_size=batch_size))
+            for record in _decode_with_files(raw_documents, batch_size):
+                yield (collection_key, record['_id']), record
+
+    return check_records(iter_records(), filetransfer=filetransfer, max_workers=max_workers)
+
+
+def format_check_summary(result: dict) -> str:
+    """ a summary of :func:`check_records`, with one line for each mismatch. """
+    lines = ['{} files referenced by {} records checked, {} missing'.format(
+        result['num_files'], result['num_records'], len(result['mismatches']))]
+    for mismatch in result['mismatches']:
+        lines.append('  missing {} on {}, referenced by {}'.format(mismatch['path'], mismatch['site'],
+                                                                   mismatch['owner']))
+    return '\n'.join(lines)
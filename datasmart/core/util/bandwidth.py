@@ -0,0 +1,166 @@
+"""bandwidth scheduler for file transfer, coordinated across processes on the same host.
+
+each site with a bandwidth budget has a state file listing all transfers (leases) to / from it on this host, guarded
+by ``flock``. The budget is divided among active leases by priority class: when any ``interactive`` lease (such as a
+fetch the user is waiting for) is active, all ``bulk`` leases (such as pushes during ingestion) share only
+``BULK_SHARE_UNDER_INTERACTIVE`` of the budget, and interactive ones share the rest. Otherwise bulk leases share all
+of it.
+
+a lease applies its share either through rsync's ``--bwlimit`` (fixed when rsync starts), or through a token bucket
+(:func:`Lease.throttle`) for the native local engine, whose rate follows changes in the share.
+Leases of processes that are gone are dropped automatically.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+PRIORITIES = ('interactive', 'bulk')
+BULK_SHARE_UNDER_INTERACTIVE = 0.1
+# how often (in seconds) a lease re-reads its share from the state file.
+REFRESH_INTERVAL = 1.0
+
+# directory of state files, shared by all users on this host.
+state_dir = os.path.join(tempfile.gettempdir(), 'datasmart-bandwidth')
+
+
+def _get_state_path(site_key: str) -> str:
+    if not os.path.exists(state_dir):
+        os.makedirs(state_dir, exist_ok=True)
+        try:
+            os.chmod(state_dir, 0o1777)
+        except OSError:
+            pass
+    return os.path.join(state_dir, ''.join(c if c.isalnum() or c in '-_.' else '_' for c in site_key) + '.json')
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _update_state(site_key: str, func):
+    """ read, modify and write the state of a site under an exclusive lock.
+
+    :param site_key: the site.
+    :param func: called with the dict of leases, which it can modify in place. dead leases are already dropped.
+    :return: return value of ``func``.
+    """
+    import fcntl
+    state_path = _get_state_path(site_key)
+    fd = os.open(state_path, os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        # so that other users can join, no matter what umask is.
+        os.fchmod(fd, 0o666)
+    except OSError:
+        pass
+    with os.fdopen(fd, 'r+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            content = f.read()
+            leases = json.loads(content) if content else {}
+            leases = {k: v for k, v in leases.items() if _pid_alive(v['pid'])}
+            ret = func(leases)
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(leases))
+            f.flush()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+    return ret
+
+
+def _compute_share(leases: dict, lease_id: str, budget: float) -> float:
+    """ share of budget for one lease, in bytes per second. """
+    priority = leases[lease_id]['priority']
+    num_interactive = sum(1 for x in leases.values() if x['priority'] == 'interactive')
+    num_bulk = len(leases) - num_interactive
+    if num_interactive == 0:
+        return budget / num_bulk
+    if priority == 'interactive':
+        return budget * (1 - BULK_SHARE_UNDER_INTERACTIVE if num_bulk else 1) / num_interactive
+    return budget * BULK_SHARE_UNDER_INTERACTIVE / num_bulk
+
+
+class Lease:
+    """ a transfer's claim on the bandwidth budget of a site. get one with :func:`acquire`. """
+
+    def __init__(self, site_key: str, budget: float, priority: str) -> None:
+        assert priority in PRIORITIES
+        assert budget > 0
+        self.site_key = site_key
+        self.budget = budget
+        self.priority = priority
+        self.lease_id = uuid.uuid4().hex
+        self.__rate = None
+        self.__rate_time = None
+        # token bucket for throttle, holding at most one second of data.
+        self.__tokens = 0.0
+        self.__token_time = time.monotonic()
+        self.__lock = threading.Lock()
+
+        def register(leases):
+            leases[self.lease_id] = {'pid': os.getpid(), 'priority': priority, 'time': time.time()}
+            return _compute_share(leases, self.lease_id, budget)
+
+        self.__set_rate(_update_state(site_key, register))
+
+    def __set_rate(self, rate: float) -> None:
+        self.__rate = rate
+        self.__rate_time = time.monotonic()
+
+    @property
+    def rate(self) -> float:
+        """ current share of the budget, in bytes per second. refreshed every ``REFRESH_INTERVAL`` seconds. """
+        if time.monotonic() - self.__rate_time >= REFRESH_INTERVAL:
+            def refresh(leases):
+                # re-register in case our lease got lost, say the state file was removed.
+                leases.setdefault(self.lease_id, {'pid': os.getpid(), 'priority': self.priority, 'time': time.time()})
+                return _compute_share(leases, self.lease_id, self.budget)
+
+            self.__set_rate(_update_state(self.site_key, refresh))
+        return self.__rate
+
+    def get_bwlimit_arg(self, num_process: int = 1) -> str:
+        """ rsync's ``--bwlimit`` option for the current share, split evenly among ``num_process`` rsync. """
+        return '--bwlimit={}'.format(max(int(self.rate / num_process / 1024), 1))
+
+    def throttle(self, num_bytes: int) -> None:
+        """ block until ``num_bytes`` can be sent under the current share. thread safe. """
+        with self.__lock:
+            rate = self.rate
+            now = time.monotonic()
+            self.__tokens = min(self.__tokens + (now - self.__token_time) * rate, rate)
+            self.__token_time = now
+            self.__tokens -= num_bytes
+            wait = -self.__tokens / rate if self.__tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+    def release(self) -> None:
+        _update_state(self.site_key, lambda leases: leases.pop(self.lease_id, None))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
+
+
+def acquire(site_key: str, budget: float, priority: str = 'bulk') -> Lease:
+    """ register a transfer on a site with bandwidth budget.
+
+    :param site_key: identifies the site, such as its host name.
+    :param budget: bandwidth budget of the site shared by all transfers on this host, in bytes per second.
+    :param priority: one of ``PRIORITIES``.
+    :return: a :class:`Lease`. release it after the transfer, or use it as a context manager.
+    """
+    return Lease(site_key, budget, priority)
@@ -0,0 +1,82 @@
+"""compression policy for file transfer.
+
+compression only pays off for compressible data over slow links. Files are classified as compressible or not,
+first by their extensions, and then, for unknown extensions, by the Shannon entropy of a few samples of their content.
+"""
+import collections
+import math
+import os
+
+# suffixes of files that are already compressed, or are (almost) random, so compressing them only wastes CPU.
+# it's rsync's default ``--skip-compress`` list, plus common formats of neural recordings, images and videos.
+INCOMPRESSIBLE_EXTENSIONS = frozenset((
+    '3g2', '3gp', '7z', 'aac', 'ace', 'apk', 'avi', 'bz2', 'deb', 'dmg', 'ear', 'f4v', 'flac', 'flv', 'gpg', 'gz',
+    'iso', 'jar', 'jpeg', 'jpg', 'lrz', 'lz', 'lz4', 'lzma', 'lzo', 'm1a', 'm1v', 'm2a', 'm2ts', 'm2v', 'm4a', 'm4b',
+    'm4p', 'm4r', 'm4v', 'mka', 'mkv', 'mov', 'mp1', 'mp2', 'mp3', 'mp4', 'mpa', 'mpeg', 'mpg', 'mpv', 'mts', 'odb',
+    'odf', 'odg', 'odi', 'odm', 'odp', 'ods', 'odt', 'oga', 'ogg', 'ogm', 'ogv', 'ogx', 'opus', 'otg', 'oth', 'otp',
+    'ots', 'ott', 'oxt', 'png', 'qt', 'rar', 'rpm', 'rz', 'rzip', 'spx', 'squashfs', 'sxc', 'sxd', 'sxg', 'sxm', 'sxw',
+    'sz', 'tbz', 'tbz2', 'tgz', 'tif', 'tiff', 'tlz', 'ts', 'txz', 'tzo', 'vob', 'war', 'webm', 'webp', 'wma', 'wmv',
+    'xz', 'z', 'zip', 'zst',
+    # Blackrock recordings.
+    'nev', 'ns1', 'ns2', 'ns3', 'ns4', 'ns5', 'ns6',
+    # other images and videos.
+    'gif', 'heic', 'jp2',
+))
+
+# suffixes of files that are known to compress well, so there's no need to sample them.
+COMPRESSIBLE_EXTENSIONS = frozenset((
+    'txt', 'csv', 'tsv', 'json', 'xml', 'html', 'htm', 'log', 'md', 'rst', 'py', 'm', 'c', 'h', 'cpp', 'yaml', 'yml',
+    'bmp', 'svg', 'tar',
+))
+
+# files with entropy (bits per byte) above this are considered incompressible.
+ENTROPY_THRESHOLD = 7.5
+# how many bytes to read from each of the beginning, middle and end of a file for sampling.
+SAMPLE_SIZE = 64 * 1024
+
+
+def get_extension(path: str) -> str:
+    """ lower case extension without dot, or empty string. """
+    return os.path.splitext(path)[1][1:].lower()
+
+
+def estimate_entropy(path: str, sample_size: int = SAMPLE_SIZE) -> float:
+    """ Shannon entropy of bytes in samples of a file, in bits per byte.
+
+    :param path: path of the file.
+    :param sample_size: bytes in each of the three samples. small files are read entirely.
+    :return: entropy in [0, 8]. 0 for empty files.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        if size <= 3 * sample_size:
+            data = f.read()
+        else:
+            data = b''
+            for offset in (0, (size - sample_size) // 2, size - sample_size):
+                f.seek(offset)
+                data += f.read(sample_size)
+    if not data:
+        return 0.0
+    total = len(data)
+    return -sum(count / total * math.log2(count / total) for count in collections.Counter(data).values())
+
+
+def is_compressible(path: str, sample: bool = True) -> bool:
+    """ whether a file is worth compressing during transfer.
+
+    :param path: path of the file.
+    :param sample: whether to sample the content of files with unknown extensions. If not, they are compressible.
+    :return:
+    """
+    extension = get_extension(path)
+    if extension in INCOMPRESSIBLE_EXTENSIONS:
+        return False
+    if extension in COMPRESSIBLE_EXTENSIONS or not sample:
+        return True
+    return estimate_entropy(path) < ENTROPY_THRESHOLD
+
+
+def get_skip_compress_arg() -> str:
+    """ the value for rsync's ``--skip-compress`` option, so that rsync skips incompressible files by itself. """
+    return '/'.join(sorted(INCOMPRESSIBLE_EXTENSIONS))
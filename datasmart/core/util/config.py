@@ -1,44 +1,208 @@
+import copy
+import hashlib
+import importlib
 import json
 import os
 import pkgutil
-from .io import load_file
+from .io import load_file, save_file
 from datasmart.core import global_config
 
+# name of the precompiled config bundle under ``config`` of a project. see :func:`build_config_bundle`.
+_BUNDLE_NAME = '_bundle_.json'
+_BUNDLE_VERSION = 2
 
-def load_config(module_name: tuple, filename='config.json', load_json=True):
-    """ load the config file for this module.
+# bundle path -> (stat signature of bundle file, bundle or None if invalid). so each bundle is read only once.
+_bundle_cache = {}
 
-    It will perform the following steps:
 
-    1. get the config file ``config/{os.sep.join(module_name)}/config.json``, where ``/`` is ``\`` for Windows,
-       under the directory consisting the invoked Python script.
-    2. if the above step fails, load the default one provided by the module.
+def _get_layer_paths(module_name: tuple, filename: str, project_root: str) -> tuple:
+    """ paths of the project and global layers of a config file, in the order of precedence."""
+    path_list = (project_root, 'config') + module_name + (filename,)
+    path_list_global = (os.path.expanduser('~'), '.datasmart', 'config') + module_name + (filename,)
+    return os.path.join(*path_list), os.path.join(*path_list_global)
 
 
-    :param filename: which file to load. by default, ``config.json``.
-    :param module_name: module name as a list of strings, "AA.BB" is represented as ``["AA","BB"]``
-    :param load_json: whether parse the string as JSON or not.
-    :return: the JSON object of the module config file, or the raw string.
+def _get_package_path(module_name: tuple, filename: str):
+    """ path of the default config file provided by the module, or None if it's not a plain file."""
+    try:
+        package = importlib.import_module(global_config['root_package_spec'] + '.config.' + '.'.join(module_name))
+    except ImportError:
+        return None
+    for package_dir in getattr(package, '__path__', []):
+        package_path = os.path.join(package_dir, filename)
+        if os.path.isfile(package_path):
+            return package_path
+    return None
+
+
+def _stat_signature(path):
+    if path is None:
+        return None
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return None
+    return [stat_result.st_mtime_ns, stat_result.st_size]
+
+
+def _load_config_layered(module_name: tuple, filename: str, project_root: str) -> tuple:
+    """ load the raw config string by walking the three layers.
+
+    :return: the raw string, and which layer it comes from.
     """
-    path_list = (global_config['project_root'], 'config') + module_name + (filename,)
-    config_path = os.path.join(*path_list)
-    path_list_global = (os.path.expanduser('~'), '.datasmart', 'config') + module_name + (filename,)
-    config_path_global = os.path.join(*path_list_global)
+    config_path, config_path_global = _get_layer_paths(module_name, filename, project_root)
     a = os.path.exists(config_path)
     b = os.path.exists(config_path_global)
     if a or b:
         if a:
             # step 1. load config in current project.
-            file_to_use = config_path
+            file_to_use, layer = config_path, 'project'
         else:
             # step 2. load config in ~/.datasmart
-            file_to_use = config_path_global
+            file_to_use, layer = config_path_global, 'global'
 
         config = load_file(file_to_use, load_json=False)
     else:
         # step 3. load default config
         config = pkgutil.get_data(
             global_config['root_package_spec'] + '.config.' + '.'.join(module_name), filename).decode()
+        layer = 'package'
+    return config, layer
+
+
+def _get_bundle_key(module_name: tuple, filename: str) -> str:
+    return '/'.join(module_name + (filename,))
+
+
+def _get_bundle_signature(module_name: tuple, filename: str, project_root: str, package_path) -> list:
+    """ stat signature of all three layers of a config file. if it changes, the bundled entry is stale."""
+    return [_stat_signature(p) for p in _get_layer_paths(module_name, filename, project_root) + (package_path,)]
+
+
+def _hash_bundle_entries(entries: dict) -> str:
+    return hashlib.sha1(json.dumps(entries, sort_keys=True).encode()).hexdigest()
+
+
+def get_bundle_path(project_root: str = None) -> str:
+    if project_root is None:
+        project_root = global_config['project_root']
+    return os.path.join(project_root, 'config', _BUNDLE_NAME)
+
+
+def build_config_bundle(module_files: list, project_root: str = None, schemas: dict = None) -> dict:
+    """ resolve a set of config files through the layered lookup, validate them, and put them into one bundle.
+
+    JSON files are stored parsed, so :func:`load_config` doesn't parse them again, along with their raw strings.
+    ``schema.json`` files are checked to be valid JSON schemas, and files in ``schemas`` are validated against them.
+
+    :param module_files: a list of ``(module_name, filename)``, like ``(('core', 'db'), 'config.json')``.
+    :param project_root: the project to build bundle for. By default, the current one.
+    :param schemas: a dict from bundle keys, like ``'core/filetransfer/config.json'``, to JSON schemas.
+    :return: the bundle, with an integrity hash. JSON files that are not valid JSON (yet), such as config files to be
+        filled out by the user, are left out, and they will be loaded through the layered lookup. Invalid ones
+        (against their schemas) raise an error.
+    """
+    # schemautil imports jsl, which is not needed to load configs.
+    from datasmart.core import schemautil
+    from jsonschema import Draft4Validator
+    if project_root is None:
+        project_root = global_config['project_root']
+    if schemas is None:
+        schemas = {}
+    entries = {}
+    for module_name, filename in module_files:
+        module_name = tuple(module_name)
+        key = _get_bundle_key(module_name, filename)
+        content, layer = _load_config_layered(module_name, filename, project_root)
+        entry = {'content': content}
+        if filename.endswith('.json'):
+            try:
+                entry['value'] = json.loads(content)
+            except ValueError:
+                print('{} of {} is not valid JSON, not bundled.'.format(filename, '.'.join(module_name)))
+                continue
+            if filename == 'schema.json':
+                Draft4Validator.check_schema(entry['value'])
+            if key in schemas:
+                schemautil.validate(schemas[key], entry['value'])
+        package_path = _get_package_path(module_name, filename)
+        entry.update({
+            'layer': layer,
+            'package_path': package_path,
+            'signature': _get_bundle_signature(module_name, filename, project_root, package_path),
+        })
+        entries[key] = entry
+    return {'version': _BUNDLE_VERSION, 'sha1': _hash_bundle_entries(entries), 'entries': entries}
+
+
+def save_config_bundle(bundle: dict, project_root: str = None) -> str:
+    """ save a bundle built by :func:`build_config_bundle` into the project.
+
+    :return: the path of saved bundle.
+    """
+    bundle_path = get_bundle_path(project_root)
+    os.makedirs(os.path.dirname(bundle_path), exist_ok=True)
+    # keys are not sorted, to keep parsed configs in the order of their files.
+    save_file(bundle_path, json.dumps(bundle, indent=2))
+    _bundle_cache.pop(bundle_path, None)
+    return bundle_path
+
+
+def _get_bundle(project_root: str):
+    """ the bundle of the project, or None if there's no valid one."""
+    bundle_path = get_bundle_path(project_root)
+    signature = _stat_signature(bundle_path)
+    if signature is None:
+        return None
+    if bundle_path in _bundle_cache and _bundle_cache[bundle_path][0] == signature:
+        return _bundle_cache[bundle_path][1]
+    bundle = load_file(bundle_path, load_json=True)
+    if bundle.get('version') != _BUNDLE_VERSION or _hash_bundle_entries(bundle['entries']) != bundle['sha1']:
+        print('config bundle {} is corrupted, ignored. reinstall the project to rebuild it.'.format(bundle_path))
+        bundle = None
+    _bundle_cache[bundle_path] = (signature, bundle)
+    return bundle
+
+
+def _load_config_from_bundle(module_name: tuple, filename: str, project_root: str):
+    """ the bundle entry of a config file, or None if it's not there or stale."""
+    bundle = _get_bundle(project_root)
+    if bundle is None:
+        return None
+    entry = bundle['entries'].get(_get_bundle_key(module_name, filename))
+    if entry is None:
+        return None
+    if _get_bundle_signature(module_name, filename, project_root, entry['package_path']) != entry['signature']:
+        return None
+    return entry
+
+
+def load_config(module_name: tuple, filename='config.json', load_json=True):
+    """ load the config file for this module.
+
+    It will perform the following steps:
+
+    0. if the project has a precompiled config bundle (see :func:`build_config_bundle`) with a fresh entry for this
+       file, use it.
+    1. get the config file ``config/{os.sep.join(module_name)}/config.json``, where ``/`` is ``\`` for Windows,
+       under the directory consisting the invoked Python script.
+    2. if the above step fails, get the config file under ``~/.datasmart/config``.
+    3. if the above step fails, load the default one provided by the module.
+
+
+    :param filename: which file to load. by default, ``config.json``.
+    :param module_name: module name as a list of strings, "AA.BB" is represented as ``["AA","BB"]``
+    :param load_json: whether parse the string as JSON or not.
+    :return: the JSON object of the module config file, or the raw string.
+    """
+    entry = _load_config_from_bundle(module_name, filename, global_config['project_root'])
+    if entry is not None:
+        if load_json and 'value' in entry:
+            # the bundle is shared by all loads.
+            return copy.deepcopy(entry['value'])
+        config = entry['content']
+    else:
+        config, _ = _load_config_layered(module_name, filename, global_config['project_root'])
     if load_json:
         config = json.loads(config)
     return config
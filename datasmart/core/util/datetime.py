@@ -1,12 +1,20 @@
 from datetime import datetime
 
-import pytz
-from strict_rfc3339 import rfc3339_to_timestamp, validate_rfc3339
-
 from datasmart.core.util.config import load_config
 
-util_config = load_config(('core', 'util'), filename='config.json', load_json=True)
-local_tz = pytz.timezone(util_config['timezone'])
+# pytz and strict_rfc3339 are imported, and the util config is read, only on first use.
+# this keeps ``import datasmart.core.util.datetime`` (thus importing actions) fast.
+_local_tz = None
+
+
+def get_local_tz():
+    """return the local timezone defined in the config of ``core.util``, loading it on first call."""
+    global _local_tz
+    if _local_tz is None:
+        import pytz
+        util_config = load_config(('core', 'util'), filename='config.json', load_json=True)
+        _local_tz = pytz.timezone(util_config['timezone'])
+    return _local_tz
 
 
 # datetime: naive, zone unspecified.
@@ -20,6 +28,7 @@ local_tz = pytz.timezone(util_config['timezone'])
 # rfc3339_utc is a rfc3339_local
 
 def datetime_local_to_rfc3339_local(dt: datetime):
+    from strict_rfc3339 import validate_rfc3339
     assert dt.tzinfo is not None
     rfc3339_local = dt.replace(microsecond=0).isoformat()
     assert validate_rfc3339(rfc3339_local)
@@ -27,6 +36,8 @@ def datetime_local_to_rfc3339_local(dt: datetime):
 
 
 def datetime_local_to_rfc3339_utc(dt: datetime):
+    import pytz
+    from strict_rfc3339 import validate_rfc3339
     assert dt.tzinfo is not None
     rfc3339_utc = dt.astimezone(pytz.utc).replace(microsecond=0).isoformat()
     assert validate_rfc3339(rfc3339_utc)
@@ -36,28 +47,32 @@ def datetime_local_to_rfc3339_utc(dt: datetime):
 def datetime_to_datetime_local(dt, is_dst=None):
     """converts an naive dt to local dt, basically getting the correct offset"""
     # `is_dst=None` make sure it will crash when dealing with ambiguous time.
-    return local_tz.localize(dt, is_dst=is_dst)
+    return get_local_tz().localize(dt, is_dst=is_dst)
 
 
 def datetime_to_datetime_utc(dt, is_dst=None):
     """add utc info to dt"""
+    import pytz
     return pytz.utc.localize(dt, is_dst=is_dst)
 
 
 def datetime_local_to_local(dt):
     assert dt.tzinfo is not None
-    return dt.astimezone(local_tz)
+    return dt.astimezone(get_local_tz())
 
 
 def rfc3339_to_datetime(rfc3339str):
     """returns a naive UTC datetime object representing the given rfc3339 timestamp"""
+    from strict_rfc3339 import rfc3339_to_timestamp
     return datetime.utcfromtimestamp(
         rfc3339_to_timestamp(rfc3339str))
 
 
 def now_rfc3339_local():
     """return current time, in RFC3339 format, and zone of local_tz"""
-    rfc3339_local = pytz.utc.localize(datetime.utcnow()).astimezone(local_tz).replace(microsecond=0).isoformat()
+    import pytz
+    from strict_rfc3339 import validate_rfc3339
+    rfc3339_local = pytz.utc.localize(datetime.utcnow()).astimezone(get_local_tz()).replace(microsecond=0).isoformat()
     # for simplicity, the microsecond part is always truncated, since Mongo may not save them in same resolution
     assert validate_rfc3339(rfc3339_local)
     return rfc3339_local
@@ -65,6 +80,8 @@ def now_rfc3339_local():
 
 def now_rfc3339_utc():
     """return current time, in RFC3339 format, and UTC"""
+    import pytz
+    from strict_rfc3339 import validate_rfc3339
     rfc3339_utc = pytz.utc.localize(datetime.utcnow()).replace(microsecond=0).isoformat()
     assert validate_rfc3339(rfc3339_utc)
     return rfc3339_utc
@@ -0,0 +1,176 @@
+"""cache of files fetched from remote sites, shared by all fetches on this host, with LRU eviction under a byte budget.
+
+cached files are keyed by ``(actual site, path, size, mtime)`` of the remote file, so a file changed on the remote
+site is never served from the cache. They live under ``objects`` of the cache dir, and an index (``index.json``)
+records their sizes and when they were last used. The index is guarded by ``flock``, so concurrent fetches, even of
+different users, can share the cache safely: files are added by atomic renames, and served by first hard linking them
+into a staging dir while holding the lock, so they can't be evicted in the middle, and then copying them from there
+without the lock, so other fetches don't wait for the copies. When the cache is over budget, least recently used files
+are removed, which doesn't affect fetched files, including hard linked ones.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import datasmart.core.util.localcopy
+
+# counters of this process, see :func:`get_stats`.
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+_stats_lock = threading.Lock()
+
+
+def get_key(host: str, prefix: str, path: str, size: int, mtime: int) -> str:
+    """ key of a remote file in the cache.
+
+    :param host: ``path`` of the actual remote site.
+    :param prefix: ``prefix`` of the actual remote site.
+    :param path: normalized path of the file relative to the site.
+    :param size: size of the file.
+    :param mtime: modification time of the file, in integral seconds.
+    :return: a hex string.
+    """
+    return hashlib.sha1(json.dumps([host, prefix, path, size, mtime]).encode()).hexdigest()
+
+
+def get_stats() -> dict:
+    """ cache ``hits``, ``misses`` and ``evictions`` of all fetches in this process so far. """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _add_stats(**kwargs) -> None:
+    with _stats_lock:
+        for key, value in kwargs.items():
+            _stats[key] += value
+
+
+class FetchCache:
+    """ a cache directory with a budget. Objects are cheap; make one for each fetch. """
+
+    def __init__(self, cache_dir: str, budget: int) -> None:
+        """
+        :param cache_dir: the cache directory. created if needed.
+        :param budget: maximum total size of cached files, in bytes.
+        """
+        assert budget > 0
+        self.cache_dir = cache_dir
+        self.budget = budget
+        os.makedirs(os.path.join(cache_dir, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(cache_dir, 'tmp'), exist_ok=True)
+
+    def _get_object_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, 'objects', key[:2], key)
+
+    def _update_index(self, func):
+        """ read, modify and write the index under an exclusive lock.
+
+        :param func: called with the index, a dict from key to ``{'size', 'last_used'}``, which it can modify in place.
+        :return: return value of ``func``.
+        """
+        import fcntl
+        fd = os.open(os.path.join(self.cache_dir, 'index.json'), os.O_RDWR | os.O_CREAT, 0o666)
+        with os.fdopen(fd, 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                content = f.read()
+                index = json.loads(content) if content else {}
+                ret = func(index)
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(index))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return ret
+
+    def checkout(self, pairs: list, hardlink: bool = False) -> list:
+        """ serve cached files.
+
+        :param pairs: a list of ``(key, dst)``. ``dst`` is replaced by the cached file if it's there.
+        :param hardlink: hard link ``dst`` to the cached file, instead of copying it (by reflink if possible).
+            see :func:`datasmart.core.util.localcopy.copy_file`.
+        :return: whether each file is served from the cache.
+        """
+        pin_dir = self.make_staging_dir()
+
+        def checkout_inner(index):
+            # pin hits by hard links, so they survive eviction until copied.
+            pins = []
+            now = time.time()
+            for idx, (key, _) in enumerate(pairs):
+                object_path = self._get_object_path(key)
+                if key in index and os.path.exists(object_path):
+                    pin_path = os.path.join(pin_dir, str(idx))
+                    try:
+                        os.link(object_path, pin_path)
+                    except OSError:
+                        # no hard links on this file system.
+                        datasmart.core.util.localcopy.copy_file(object_path, pin_path)
+                    index[key]['last_used'] = now
+                    pins.append(pin_path)
+                else:
+                    # removed by someone else.
+                    index.pop(key, None)
+                    pins.append(None)
+            return pins
+
+        try:
+            pins = self._update_index(checkout_inner)
+            for pin_path, (_, dst) in zip(pins, pairs):
+                if pin_path is not None:
+                    datasmart.core.util.localcopy.copy_file(pin_path, dst, hardlink=hardlink)
+        finally:
+            shutil.rmtree(pin_dir)
+        hits = [pin_path is not None for pin_path in pins]
+        _add_stats(hits=sum(hits), misses=len(hits) - sum(hits))
+        return hits
+
+    def make_staging_dir(self) -> str:
+        """ a new directory to download files into, on the same file system as the cache. remove it after use. """
+        return tempfile.mkdtemp(dir=os.path.join(self.cache_dir, 'tmp'))
+
+    def add(self, pairs: list) -> None:
+        """ move files into the cache, and then evict least recently used files if it's over budget.
+
+        :param pairs: a list of ``(key, path)``, where path is usually in a staging dir. files larger than the budget
+            are not added, and stay where they are.
+        """
+        def add_inner(index):
+            now = time.time()
+            for key, path in pairs:
+                size = os.path.getsize(path)
+                if size > self.budget:
+                    continue
+                object_path = self._get_object_path(key)
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                os.replace(path, object_path)
+                index[key] = {'size': size, 'last_used': now}
+            return self._evict(index)
+
+        _add_stats(evictions=self._update_index(add_inner))
+
+    def _evict(self, index: dict) -> int:
+        """ remove least recently used files until the cache is within budget.
+
+        :return: number of files removed.
+        """
+        total = sum(x['size'] for x in index.values())
+        num_evicted = 0
+        for key in sorted(index, key=lambda k: index[k]['last_used']):
+            if total <= self.budget:
+                break
+            try:
+                os.remove(self._get_object_path(key))
+            except FileNotFoundError:
+                pass
+            total -= index.pop(key)['size']
+            num_evicted += 1
+        return num_evicted
+
+    def get_usage(self) -> int:
+        """ total size of cached files, in bytes. """
+        return self._update_index(lambda index: sum(x['size'] for x in index.values()))
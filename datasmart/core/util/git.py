@@ -1,24 +1,204 @@
+"""helpers to record and check code provenance in git repositories.
+
+the url of a remote and the commit of ``HEAD`` are read directly from ``.git`` (``HEAD``, loose refs, ``packed-refs``
+and ``config``) without running ``git``, and cached for the rest of the run. A cached value is reused as long as
+the files it's read from are not changed, judged by their modification times and sizes, so a new commit or checkout
+is picked up. Anything not understood here, such as ``insteadOf`` url rewriting or ``include`` in config, falls back
+to running ``git``, and so do status and branch containment checks.
+"""
+import os
 import subprocess
 import string
 import re
+import threading
 from ..schemautil import stringpatterns
 
 _sha1_checker = re.compile(stringpatterns.StringPatterns.sha1Pattern)
+# matches a character not in ``string.printable``, so that output is checked with one search.
+_non_printable_re = re.compile('[^' + re.escape(string.printable) + ']')
+# a ``[remote "name"]`` section header in git config, where the name has no quote or backslash.
+_remote_section_re = re.compile(r'\[\s*remote\s+"([^"\\]*)"\s*\]')
+# environment variables changing where git looks for a repo or config, under which we always run ``git``.
+_git_env_vars = ('GIT_DIR', 'GIT_WORK_TREE', 'GIT_COMMON_DIR', 'GIT_CONFIG', 'GIT_CONFIG_GLOBAL', 'GIT_CONFIG_SYSTEM',
+                 'GIT_CONFIG_COUNT', 'GIT_CONFIG_PARAMETERS')
+
+# per-run cache. (what, real path of repo, args) -> (signature of files read, value).
+_cache = {}
+_cache_lock = threading.Lock()
 
 
 def get_cmd_output(cmds, cwd):
     result = subprocess.check_output(cmds, cwd=cwd).decode()
-    for x in result:
-        assert x in string.printable
+    match = _non_printable_re.search(result)
+    assert match is None, "output has non printable character {}".format(repr(match.group()))
     return result
 
 
+def clear_cache():
+    """ forget everything read from ``.git`` so far. Only needed when a repo is changed within the same second, on a
+    file system with coarse modification times.
+    """
+    with _cache_lock:
+        _cache.clear()
+
+
+def _get_signature(paths):
+    """ modification times and sizes of files, or None for missing ones. """
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append((path, None, None))
+    return tuple(signature)
+
+
+def _read_file(path, files_read):
+    """ content of a text file, or None if it's missing. the signature of ``path``, taken before reading it, is added
+    to ``files_read`` either way.
+    """
+    files_read.append(_get_signature([path])[0])
+    try:
+        with open(path, 'rt') as f:
+            return f.read()
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+def _find_git_dir(repopath, files_read):
+    """ find the git dir of a working tree containing ``repopath``.
+
+    :return: ``(git dir, common dir)``, which differ for linked worktrees, or None if it's not found in a form
+        understood here, such as a bare repo.
+    """
+    if any(x in os.environ for x in _git_env_vars):
+        return None
+    path = os.path.realpath(repopath)
+    while True:
+        dot_git = os.path.join(path, '.git')
+        if os.path.isdir(dot_git):
+            git_dir = dot_git
+            break
+        if os.path.isfile(dot_git):
+            # a linked worktree or a submodule, with ``gitdir: <path>`` in ``.git``.
+            content = _read_file(dot_git, files_read)
+            if content is None or not content.startswith('gitdir: '):
+                return None
+            git_dir = os.path.normpath(os.path.join(path, content[len('gitdir: '):].strip()))
+            break
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+    common_dir = _read_file(os.path.join(git_dir, 'commondir'), files_read)
+    if common_dir is None:
+        common_dir = git_dir
+    else:
+        common_dir = os.path.normpath(os.path.join(git_dir, common_dir.strip()))
+    return git_dir, common_dir
+
+
+def _read_packed_refs(common_dir, files_read):
+    """ ref name -> sha1 in ``packed-refs``. """
+    refs = {}
+    content = _read_file(os.path.join(common_dir, 'packed-refs'), files_read)
+    for line in (content or '').splitlines():
+        # comments, and peeled tags (``^<sha1>``) following their tags.
+        if line.startswith('#') or line.startswith('^'):
+            continue
+        sha1, _, ref = line.partition(' ')
+        refs[ref.strip()] = sha1
+    return refs
+
+
+def _resolve_ref(git_dir, common_dir, ref, files_read):
+    """ sha1 of a ref, such as ``HEAD`` or ``refs/heads/master``, following symbolic refs, or None if not found. """
+    # a few levels of symbolic refs at most, as git does.
+    for _ in range(5):
+        # ``HEAD`` is per worktree, and other refs are shared.
+        content = _read_file(os.path.join(git_dir if ref == 'HEAD' else common_dir, ref), files_read)
+        if content is None:
+            return _read_packed_refs(common_dir, files_read).get(ref)
+        content = content.strip()
+        if not content.startswith('ref: '):
+            return content
+        ref = content[len('ref: '):].strip()
+    return None
+
+
+def _read_remote_url(common_dir, remote_name, files_read):
+    """ first ``url`` of a remote in the repo's config, or None if it's not there, or the config (including global
+    ones, as they may rewrite urls) has anything not understood here.
+    """
+    home = os.path.expanduser('~')
+    global_configs = [os.path.join(home, '.gitconfig'), '/etc/gitconfig',
+                      os.path.join(os.environ.get('XDG_CONFIG_HOME', os.path.join(home, '.config')), 'git', 'config')]
+    for path in global_configs:
+        content = _read_file(path, files_read)
+        if content is not None and ('insteadof' in content.lower() or '[include' in content.lower()):
+            return None
+    content = _read_file(os.path.join(common_dir, 'config'), files_read)
+    if content is None or 'insteadof' in content.lower() or '[include' in content.lower():
+        return None
+    section = None
+    for line in content.splitlines():
+        line = line.strip()
+        if not line or line[0] in '#;':
+            continue
+        if line.startswith('['):
+            match = _remote_section_re.fullmatch(line)
+            section = match.group(1) if match else None
+            continue
+        key, _, value = line.partition('=')
+        if section == remote_name and key.strip().lower() == 'url':
+            value = value.strip()
+            # quoting, escaping and comments are left to git.
+            if not value or any(c in value for c in '"\\#;'):
+                return None
+            return value
+    return None
+
+
+def _cached(what, repopath, args, read_func):
+    """ a value read from ``.git`` by ``read_func(files_read)``, cached while the files it reads are unchanged.
+
+    :return: the value, or None if ``read_func`` can't get it, in which case nothing is cached.
+    """
+    key = (what, os.path.realpath(repopath), args)
+    with _cache_lock:
+        entry = _cache.get(key)
+    if entry is not None and _get_signature([x[0] for x in entry[0]]) == entry[0]:
+        return entry[1]
+    files_read = []
+    value = read_func(files_read)
+    # only cache it if no file changed while reading, otherwise the value may be stale under a newer signature.
+    signature = tuple(files_read)
+    if value is not None and _get_signature([x[0] for x in signature]) == signature:
+        with _cache_lock:
+            _cache[key] = (signature, value)
+    return value
+
+
 def get_git_repo_url(repopath, remote_name='origin'):
-    return get_cmd_output(['git', 'ls-remote', '--get-url', remote_name], cwd=repopath).strip()
+    def read_func(files_read):
+        dirs = _find_git_dir(repopath, files_read)
+        return None if dirs is None else _read_remote_url(dirs[1], remote_name, files_read)
+
+    result = _cached('url', repopath, remote_name, read_func)
+    if result is None:
+        result = get_cmd_output(['git', 'ls-remote', '--get-url', remote_name], cwd=repopath).strip()
+    return result
 
 
 def get_git_repo_hash(repopath):
-    result = get_cmd_output(['git', 'rev-parse', '--verify', 'HEAD'], cwd=repopath).strip()
+    def read_func(files_read):
+        dirs = _find_git_dir(repopath, files_read)
+        return None if dirs is None else _resolve_ref(dirs[0], dirs[1], 'HEAD', files_read)
+
+    result = _cached('hash', repopath, None, read_func)
+    if result is None or not _sha1_checker.fullmatch(result):
+        result = get_cmd_output(['git', 'rev-parse', '--verify', 'HEAD'], cwd=repopath).strip()
     assert _sha1_checker.fullmatch(result)
     return result
 
@@ -61,3 +241,31 @@ def check_commit_in_remote(repopath, commit_sha1, remote_name='origin', remote_b
     # a space, then remote_name/remote_branch, then \n.
     #print(result_raw)
     return result_raw.find(' {}/{}\n'.format(remote_name, remote_branch)) != -1
+
+
+def check_commits_in_remote(repopath, commit_sha1_list, remote_name='origin', remote_branch='master'):
+    """check many commits against remote tracking branch `remote_name`/`remote_branch` at once.
+
+    it runs ``git rev-list`` of the branch once, instead of ``git branch --contains`` for each commit as
+    :func:`check_commit_in_remote` does.
+
+    Parameters
+    ----------
+    repopath
+    commit_sha1_list
+        list of full sha1 of commits.
+    remote_name
+    remote_branch
+
+    Returns
+    -------
+    a list of bool, whether each commit is in the branch. Unknown commits are not in the branch.
+    """
+    for commit_sha1 in commit_sha1_list:
+        assert _sha1_checker.fullmatch(commit_sha1), 'you must give a valid sha1'
+    if not commit_sha1_list:
+        return []
+    result_raw = get_cmd_output(['git', 'rev-list', 'refs/remotes/{}/{}'.format(remote_name, remote_branch), '--'],
+                                cwd=repopath)
+    commits_in_remote = set(result_raw.split())
+    return [commit_sha1 in commits_in_remote for commit_sha1 in commit_sha1_list]
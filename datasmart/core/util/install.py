@@ -0,0 +1,161 @@
+"""incremental installation of generated files, such as configs and start scripts, into a directory.
+
+every file written by an installer is recorded with the sha1 of its content in a manifest (``_MANIFEST_NAME`` under
+the directory). On the next run, a file whose content would be the same is not written again, a file changed since it
+was installed (its sha1 differs from the one in manifest) is kept as the user left it, and files installed before but
+no longer generated are removed (after asking, if the installer wants to), unless changed as well. Other files in the
+directory, such as prepare results of actions, are never touched.
+
+directories installed by older versions have no manifest, so all their files would be kept as changed by the user.
+Install with ``adopt`` once to take them over.
+"""
+import collections
+import hashlib
+import json
+import os
+import stat
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from .io import get_file_sha1
+
+_MANIFEST_NAME = '.datasmart_install.json'
+# what can happen to each file, in the order they are reported.
+STATUSES = ('created', 'updated', 'removed', 'kept', 'unchanged')
+# umask of the process, read once here, as reading it means setting it, which is not safe with threads writing files.
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+def load_manifest(root: str) -> dict:
+    """ relative path -> sha1 of content, for files installed under ``root``. empty if nothing is installed. """
+    try:
+        with open(os.path.join(root, _MANIFEST_NAME), 'rt', encoding='utf-8') as f:
+            return json.loads(f.read())
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(root: str, manifest: dict) -> None:
+    _write_atomic(os.path.join(root, _MANIFEST_NAME), json.dumps(manifest, indent=2, sort_keys=True).encode())
+
+
+def _write_atomic(path: str, content: bytes, executable: bool = False) -> None:
+    """ write a file through a temp file and rename, so it's never seen half written. """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.' + os.path.basename(path) + '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        # mkstemp gives 0o600. use what a plain ``open`` would give.
+        mode = 0o666 & ~_umask
+        if executable:
+            mode |= stat.S_IEXEC
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def _remove_empty_parents(root: str, path: str) -> None:
+    """ remove directories containing ``path`` that become empty, up to ``root`` (exclusive). """
+    parent = os.path.dirname(path)
+    while os.path.abspath(parent) != os.path.abspath(root):
+        try:
+            os.rmdir(parent)
+        except OSError:
+            break
+        parent = os.path.dirname(parent)
+
+
+def install_file(root: str, relpath: str, content: bytes, manifest: dict, executable: bool = False,
+                 adopt: bool = False) -> str:
+    """ install one file, unless it's up to date or changed by the user.
+
+    :param root: directory to install into.
+    :param relpath: path of the file relative to ``root``.
+    :param content: content of the file.
+    :param manifest: manifest of ``root``, see :func:`load_manifest`. updated in place. different files can be
+        installed concurrently with the same manifest.
+    :param executable: make the file executable by its owner.
+    :param adopt: overwrite the file if it's there but not in the manifest, as if it was installed before.
+    :return: one of ``STATUSES``.
+    """
+    path = os.path.join(root, relpath)
+    new_sha1 = hashlib.sha1(content).hexdigest()
+    try:
+        old_sha1 = get_file_sha1(path)
+    except FileNotFoundError:
+        old_sha1 = None
+    if old_sha1 == new_sha1:
+        status = 'unchanged'
+        if executable and not os.stat(path).st_mode & stat.S_IEXEC:
+            os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    elif old_sha1 is not None and old_sha1 != manifest.get(relpath) and not (adopt and relpath not in manifest):
+        # changed by the user, or not installed by us at all. the manifest is left as is, so it stays that way.
+        return 'kept'
+    else:
+        _write_atomic(path, content, executable)
+        status = 'created' if old_sha1 is None else 'updated'
+    manifest[relpath] = new_sha1
+    return status
+
+
+def install_files(root: str, files: list, max_workers: int = None, confirm_remove=None, adopt: bool = False) -> dict:
+    """ install files into ``root`` concurrently, remove files no longer installed, and save the manifest.
+
+    :param root: directory to install into. created if needed.
+    :param files: a list of ``(relative path, content, executable)``, with distinct paths.
+    :param max_workers: number of threads. By default, as ``ThreadPoolExecutor``.
+    :param confirm_remove: called with the sorted relative paths of files to be removed, if any, before removing them.
+        if it returns False, they stay installed (``unchanged``). By default, they are removed without asking.
+    :param adopt: see :func:`install_file`.
+    :return: relative path -> status (one of ``STATUSES``), for files installed now or before.
+    """
+    assert len({x[0] for x in files}) == len(files), 'files to install must have distinct paths!'
+    os.makedirs(root, exist_ok=True)
+    manifest = load_manifest(root)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        statuses = dict(zip((x[0] for x in files),
+                            executor.map(lambda x: install_file(root, x[0], x[1], manifest, x[2], adopt), files)))
+    to_remove = []
+    for relpath in sorted(set(manifest) - set(statuses)):
+        try:
+            changed = get_file_sha1(os.path.join(root, relpath)) != manifest[relpath]
+        except FileNotFoundError:
+            # removed by the user.
+            del manifest[relpath]
+            continue
+        if changed:
+            # a changed one is the user's now.
+            del manifest[relpath]
+            statuses[relpath] = 'kept'
+        else:
+            to_remove.append(relpath)
+    if to_remove and (confirm_remove is None or confirm_remove(to_remove)):
+        for relpath in to_remove:
+            path = os.path.join(root, relpath)
+            os.remove(path)
+            del manifest[relpath]
+            statuses[relpath] = 'removed'
+            _remove_empty_parents(root, path)
+    else:
+        statuses.update((relpath, 'unchanged') for relpath in to_remove)
+    save_manifest(root, manifest)
+    return statuses
+
+
+def format_summary(statuses: dict) -> str:
+    """ a summary of what :func:`install_files` did, with the counts of each status and files that are not unchanged.
+    """
+    counter = collections.Counter(statuses.values())
+    lines = ['{} files: '.format(len(statuses)) + ', '.join('{} {}'.format(counter[x], x) for x in STATUSES)]
+    for status in STATUSES[:-1]:
+        for relpath in sorted(p for p, s in statuses.items() if s == status):
+            lines.append('  {:<8} {}'.format(status, relpath))
+    if counter['kept']:
+        lines.append('kept files are changed since they were installed, or not installed by this installer, and '
+                     'left as they are. remove them and install again to get the new ones, or install with --adopt '
+                     'to overwrite those not installed by this installer.')
+    return '\n'.join(lines)
@@ -1,3 +1,4 @@
+import hashlib
 import json
 
 def load_file(savepath, load_json=True):
@@ -12,4 +13,13 @@ def load_file(savepath, load_json=True):
 def save_file(savepath, content):
     """just created to have higher GPA in code climate"""
     with open(savepath, 'wt', encoding='utf-8') as f:
-        f.write(content)
\ No newline at end of file
+        f.write(content)
+
+
+def get_file_sha1(path, chunk_size=1024 * 1024):
+    """sha1 hex digest of a file's content, read in chunks"""
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
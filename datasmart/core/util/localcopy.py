@@ -0,0 +1,199 @@
+"""native copy of files between two local directories, used by file transfer when both sides are local.
+
+for each file, the fastest available way is used, in this order:
+
+1. reflink (``FICLONE``), which shares data blocks on copy-on-write file systems (btrfs, xfs, ...), so no data is
+   copied at all.
+2. ``os.copy_file_range``, which copies in kernel, and possibly on the server side for network file systems.
+3. ``os.sendfile``.
+4. plain read and write.
+
+just like ``rsync -a``, files with the same size and modification time on both sides are skipped, symlinks are
+copied as symlinks, and permission bits and times are preserved. Each file is written to a temporary name first and
+then renamed, so a failed copy never leaves a partial file.
+
+copies can be throttled by a function called with the number of bytes before copying each chunk, such as
+:func:`datasmart.core.util.bandwidth.Lease.throttle`. Reflinks and hard links move no data, so they are not throttled.
+"""
+import errno
+import os
+import shutil
+import stat
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# ioctl request of FICLONE on Linux, from ``linux/fs.h``.
+_FICLONE = 0x40049409
+# errors meaning the method is not available for this pair of files, so that the next one should be tried.
+_FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EBADF,
+                    errno.ETXTBSY, errno.EPERM}
+
+
+def _reflink(fsrc, fdst, size) -> bool:
+    try:
+        import fcntl
+        fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+    except (ImportError, OSError) as e:
+        if isinstance(e, OSError) and e.errno not in _FALLBACK_ERRNOS:
+            raise
+        return False
+    return True
+
+
+def _copy_file_range(fsrc, fdst, size) -> bool:
+    if not hasattr(os, 'copy_file_range'):
+        return False
+    copied = 0
+    while copied < size:
+        try:
+            n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - copied)
+        except OSError as e:
+            # it's fine to give up only if nothing has been written yet.
+            if e.errno in _FALLBACK_ERRNOS and copied == 0:
+                return False
+            raise
+        if n == 0:
+            break
+        copied += n
+    return True
+
+
+def _sendfile(fsrc, fdst, size) -> bool:
+    if not hasattr(os, 'sendfile'):
+        return False
+    copied = 0
+    while copied < size:
+        try:
+            n = os.sendfile(fdst.fileno(), fsrc.fileno(), copied, size - copied)
+        except OSError as e:
+            if e.errno in _FALLBACK_ERRNOS and copied == 0:
+                return False
+            raise
+        if n == 0:
+            break
+        copied += n
+    return True
+
+
+# size of chunks for throttled copy.
+_THROTTLE_CHUNK_SIZE = 1024 * 1024
+
+
+def _copy_throttled(fsrc, fdst, size, throttle) -> None:
+    while True:
+        chunk = fsrc.read(_THROTTLE_CHUNK_SIZE)
+        if not chunk:
+            break
+        throttle(len(chunk))
+        fdst.write(chunk)
+
+
+def _copy_data(src: str, dst: str, throttle=None) -> None:
+    size = os.path.getsize(src)
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        if size == 0:
+            return
+        if _reflink(fsrc, fdst, size):
+            return
+        if throttle is not None:
+            _copy_throttled(fsrc, fdst, size, throttle)
+            return
+        for method in (_copy_file_range, _sendfile):
+            if method(fsrc, fdst, size):
+                return
+        shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+
+
+def is_up_to_date(src: str, dst: str, hardlink: bool = False) -> bool:
+    """ whether copying ``src`` to ``dst`` would be skipped by :func:`copy_file`. """
+    return _is_up_to_date(os.lstat(src), dst, hardlink)
+
+
+def _is_up_to_date(src_stat: os.stat_result, dst: str, hardlink: bool) -> bool:
+    """ rsync's quick check: same size and modification time. for hardlink, it must be the same file. """
+    try:
+        dst_stat = os.lstat(dst)
+    except FileNotFoundError:
+        return False
+    if hardlink:
+        return (src_stat.st_dev, src_stat.st_ino) == (dst_stat.st_dev, dst_stat.st_ino)
+    return src_stat.st_size == dst_stat.st_size and src_stat.st_mtime_ns == dst_stat.st_mtime_ns
+
+
+def copy_file(src: str, dst: str, hardlink: bool = False, throttle=None, link_dest: str = None):
+    """ copy one file, creating parent directories of ``dst`` if needed.
+
+    all missing parents are created, like the directories rsync creates for ``--relative`` paths. Unlike rsync, this
+    includes the destination directory itself and those above it, so callers wanting rsync's behavior (only the last
+    level of the destination directory is created) should create it first, as ``FileTransfer._transfer_local`` does.
+
+    :param src: source file.
+    :param dst: destination file, which will be replaced if it's there.
+    :param hardlink: hard link ``dst`` to ``src`` instead of copying, if they are on the same file system.
+        Then they share content, so only use it when ``dst`` is only going to be read.
+    :param throttle: a function called with the number of bytes before copying each chunk, or None.
+    :param link_dest: an older copy of ``dst``, such as the same file in an earlier snapshot, or None.
+        If it's up to date with ``src``, ``dst`` is hard linked to it instead of copied, like ``rsync --link-dest``.
+    :return: number of bytes copied (0 if hard linked), or None if skipped as up to date, or hard linked to
+        ``link_dest``, as rsync doesn't report those either.
+    """
+    src_stat = os.lstat(src)
+    if _is_up_to_date(src_stat, dst, hardlink):
+        return None
+    linked_to_dest = link_dest is not None and not stat.S_ISLNK(src_stat.st_mode) and _is_up_to_date(
+        src_stat, link_dest, False)
+    if linked_to_dest:
+        src, hardlink = link_dest, True
+    dst_dir = os.path.dirname(dst)
+    os.makedirs(dst_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix='.' + os.path.basename(dst) + '.', dir=dst_dir)
+    os.close(fd)
+    copied = 0
+    try:
+        os.remove(tmp)
+        if os.path.islink(src):
+            os.symlink(os.readlink(src), tmp)
+        else:
+            linked = False
+            if hardlink:
+                try:
+                    os.link(src, tmp)
+                    linked = True
+                except OSError as e:
+                    if e.errno not in _FALLBACK_ERRNOS:
+                        raise
+            if not linked:
+                _copy_data(src, tmp, throttle)
+                shutil.copystat(src, tmp)
+                copied = src_stat.st_size
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        raise
+    return None if linked_to_dest and not copied else copied
+
+
+def copy_files(pairs: list, hardlink: bool = False, workers: int = 1, throttle=None, link_dests: list = None) -> list:
+    """ copy a list of files, with a pool of threads.
+
+    :param pairs: a list of ``(src, dst)``.
+    :param hardlink: see :func:`copy_file`.
+    :param workers: number of threads.
+    :param throttle: see :func:`copy_file`. it's shared by all threads.
+    :param link_dests: ``link_dest`` of :func:`copy_file` for each pair, or None.
+    :return: result of :func:`copy_file` for each pair. If any copy fails, its exception is raised after all copies
+        finish.
+    """
+    workers = max(min(workers, len(pairs)), 1)
+    if link_dests is None:
+        link_dests = [None] * len(pairs)
+    assert len(link_dests) == len(pairs)
+    if workers == 1:
+        return [copy_file(src, dst, hardlink, throttle, link_dest) for (src, dst), link_dest in zip(pairs, link_dests)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(copy_file, src, dst, hardlink, throttle, link_dest)
+                   for (src, dst), link_dest in zip(pairs, link_dests)]
+        for future in futures:
+            future.exception()
+        return [future.result() for future in futures]
@@ -1,4 +1,5 @@
 import os
+import re
 import string
 import collections
 from copy import deepcopy
@@ -7,6 +8,20 @@ from datasmart.core.schemautil.filetransfer import FileTransferSiteAny, FileTran
 from datasmart.core.schemautil import validate
 
 _valid_chracters = set(string.printable) - set('\t\n\r\v\f')
+# matches a character not in ``_valid_chracters``, so a path is checked with one search instead of a Python loop.
+_invalid_character_re = re.compile('[^' + re.escape(''.join(sorted(_valid_chracters))) + ']')
+# same, but also allowing ``\n``, to check many paths joined by ``\n`` at once.
+_invalid_character_joined_re = re.compile('[^\n' + re.escape(''.join(sorted(_valid_chracters))) + ']')
+# paths that ``os.path.normpath`` may change: empty, absolute, or with empty, ``.`` or ``..`` components.
+# others are normalized already.
+_maybe_not_normalized_re = re.compile(r'^$|^/|//|/$|(^|/)\.\.?(/|$)')
+# the same for many paths joined by ``\n``, with ``\n`` added at both ends: any path may change if any of these is in
+# the string. plain substring search is much faster than a regex with anchors on long strings.
+_maybe_not_normalized_joined = ('\n\n', '\n/', '//', '/\n', '/./', '/.\n', '\n./', '\n.\n', '/../', '/..\n', '\n../',
+                                '\n..\n')
+# normalized paths (joined as above) with valid characters only, any of which fails ``filename_more_check`` if any
+# of these is in the string.
+_bad_filename_joined = ('\n ', ' \n', '\n/', '\n.\n', '\n..\n', '/..\n')
 
 
 def joinpath_norm(path, *paths):
@@ -17,10 +32,9 @@ def joinpath_norm(path, *paths):
     :return: normalized joined path.
     """
     s = os.path.normpath(os.path.join(path, *paths))
-    assert s == os.path.normpath(s)
     # make sure unique unicode normalization.
-    for c in s:
-        assert c in _valid_chracters, "path {} has invalid character {}".format(s, c)
+    match = _invalid_character_re.search(s)
+    assert match is None, "path {} has invalid character {}".format(s, match.group() if match else '')
     return s
 
 
@@ -77,15 +91,37 @@ def filename_more_check(p):
 def normalize_filelist_relative(filelist: list, prefix='') -> list:
     """ normalize a list of relative file paths, and check that paths are well-behaved.
 
-    :param filelist: a list of relative file paths
+    the result is the same as ``joinpath_norm(prefix, p)`` followed by ``filename_more_check`` for each path ``p``,
+    but it's done in bulk: all paths are joined into one string, which is checked by one regex search and a few
+    substring searches, and only if some path may change, paths are passed through ``os.path.normpath`` one by one.
+
+    :param filelist: a list (or any iterable) of relative file paths
     :param prefix: an optional preffix
     :return: same file list, with paths normalized.
     """
+    filelist = list(filelist)
     assert len(filelist) > 0
 
-    ret_filelist = [joinpath_norm(prefix, p) for p in filelist]
-    for p in ret_filelist:
-        filename_more_check(p)
+    joined = '\n'.join(filelist)
+    if _invalid_character_joined_re.search(joined) is not None or joined.count('\n') != len(filelist) - 1:
+        # find the culprit, for the error message.
+        for p in filelist:
+            joinpath_norm(prefix, p)
+            assert '\n' not in p, "path {} has invalid character {}".format(p, repr('\n'))
+    assert '\n/' not in '\n' + joined, "file paths are all relative"
+
+    prefix = joinpath_norm(prefix) if prefix else '.'
+    if prefix != '.':
+        joined = prefix + '/' + joined.replace('\n', '\n' + prefix + '/')
+    ret_filelist = joined.split('\n')
+    joined = '\n' + joined + '\n'
+    if any(x in joined for x in _maybe_not_normalized_joined):
+        ret_filelist = [os.path.normpath(p) if _maybe_not_normalized_re.search(p) is not None else p
+                        for p in ret_filelist]
+        joined = '\n' + '\n'.join(ret_filelist) + '\n'
+    if any(x in joined for x in _bad_filename_joined):
+        for p in ret_filelist:
+            filename_more_check(p)
     return ret_filelist
 
 
@@ -95,6 +131,8 @@ def check_duplicate(filelist: list) -> None:
     :param filelist: a list of strings
     :return: return None. raise error if there's any duplicate stuff.
     """
+    if len(set(filelist)) == len(filelist):
+        return
     duplicate_items = [item for item, count in collections.Counter(filelist).items() if count > 1]
     if duplicate_items:
         raise RuntimeError("duplicate files exist for non-relative mode: " + str(duplicate_items))
@@ -117,9 +155,10 @@ def get_rsync_filelist(filelist: list, options: dict) -> tuple:
     # check that filenames don't contain weird characters, and get basename list.
     rsync_filelist_from = normalize_filelist_relative(filelist)
 
-    # add strip_prefix.
+    # add strip_prefix. it must be a whole directory, so what's left is still a normalized relative path.
     for x in rsync_filelist_from:
-        assert x.startswith(strip_prefix), 'file {} does not start with prefix `{}`'.format(x, strip_prefix)
+        assert (not strip_prefix) or x.startswith(strip_prefix + '/'), 'file {} does not start with prefix `{}`'.format(
+            x, strip_prefix)
 
     # revise from list based on strip, and get files on remote host (relative)
     if strip_prefix:  # this needs to be added when strip_prefix is not empty.
@@ -134,8 +173,7 @@ def get_rsync_filelist(filelist: list, options: dict) -> tuple:
         rsync_filelist_from_second = rsync_filelist_from
 
     # `rsync_filelist_from_second` is the list of files that will appear on remote host.
-    # (in relative mode)
-    assert normalize_filelist_relative(rsync_filelist_from_second) == rsync_filelist_from_second
+    # (in relative mode). it's normalized already, as a part of normalized paths.
 
     if not options['relative']:
         rsync_filelist_to = [os.path.basename(p) for p in rsync_filelist_from]
@@ -0,0 +1,70 @@
+"""registry of installable actions.
+
+Every action ``lab/action`` ships a config package ``datasmart.config.actions.lab.action`` with a ``_ds_meta_.json``.
+The registry is built by scanning these config packages on disk, so listing actions doesn't import any of the action
+modules (and their heavy dependencies).
+"""
+import importlib
+import os
+
+from datasmart.core import global_config
+from .io import load_file
+
+_META_FILE_NAME = '_ds_meta_.json'
+
+# action name like ``demo/file_upload`` -> its entry. built on first use.
+_action_registry = None
+
+
+def _scan_actions() -> dict:
+    # the namespace package for action configs. it contains only data files, so it's cheap to import.
+    config_actions = importlib.import_module(global_config['root_package_spec'] + '.config.actions')
+    registry = {}
+    for root_path in config_actions.__path__:
+        for dirpath, dirnames, filenames in os.walk(root_path):
+            dirnames[:] = sorted(d for d in dirnames if d != '__pycache__')
+            if _META_FILE_NAME not in filenames:
+                continue
+            action_components = tuple(os.path.relpath(dirpath, root_path).split(os.sep))
+            action_name = '/'.join(action_components)
+            if action_name in registry:
+                # same action in more than one path entry. the first one wins, just like import.
+                continue
+            registry[action_name] = {
+                'components': action_components,
+                'module': global_config['root_package_spec'] + '.actions.' + '.'.join(action_components),
+                'config_module': global_config['root_package_spec'] + '.config.actions.' + '.'.join(
+                    action_components),
+                'meta': load_file(os.path.join(dirpath, _META_FILE_NAME), load_json=True),
+            }
+    return registry
+
+
+def get_action_registry() -> dict:
+    """ get the registry of all actions, scanning for them on first call.
+
+    :return: a dict from action name (like ``demo/file_upload``) to a dict with keys ``components``,
+        ``module``, ``config_module``, and ``meta`` (content of ``_ds_meta_.json``).
+    """
+    global _action_registry
+    if _action_registry is None:
+        _action_registry = _scan_actions()
+    return _action_registry
+
+
+def list_actions() -> list:
+    """ sorted names of all actions, without importing any of them.
+
+    :return: a list of action names like ``demo/file_upload``.
+    """
+    return sorted(get_action_registry())
+
+
+def load_action(action_name: str) -> type:
+    """ import the module of an action, and return the action class.
+
+    :param action_name: action name like ``demo/file_upload``.
+    :return: the action class.
+    """
+    entry = get_action_registry()[action_name]
+    return getattr(importlib.import_module(entry['module']), entry['meta']['action_name'])
@@ -0,0 +1,143 @@
+"""persistent, multiplexed ssh connections for file transfer.
+
+For each ``(user, host, port)``, one ssh master connection is kept (``ControlMaster``), and all later ssh invocations,
+including the ones made by rsync through ``-e``, go through its control socket. So only the first command pays for
+TCP connection, key exchange and authentication. The master quits by itself after being idle for ``control_persist``
+seconds, and all masters are closed when the Python process exits.
+"""
+import atexit
+import hashlib
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+# directory for control sockets. created on first use. keep it short, since unix socket paths are limited to ~100 chars.
+_control_dir = None
+# (user, host, port) -> control socket path, for all masters we have started.
+_masters = {}
+# (user, host, port) -> {'started': int, 'reused': int}
+_stats = {}
+# (user, host, port) -> lock held while checking or starting its master, so hosts don't wait for each other.
+_host_locks = {}
+# (user, host, port) -> time.monotonic() of the last failed start of its master.
+_failed_starts = {}
+_lock = threading.Lock()
+
+# seconds to wait for the connection when starting a master.
+_CONNECT_TIMEOUT = 10
+# seconds after a failed start during which plain ssh is used, instead of trying to start the master again.
+_FAILED_START_BACKOFF = 60
+
+
+def _get_control_dir() -> str:
+    global _control_dir
+    if _control_dir is None:
+        _control_dir = tempfile.mkdtemp(prefix='ds-ssh-')
+    return _control_dir
+
+
+def _get_control_path(key: tuple) -> str:
+    return os.path.join(_get_control_dir(), hashlib.sha1('{}@{}:{}'.format(*key).encode()).hexdigest()[:16])
+
+
+def _base_args(port: int) -> list:
+    return ['ssh', '-p', str(port)]
+
+
+def _start_master(key: tuple, control_path: str, control_persist: int) -> None:
+    username, host, port = key
+    # -f: go to background after authentication, -N: no command. BatchMode: fail instead of prompting for a password
+    # or host key confirmation, which nobody would answer with stdin closed.
+    subprocess.run(_base_args(port) + ['-o', 'BatchMode=yes', '-o', 'ConnectTimeout={}'.format(_CONNECT_TIMEOUT),
+                                       '-o', 'ControlMaster=yes',
+                                       '-o', 'ControlPath=' + control_path,
+                                       '-o', 'ControlPersist={}'.format(control_persist),
+                                       '-f', '-N', username + '@' + host],
+                   check=True, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+
+
+def get_ssh_args(username: str, host: str, port: int, multiplex: bool = True, control_persist: int = 600) -> list:
+    """ ssh command (without destination) for a remote host, going through a persistent master if ``multiplex``.
+
+    the master is (re)started if it's not there, say it has quit after being idle for too long. Only callers for the
+    same host wait for it to start.
+    If starting the master fails, plain ssh arguments are returned, and the failure shows up in the actual command.
+    A failed start is not tried again for ``_FAILED_START_BACKOFF`` seconds.
+
+    :param username: ssh username.
+    :param host: remote host.
+    :param port: ssh port.
+    :param multiplex: whether use a persistent master connection.
+    :param control_persist: how long (in seconds) the master would stay after last use.
+    :return: a list of command line arguments, starting with ``ssh``.
+    """
+    if not multiplex:
+        return _base_args(port)
+    key = (username, host, port)
+    with _lock:
+        control_path = _get_control_path(key)
+        stats_this = _stats.setdefault(key, {'started': 0, 'reused': 0})
+        host_lock = _host_locks.setdefault(key, threading.Lock())
+    with host_lock:
+        if os.path.exists(control_path):
+            with _lock:
+                stats_this['reused'] += 1
+        else:
+            failed_time = _failed_starts.get(key)
+            if failed_time is not None and time.monotonic() - failed_time < _FAILED_START_BACKOFF:
+                return _base_args(port)
+            try:
+                _start_master(key, control_path, control_persist)
+            except (subprocess.CalledProcessError, OSError):
+                _failed_starts[key] = time.monotonic()
+                return _base_args(port)
+            _failed_starts.pop(key, None)
+            with _lock:
+                _masters[key] = control_path
+                stats_this['started'] += 1
+    # ControlMaster=no: never become a master ourselves; if the socket has gone away meanwhile, ssh connects directly.
+    return _base_args(port) + ['-o', 'ControlMaster=no', '-o', 'ControlPath=' + control_path]
+
+
+def get_ssh_command(username: str, host: str, port: int, **kwargs) -> list:
+    """ like :func:`get_ssh_args`, with the destination appended. append the remote command to it to run it. """
+    return get_ssh_args(username, host, port, **kwargs) + [username + '@' + host]
+
+
+def get_rsync_rsh(ssh_args: list) -> str:
+    """ the string for rsync's ``-e`` option. """
+    return ' '.join(shlex.quote(x) for x in ssh_args)
+
+
+def get_ssh_stats() -> dict:
+    """ reuse statistics of master connections.
+
+    :return: a dict from ``'user@host:port'`` to ``{'started': int, 'reused': int}``. ``started`` counts masters
+        started (more than one means it had quit in between), and ``reused`` counts ssh invocations served by an
+        existing master.
+    """
+    with _lock:
+        return {'{}@{}:{}'.format(*key): dict(value) for key, value in _stats.items()}
+
+
+def close_all_masters() -> None:
+    """ ask all masters to quit, and remove the directory of control sockets. """
+    global _control_dir
+    with _lock:
+        for (username, host, port), control_path in _masters.items():
+            if os.path.exists(control_path):
+                subprocess.run(_base_args(port) + ['-o', 'ControlPath=' + control_path, '-O', 'exit',
+                                                   username + '@' + host],
+                               stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        _masters.clear()
+        _failed_starts.clear()
+        if _control_dir is not None:
+            shutil.rmtree(_control_dir, ignore_errors=True)
+            _control_dir = None
+
+
+atexit.register(close_all_masters)
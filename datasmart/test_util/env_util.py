@@ -7,6 +7,7 @@ from unittest import TestCase
 
 import pymongo
 
+from datasmart.core.filetransfer import FileTransfer
 from . import file_util
 
 
@@ -76,6 +77,8 @@ def setup_local_config(config_path: tuple, config_text: str, first_time: bool =
     os.makedirs(subdir)
     with open(os.path.join(subdir, "config.json"), "wt") as f:
         f.write(config_text)
+    # normalized configs cached from before are stale now.
+    FileTransfer.invalidate_config()
 
 
 def setup_remote_site(subdirs_to_create=None):
@@ -105,5 +108,6 @@ def teardown_remote_site(site):
 
 def teardown_local_config():
     shutil.rmtree("config")
+    FileTransfer.invalidate_config()
     time.sleep(0.25)  # buffer
     assert not os.path.exists("config"), "config still exists!"
@@ -12,6 +12,7 @@ class MockNames:
     git_repo_hash = "datasmart.core.util.git.get_git_repo_hash"
     git_check_clean = "datasmart.core.util.git.check_git_repo_clean"
     git_check_remote_commit = "datasmart.core.util.git.check_commit_in_remote"
+    git_check_remote_commits = "datasmart.core.util.git.check_commits_in_remote"
 
 
 def create_mocked_action(action_class: type, action_config=None, mock_options=None):
@@ -54,7 +55,10 @@ def parse_mock_option(key: str, value: object):
         return [mock.patch(MockNames.git_repo_url, return_value=value['git_url']),
                 mock.patch(MockNames.git_repo_hash, return_value=value['git_hash']),
                 mock.patch(MockNames.git_check_clean, return_value=True),
-                mock.patch(MockNames.git_check_remote_commit, return_value=True)]
+                mock.patch(MockNames.git_check_remote_commit, return_value=True),
+                mock.patch(MockNames.git_check_remote_commits,
+                           side_effect=lambda repopath, commit_sha1_list, *args, **kwargs: [True] * len(
+                               commit_sha1_list))]
     else:
         raise ValueError('unknown mock type!')
 
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+"""Python script to back up files referenced by records, consistent with a backup of the database.
+
+It's assumed that datasmart project must be importable through `datasmart` (not a submodule).
+Sites are accessed with the config of ``core.filetransfer``. see :mod:`datasmart.core.sitebackup` for the format of
+snapshots.
+"""
+
+import argparse
+import sys
+
+from datasmart.core import sitebackup
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='snapshot files referenced by records in a database backup (the '
+                                                 'latest in DB_BACKUP_ROOT by default) into SITE_BACKUP_ROOT, hard '
+                                                 'linking files unchanged since the previous snapshot.')
+    parser.add_argument('db_backup_root', metavar='DB_BACKUP_ROOT', help='directory holding all database backups')
+    parser.add_argument('site_backup_root', metavar='SITE_BACKUP_ROOT', help='directory holding all snapshots')
+    parser.add_argument('--name', help='name of the database backup to take records from')
+    parser.add_argument('--collection', action='append', dest='collections', metavar='DATABASE.COLLECTION',
+                        help='collection to take records from; can be repeated. By default, all in the backup.')
+    parser.add_argument('--jobs', type=int, default=4, help='sites transferred in parallel (default 4)')
+    args = parser.parse_args(argv)
+    assert args.jobs >= 1
+    sitebackup.backup_sites(args.db_backup_root, args.site_backup_root, db_backup_name=args.name,
+                            collections=args.collections, max_workers=args.jobs, quiet=False)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
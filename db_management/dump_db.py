@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+"""Python script to back up the database online, without stopping mongod.
+
+It's assumed that datasmart project must be importable through `datasmart` (not a submodule).
+The database is connected with the config of ``core.db``. see :mod:`datasmart.core.dbbackup` for the format of backups.
+"""
+
+import argparse
+import sys
+
+from datasmart.core import dbbackup
+from datasmart.core.db import DB, DBContextManager
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='back up MongoDB online, incrementally over the latest backup in '
+                                                 'BACKUP_ROOT unless --full.')
+    parser.add_argument('backup_root', metavar='BACKUP_ROOT', help='directory holding all backups')
+    parser.add_argument('--full', action='store_true', help='take a full backup')
+    parser.add_argument('--db', action='append', dest='databases', metavar='DATABASE',
+                        help='database to back up; can be repeated. By default, all but system databases.')
+    parser.add_argument('--jobs', type=int, default=4,
+                        help='collections dumped, and chunks compressed, in parallel (default 4)')
+    parser.add_argument('--chunk-size', type=int, default=dbbackup.CHUNK_SIZE // (1024 * 1024),
+                        help='size of compressed chunks before compression, in MiB (default %(default)s)')
+    args = parser.parse_args(argv)
+    assert args.jobs >= 1 and args.chunk_size >= 1
+    with DBContextManager(DB()) as db_instance:
+        dbbackup.backup(db_instance.client_instance, args.backup_root, databases=args.databases, full=args.full,
+                        max_workers=args.jobs, chunk_size=args.chunk_size * 1024 * 1024, quiet=False)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
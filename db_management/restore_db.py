@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+"""Python script to restore the database from a backup made by ``dump_db.py``, without stopping mongod.
+
+It's assumed that datasmart project must be importable through `datasmart` (not a submodule).
+The database is connected with the config of ``core.db``, and sites are accessed with the config of
+``core.filetransfer``. see :mod:`datasmart.core.dbbackup` and :mod:`datasmart.core.sitebackup` for details.
+"""
+
+import argparse
+import sys
+
+from datasmart.core import dbbackup, sitebackup
+from datasmart.core.db import DB, DBContextManager
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='restore MongoDB online from a backup in BACKUP_ROOT (the latest by '
+                                                 'default), and then check that files referenced by restored '
+                                                 'records exist on their sites.')
+    parser.add_argument('backup_root', metavar='BACKUP_ROOT', help='directory holding all backups')
+    parser.add_argument('--name', help='name of the backup to restore')
+    parser.add_argument('--collection', action='append', dest='collections', metavar='DATABASE.COLLECTION',
+                        help='collection to restore; can be repeated. By default, all in the backup.')
+    parser.add_argument('--drop', action='store_true', help='drop collections that exist already')
+    parser.add_argument('--jobs', type=int, default=4,
+                        help='collections loaded, inserts, and sites checked, in parallel (default 4)')
+    parser.add_argument('--no-verify', action='store_false', dest='verify',
+                        help="don't check files referenced by restored records")
+    args = parser.parse_args(argv)
+    assert args.jobs >= 1
+    with DBContextManager(DB()) as db_instance:
+        result = dbbackup.restore(db_instance.client_instance, args.backup_root, name=args.name,
+                                  collections=args.collections, drop=args.drop, max_workers=args.jobs, quiet=False)
+        if args.verify:
+            check_result = sitebackup.verify_database(db_instance.client_instance, sorted(result['collections']),
+                                                      max_workers=args.jobs)
+            print(sitebackup.format_check_summary(check_result))
+            if check_result['mismatches']:
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
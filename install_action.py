@@ -4,25 +4,38 @@
 It's assumed that datasmart project must be importable through `datasmart` (not a submodule)
 """
 
-import shutil
 import os
 from datasmart.config.core import __path__ as pkg_to_copy_from_path
 import sys
 import pkgutil
-import json
 import datasmart
-import stat
+from concurrent.futures import ThreadPoolExecutor
+from datasmart.core.filetransfer import FileTransferConfigSchema
+from datasmart.core.util.config import build_config_bundle, save_config_bundle, get_bundle_path
+from datasmart.core.util.io import load_file
+from datasmart.core.util.install import install_files, format_summary
+from datasmart.core.util.registry import get_action_registry, list_actions
 
 help_string = """Usage:
 {exec} /project/upload demo/file_upload  # install action `file_upload` from lab `demo`, under dir `/project/upload`
 {exec} /project/mixed lab1/action1 lab2/action2  # install two actions from two labs, under dir `/project/mixed`
+{exec} --adopt /project/upload demo/file_upload  # same, overwriting files installed by an older version
+{exec} --list  # list all available actions
 
-Project directory and at least one action must be specified.
+Project directory and at least one action must be specified. If the project directory exists, it's updated in place:
+only files that changed are written, and files you changed are kept. You are asked before files of actions installed
+before but not given now are removed. Projects installed by an older version have no record of installed files, so
+their files are all kept as changed by you; install with --adopt once to overwrite them.
 """
 
 core_pkgs_names = [x[1] for x in pkgutil.iter_modules(pkg_to_copy_from_path)]
 datasmart_path = [os.path.split(x)[0] for x in datasmart.__path__]
 
+# config files of actions that are loaded through ``load_config``, thus put into the config bundle.
+action_config_files = ('config.json', 'schema.json', 'template.json', 'query_template.py')
+# core modules whose config can be validated at install time.
+core_config_schemas = {'filetransfer': FileTransferConfigSchema}
+
 
 def check_one_meta(meta_dict):
     assert 'action_name' in meta_dict
@@ -91,89 +104,134 @@ python {start_script_name}
     return template.encode()
 
 
-def main(install_folder, actions):
-    modified_core_list = set()
+def generate_config_bundle(install_folder, actions):
+    """ precompile all configs of the project into one bundle, so that they are read with one file read at startup.
+
+    core configs are validated against their schemas if possible, and schemas of actions are checked to be valid.
 
+    :return: path of the bundle, and whether it's written, or the same bundle is there already.
+    """
+    action_registry = get_action_registry()
+    module_files = [(('core', pkg), 'config.json') for pkg in core_pkgs_names]
+    for action in actions:
+        action_module_config = action_registry[action]['config_module']
+        for filename in action_config_files:
+            try:
+                has_file = pkgutil.get_data(action_module_config, filename) is not None
+            except OSError:
+                has_file = False
+            if has_file:
+                module_files.append((('actions',) + action_registry[action]['components'], filename))
+    schemas = {'core/{}/config.json'.format(pkg): schema.get_schema() for pkg, schema in core_config_schemas.items()}
+    bundle = build_config_bundle(module_files, project_root=os.path.abspath(install_folder), schemas=schemas)
+    # the bundle records stat signatures of config files, so it's the same only if no config file is touched.
+    bundle_path = get_bundle_path(os.path.abspath(install_folder))
+    try:
+        if load_file(bundle_path).get('sha1') == bundle['sha1']:
+            return bundle_path, False
+    except (OSError, ValueError):
+        pass
+    return save_config_bundle(bundle, project_root=os.path.abspath(install_folder)), True
+
+
+def generate_action_files(action):
+    """ all files to install for one action.
+
+    :return: a list of ``(relative path, content, executable)`` for the action itself, and a dict of core module name
+        to its overriding config.
+    """
+    action_registry = get_action_registry()
+    action_components = action.split('/')
+    action_module = action_registry[action]['module']
+    action_module_config = action_registry[action]['config_module']
+    # ok. time to collect their meta file.
+    meta_this = action_registry[action]['meta']
+
+    # TODO: a json schema based checking, rather than adhoc.
+    check_one_meta(meta_this)
+    # collect config for this action.
+    config_this_action = pkgutil.get_data(action_module_config, 'config.json')
+    # then collect config overrides
+    config_override_dict_this = generate_config_override(action_module_config, meta_this)
+    # content of start script.
+    start_script_content = construct_start_script(action_module, action_module_config, meta_this)
+    # content of wrapper script.
+    action_flat_name = '_'.join(action_components)
+    assert ('.' not in action_flat_name) and (' ' not in action_flat_name)
+    wrapper_script_content = generate_wrapper_script(action_flat_name)
+
+    # additional files
+    additional_file_dict_this = generate_additional_files(action_module_config, meta_this)
+
+    files = [(os.path.join('config', 'actions', *action_components, 'config.json'), config_this_action, False),
+             (action_flat_name + '.py', start_script_content, False),
+             ('start_' + action_flat_name + '.sh', wrapper_script_content, True)]
+    files.extend((fname, f_content, False) for fname, f_content in additional_file_dict_this.items())
+    return files, config_override_dict_this
+
+
+def confirm_remove(relpaths):
+    """ ask before removing files of actions installed before but not given now. """
+    print('these files were installed before, but not for the actions given now:')
+    for relpath in relpaths:
+        print('  ' + relpath)
+    try:
+        return input('remove them? [y/N] ').strip().lower() in ('y', 'yes')
+    except EOFError:
+        return False
+
+
+def main(install_folder, actions, max_workers=None, adopt=False, confirm_remove=confirm_remove):
+    """ install actions into a project folder, or update an existing one incrementally.
+
+    files that are up to date are not written again, and files changed by the user, such as configs filled out, and
+    other files in the folder, such as prepare results, are kept. see :mod:`datasmart.core.util.install`.
+    actions are processed concurrently.
+
+    :param adopt: overwrite files not recorded as installed, such as those installed by an older version.
+    :param confirm_remove: called with files installed before but not now, to decide whether to remove them.
+    """
     assert sys.version_info >= (3, 5), "you must have at least Python 3.5 to run this!"
+    action_registry = get_action_registry()
+    for action in actions:
+        assert action in action_registry, "unknown action {}! run with --list to see all actions".format(action)
     if os.path.exists(install_folder):
-        print("old project folder `{}` exists! do you want to really remove them and create a new one?"
-              " potentially all existing data there will be lost.".format(install_folder))
-        answer = input("type y to confirm, otherwise the program will exit")
-        if answer == 'y':
-            shutil.rmtree(install_folder)
-        else:
-            return
-    assert not os.path.exists(install_folder), 'the installation folder must not exist!'
-    os.makedirs(install_folder)
-    action_config_dir_root = os.path.join(install_folder, 'config', 'actions')
-    core_config_dir_root = os.path.join(install_folder, 'config', 'core')
-    assert os.path.exists(install_folder)
+        print("project folder `{}` exists, and it will be updated. files changed by you are kept.".format(
+            install_folder))
 
-    for action in actions:
-        action_components = action.split('/')
-        action_module = 'datasmart.actions.' + '.'.join(action_components)
-        print('working on {} ... '.format(action_module), end='')
-        action_module_config = 'datasmart.config.actions.' + '.'.join(action_components)
-        meta_file_this = pkgutil.get_data(action_module_config, '_ds_meta_.json')
-        # ok. time to collect their meta file.
-        assert meta_file_this is not None
-        meta_this = json.loads(meta_file_this.decode())
-
-        # TODO: a json schema based checking, rather than adhoc.
-        check_one_meta(meta_this)
-        # collect config for this action.
-        config_this_action = pkgutil.get_data(action_module_config, 'config.json')
-        # then collect config overrides
-        config_override_dict_this = generate_config_override(action_module_config, meta_this)
-        # content of start script.
-        start_script_content = construct_start_script(action_module, action_module_config, meta_this)
-        # content of wrapper script.
-        action_flat_name = '_'.join(action_components)
-        assert ('.' not in action_flat_name) and (' ' not in action_flat_name)
-        wrapper_script_content = generate_wrapper_script(action_flat_name)
-
-        # additional files
-        additional_file_dict_this = generate_additional_files(action_module_config, meta_this)
-
-        # write action config
-        action_config_dir_this = os.path.join(action_config_dir_root, *action_components)
-        os.makedirs(action_config_dir_this)
-        with open(os.path.join(action_config_dir_this, 'config.json'), 'wb') as f_config:
-            f_config.write(config_this_action)
-
-        # write config overrides
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        generated = list(executor.map(generate_action_files, actions))
+
+    files = []
+    core_config_overrides = {}
+    for action, (files_this, config_override_dict_this) in zip(actions, generated):
+        files.extend(files_this)
+        # config overrides. the first action overriding a core module wins.
         for core_module_name, core_module_config in config_override_dict_this.items():
-            modified_core_list.add(core_module_name)
-            core_config_dir_this = os.path.join(core_config_dir_root, core_module_name)
-            if os.path.exists(core_config_dir_this):
-                print('warning, config for core.{} already exists. old config get overwritten'.format(core_module_name))
+            if core_module_name in core_config_overrides:
+                print('warning, config for core.{} is already overridden by {}. the one of {} is ignored'.format(
+                    core_module_name, core_config_overrides[core_module_name][0], action))
             else:
-                os.makedirs(core_config_dir_this)
-                with open(os.path.join(core_config_dir_this, 'config.json'), 'wb') as f_config:
-                    f_config.write(core_module_config)
-
-        # write start script
-        with open(os.path.join(install_folder, action_flat_name + '.py'), 'wb') as f_start_script:
-            f_start_script.write(start_script_content)
-        # write wrapper script
-        wrapper_script_name = os.path.join(install_folder, 'start_' + action_flat_name + '.sh')
-        with open(wrapper_script_name, 'wb') as f_wrapper_script:
-            f_wrapper_script.write(wrapper_script_content)
-        os.chmod(wrapper_script_name, stat.S_IEXEC | os.stat(wrapper_script_name).st_mode)
-
-        # write additional files
-        for fname, f_content in additional_file_dict_this.items():
-            with open(os.path.join(install_folder, fname), 'wb') as f_addon_this:
-                f_addon_this.write(f_content)
-
-        print('done')
-    if modified_core_list:
-        print('config for core modules {} got overriden. Check them under {}'.format(modified_core_list,
-                                                                                     core_config_dir_root))
+                core_config_overrides[core_module_name] = (action, core_module_config)
+    files.extend((os.path.join('config', 'core', core_module_name, 'config.json'), core_module_config, False)
+                 for core_module_name, (_, core_module_config) in sorted(core_config_overrides.items()))
+
+    statuses = install_files(install_folder, files, max_workers=max_workers, confirm_remove=confirm_remove,
+                             adopt=adopt)
+    print(format_summary(statuses))
+    if core_config_overrides:
+        print('config for core modules {} got overriden. Check them under {}'.format(
+            sorted(core_config_overrides), os.path.join(install_folder, 'config', 'core')))
+    bundle_path, bundle_written = generate_config_bundle(install_folder, actions)
+    print('config bundle {} {}'.format('written to' if bundle_written else 'is up to date at', bundle_path))
 
 
 if __name__ == '__main__':
-    if len(sys.argv) < 3:
+    if sys.argv[1:] == ['--list']:
+        print('\n'.join(list_actions()))
+        sys.exit(0)
+    args = [x for x in sys.argv[1:] if x != '--adopt']
+    if len(args) < 2:
         print(help_string.format(exec=sys.argv[0]))
         sys.exit(1)
-    main(sys.argv[1], sys.argv[2:])
+    main(args[0], args[1:], adopt='--adopt' in sys.argv[1:])
@@ -0,0 +1,60 @@
+""" test script for the bandwidth scheduler in datasmart.core.util.bandwidth.
+"""
+import json
+import shutil
+import tempfile
+import time
+import unittest
+
+import datasmart.core.util.bandwidth as bandwidth
+
+
+class TestBandwidth(unittest.TestCase):
+
+    def setUp(self):
+        self.old_state_dir = bandwidth.state_dir
+        bandwidth.state_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(bandwidth.state_dir)
+        bandwidth.state_dir = self.old_state_dir
+
+    def test_share(self):
+        budget = 1000000
+        with bandwidth.acquire('site', budget, 'bulk') as bulk1:
+            self.assertEqual(bulk1.rate, budget)
+            with bandwidth.acquire('site', budget, 'bulk') as bulk2:
+                self.assertEqual(bulk2.rate, budget / 2)
+                # interactive transfers take most of the budget.
+                with bandwidth.acquire('site', budget, 'interactive') as interactive:
+                    self.assertEqual(interactive.rate, budget * (1 - bandwidth.BULK_SHARE_UNDER_INTERACTIVE))
+                    # other sites are not affected.
+                    with bandwidth.acquire('another_site', budget, 'bulk') as bulk_other:
+                        self.assertEqual(bulk_other.rate, budget)
+            # current rate is picked up after refresh interval.
+            time.sleep(bandwidth.REFRESH_INTERVAL)
+            self.assertEqual(bulk1.rate, budget)
+
+    def test_dead_lease(self):
+        with bandwidth.acquire('site', 1000, 'bulk'):
+            pass
+        # a lease of a process which is gone.
+        state_path = bandwidth._get_state_path('site')
+        with open(state_path, 'wt') as f:
+            f.write(json.dumps({'dead': {'pid': 2 ** 22 + 1, 'priority': 'interactive', 'time': 0}}))
+        with bandwidth.acquire('site', 1000, 'bulk') as lease:
+            self.assertEqual(lease.rate, 1000)
+
+    def test_throttle(self):
+        with bandwidth.acquire('site', 1000000, 'bulk') as lease:
+            start_time = time.monotonic()
+            for _ in range(5):
+                lease.throttle(100000)
+            # 500KB at 1MB/s.
+            self.assertGreater(time.monotonic() - start_time, 0.4)
+        with open(bandwidth._get_state_path('site')) as f:
+            self.assertEqual(json.loads(f.read()), {})
+
+
+if __name__ == '__main__':
+    unittest.main(failfast=True)
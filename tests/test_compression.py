@@ -0,0 +1,72 @@
+""" test script for the compression policy in datasmart.core.util.compression.
+"""
+import os
+import shutil
+import unittest
+
+import datasmart.core.filetransfer
+import datasmart.core.util.compression
+import datasmart.core.util.git
+from datasmart.test_util import file_util
+
+
+class TestCompression(unittest.TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        # check git is clean
+        datasmart.core.util.git.check_git_repo_clean()
+
+    @classmethod
+    def setUpClass(cls):
+        # check git is clean
+        datasmart.core.util.git.check_git_repo_clean()
+
+    def setUp(self):
+        self.site_path = os.path.abspath(file_util.gen_unique_local_paths(1)[0])
+        os.makedirs(self.site_path)
+        # random data with a compressible name, text with an unknown extension, and a video.
+        self.filelist = ['random.txt', 'random.bin', 'text.bin', 'video.mp4']
+        contents = [os.urandom(100000), os.urandom(300000), b'hello world! ' * 30000, b'\0' * 1000]
+        for name, content in zip(self.filelist, contents):
+            with open(os.path.join(self.site_path, name), 'wb') as f:
+                f.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.site_path)
+
+    def test_is_compressible(self):
+        self.assertEqual([datasmart.core.util.compression.is_compressible(os.path.join(self.site_path, p))
+                          for p in self.filelist], [True, False, True, False])
+        self.assertGreater(datasmart.core.util.compression.estimate_entropy(
+            os.path.join(self.site_path, 'random.bin')), 7.9)
+
+    def test_compression_groups(self):
+        config = {
+            "local_data_dir": self.site_path,
+            "site_mapping_push": [],
+            "site_mapping_fetch": [],
+            "remote_site_config": {"remote": {"ssh_username": "test", "ssh_port": 22}},
+            "default_site": {"local": True, "path": self.site_path},
+            "quiet": True,
+            "local_fetch_option": "copy"
+        }
+        remote_site = {'local': False, 'path': 'remote', 'prefix': '/data'}
+        local_site = {'local': True, 'path': self.site_path}
+        for policy, push_groups, fetch_groups in [
+            ('auto', [(['-z'], [0, 2]), ([], [1, 3])], [(['-z', '--skip-compress'], [0, 1, 2, 3])]),
+            ('always', [(['-z'], [0, 1, 2, 3])], [(['-z'], [0, 1, 2, 3])]),
+            ('never', [([], [0, 1, 2, 3])], [([], [0, 1, 2, 3])])
+        ]:
+            with self.subTest(policy=policy):
+                config['remote_site_config']['remote']['compress'] = policy
+                filetransfer = datasmart.core.filetransfer.FileTransfer(config)
+                for src, dest, groups_expected in [(local_site, remote_site, push_groups),
+                                                   (remote_site, local_site, fetch_groups)]:
+                    groups = filetransfer._get_compression_groups(src, dest, self.filelist)
+                    self.assertEqual([([x.split('=')[0] for x in args], indices) for args, _, indices in groups],
+                                     groups_expected)
+
+
+if __name__ == '__main__':
+    unittest.main(failfast=True)
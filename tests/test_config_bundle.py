@@ -0,0 +1,103 @@
+""" test script for the precompiled config bundle in datasmart.core.util.config.
+"""
+import json
+import os
+import shutil
+import unittest
+
+import jsonschema
+
+import datasmart.core.util.config
+import datasmart.core.util.git
+from datasmart.core import global_config
+from datasmart.core.util.io import load_file, save_file
+from datasmart.test_util import file_util
+
+
+class TestConfigBundle(unittest.TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        # check git is clean
+        datasmart.core.util.git.check_git_repo_clean()
+
+    @classmethod
+    def setUpClass(cls):
+        # check git is clean
+        datasmart.core.util.git.check_git_repo_clean()
+
+    def setUp(self):
+        self.project_root = os.path.abspath(file_util.gen_unique_local_paths(1)[0])
+        self.old_project_root = global_config['project_root']
+        global_config['project_root'] = self.project_root
+        # a project level config for core.db, and the rest are global or packaged ones.
+        self.db_config_path = os.path.join(self.project_root, 'config', 'core', 'db', 'config.json')
+        os.makedirs(os.path.dirname(self.db_config_path))
+        self.db_config = {"url": "127.0.0.1", "port": 27018, "authentication": False, "user": "test",
+                          "password": "test", "auth_db": "admin"}
+        save_file(self.db_config_path, json.dumps(self.db_config))
+        self.module_files = [(('core', 'db'), 'config.json'), (('core', 'util'), 'config.json'),
+                             (('actions', 'demo', 'file_upload'), 'template.json')]
+
+    def tearDown(self):
+        global_config['project_root'] = self.old_project_root
+        shutil.rmtree(self.project_root)
+
+    def tamper_bundle(self, key, content):
+        """ change the bundle content in place, with a valid hash, to see if the bundle is really used."""
+        bundle_path = datasmart.core.util.config.get_bundle_path()
+        bundle = load_file(bundle_path)
+        bundle['entries'][key]['content'] = content
+        bundle['entries'][key]['value'] = json.loads(content)
+        bundle['sha1'] = datasmart.core.util.config._hash_bundle_entries(bundle['entries'])
+        datasmart.core.util.config.save_config_bundle(bundle)
+
+    def test_same_as_layered(self):
+        before = [datasmart.core.util.config.load_config(m, f, load_json=False) for m, f in self.module_files]
+        bundle = datasmart.core.util.config.build_config_bundle(self.module_files)
+        datasmart.core.util.config.save_config_bundle(bundle)
+        self.assertEqual(bundle['entries']['core/db/config.json']['layer'], 'project')
+        after = [datasmart.core.util.config.load_config(m, f, load_json=False) for m, f in self.module_files]
+        self.assertEqual(before, after)
+        self.assertEqual(datasmart.core.util.config.load_config(('core', 'db')), self.db_config)
+        # parsed values are stored, and copied on every load.
+        self.assertEqual(bundle['entries']['core/db/config.json']['value'], self.db_config)
+        datasmart.core.util.config.load_config(('core', 'db'))['port'] = 0
+        self.assertEqual(datasmart.core.util.config.load_config(('core', 'db')), self.db_config)
+
+    def test_validated(self):
+        schemas = {'core/db/config.json': {'type': 'object', 'required': ['url', 'port'],
+                                           'properties': {'port': {'type': 'integer'}}}}
+        datasmart.core.util.config.build_config_bundle(self.module_files, schemas=schemas)
+        self.db_config['port'] = '27018'
+        save_file(self.db_config_path, json.dumps(self.db_config))
+        with self.assertRaises(jsonschema.ValidationError):
+            datasmart.core.util.config.build_config_bundle(self.module_files, schemas=schemas)
+        # schemas of actions must be valid JSON schemas themselves.
+        schema_path = os.path.join(os.path.dirname(self.db_config_path), 'schema.json')
+        save_file(schema_path, json.dumps({'type': 'no such type'}))
+        with self.assertRaises(jsonschema.SchemaError):
+            datasmart.core.util.config.build_config_bundle([(('core', 'db'), 'schema.json')])
+
+    def test_bundle_used_and_stale(self):
+        datasmart.core.util.config.save_config_bundle(
+            datasmart.core.util.config.build_config_bundle(self.module_files))
+        self.tamper_bundle('core/db/config.json', '{"from_bundle": true}')
+        self.assertEqual(datasmart.core.util.config.load_config(('core', 'db')), {"from_bundle": True})
+        # change the project config, then bundle entry is stale.
+        self.db_config['port'] = 27019
+        save_file(self.db_config_path, json.dumps(self.db_config, indent=2))
+        self.assertEqual(datasmart.core.util.config.load_config(('core', 'db')), self.db_config)
+
+    def test_corrupted(self):
+        datasmart.core.util.config.save_config_bundle(
+            datasmart.core.util.config.build_config_bundle(self.module_files))
+        bundle_path = datasmart.core.util.config.get_bundle_path()
+        bundle = load_file(bundle_path)
+        bundle['entries']['core/db/config.json']['content'] = '{"from_bundle": true}'
+        save_file(bundle_path, json.dumps(bundle))
+        self.assertEqual(datasmart.core.util.config.load_config(('core', 'db')), self.db_config)
+
+
+if __name__ == '__main__':
+    unittest.main(failfast=True)
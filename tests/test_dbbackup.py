@@ -0,0 +1,124 @@
+""" test script for online backup of MongoDB in datasmart.core.dbbackup. It needs a local mongod, like other tests
+working with the database.
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import bson
+import pymongo
+
+import datasmart.core.dbbackup as dbbackup
+
+
+class TestDBBackup(unittest.TestCase):
+
+    def setUp(self):
+        self.backup_root = tempfile.mkdtemp()
+        self.db_client = pymongo.MongoClient()
+        self.database = 'datasmart_test_dbbackup'
+        self.db_client.drop_database(self.database)
+        self.collection = self.db_client[self.database]['records']
+        self.collection.insert_many([{'x': i} for i in range(100)])
+        self.collection.create_index('x')
+        self.db_client[self.database]['keyed'].insert_many([{'_id': 'k{}'.format(i)} for i in range(5)])
+
+    def tearDown(self):
+        self.db_client.drop_database(self.database)
+        self.db_client.close()
+        shutil.rmtree(self.backup_root)
+
+    def get_xs(self, name):
+        return sorted(bson.decode(x)['x'] for x in dbbackup.iter_documents(self.backup_root, name,
+                                                                           self.database + '.records'))
+
+    def test_backup(self):
+        # a record prepared (given its ``_id``) before a backup, and inserted after it.
+        late_record = {'_id': bson.ObjectId(), 'x': 110}
+        manifest = dbbackup.backup(self.db_client, self.backup_root, databases=[self.database], chunk_size=500)
+        self.assertIsNone(manifest['parent'])
+        entry = manifest['collections'][self.database + '.records']
+        self.assertEqual((entry['mode'], entry['count'], entry['num_ids']), ('full', 100, 100))
+        self.assertGreater(len(entry['chunks']), 1)
+        self.assertIn('x_1', [x['name'] for x in dbbackup.from_json(entry['indexes'])])
+        self.assertEqual(self.get_xs(manifest['name']), list(range(100)))
+
+        # insert and remove some, and the next backup only has new documents, but restores to the new state.
+        self.collection.delete_one({'x': 0})
+        self.collection.insert_many([{'x': i} for i in range(100, 110)] + [late_record])
+        self.db_client[self.database]['keyed'].insert_one({'_id': 'new'})
+        # backups are named by seconds.
+        time.sleep(1.1)
+        manifest_2 = dbbackup.backup(self.db_client, self.backup_root, databases=[self.database])
+        self.assertEqual(manifest_2['parent'], manifest['name'])
+        entry = manifest_2['collections'][self.database + '.records']
+        self.assertEqual((entry['mode'], entry['count'], entry['num_ids']), ('incremental', 11, 110))
+        entry = manifest_2['collections'][self.database + '.keyed']
+        self.assertEqual((entry['mode'], entry['count'], entry['num_ids']), ('incremental', 1, 6))
+        self.assertEqual(self.get_xs(manifest_2['name']), list(range(1, 111)))
+        # the older point is still there.
+        self.assertEqual(self.get_xs(manifest['name']), list(range(100)))
+        self.assertEqual(dbbackup.list_backups(self.backup_root), [manifest['name'], manifest_2['name']])
+
+        # backups are named by seconds.
+        time.sleep(1.1)
+        manifest_3 = dbbackup.backup(self.db_client, self.backup_root, databases=[self.database], full=True)
+        self.assertIsNone(manifest_3['parent'])
+        self.assertEqual(manifest_3['collections'][self.database + '.records']['mode'], 'full')
+        self.assertEqual(self.get_xs(manifest_3['name']), list(range(1, 111)))
+
+    def test_failed_backup(self):
+        with mock.patch('datasmart.core.dbbackup._backup_collection', side_effect=RuntimeError('dump failed')):
+            with self.assertRaises(RuntimeError):
+                dbbackup.backup(self.db_client, self.backup_root, databases=[self.database])
+        # no partial backup is left.
+        self.assertEqual(os.listdir(self.backup_root), [])
+
+
+    def test_restore(self):
+        self.collection.create_index([('x', pymongo.DESCENDING), ('_id', pymongo.ASCENDING)], name='x_id')
+        manifest = dbbackup.backup(self.db_client, self.backup_root, databases=[self.database], chunk_size=500)
+        # backups are named by seconds.
+        time.sleep(1.1)
+        self.collection.delete_one({'x': 0})
+        self.collection.insert_many([{'x': i} for i in range(100, 110)])
+        manifest_2 = dbbackup.backup(self.db_client, self.backup_root, databases=[self.database])
+        docs = sorted(self.collection.find(), key=lambda doc: doc['x'])
+        index_info = self.collection.index_information()
+
+        # collections must not exist, unless dropped.
+        with self.assertRaises(AssertionError):
+            dbbackup.restore(self.db_client, self.backup_root)
+        self.db_client.drop_database(self.database)
+        result = dbbackup.restore(self.db_client, self.backup_root, batch_size=7)
+        self.assertEqual(result['name'], manifest_2['name'])
+        self.assertEqual(result['collections'][self.database + '.records'], {'count': 109, 'num_indexes': 2})
+        self.assertEqual(sorted(self.collection.find(), key=lambda doc: doc['x']), docs)
+        self.assertEqual({k: v['key'] for k, v in self.collection.index_information().items()},
+                         {k: v['key'] for k, v in index_info.items()})
+        self.assertEqual(self.db_client[self.database]['keyed'].count_documents({}), 5)
+
+        # an older point.
+        result = dbbackup.restore(self.db_client, self.backup_root, name=manifest['name'],
+                                  collections=[self.database + '.records'], drop=True)
+        self.assertEqual(result['collections'][self.database + '.records']['count'], 100)
+        self.assertEqual(self.collection.count_documents({}), 100)
+        self.assertIn('restored backup', dbbackup.format_restore_summary(result))
+
+
+
+
+class TestManifestJSON(unittest.TestCase):
+
+    def test_key_order(self):
+        spec = bson.SON([('v', 2), ('key', bson.SON([('x', -1), ('_id', 1), ('a', 1)])), ('name', 'x_id_a')])
+        value = dbbackup._to_json(spec)
+        self.assertEqual(list(value['key']), ['x', '_id', 'a'])
+        self.assertEqual(list(dbbackup.from_json(value)['key'].items()), [('x', -1), ('_id', 1), ('a', 1)])
+        self.assertIsInstance(dbbackup.from_json(value)['key'], bson.SON)
+
+if __name__ == '__main__':
+    unittest.main(failfast=True)
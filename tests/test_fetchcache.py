@@ -0,0 +1,77 @@
+""" test script for the fetch cache in datasmart.core.util.fetchcache.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import datasmart.core.util.fetchcache as fetchcache
+import datasmart.core.util.localcopy
+
+
+class TestFetchCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = fetchcache.FetchCache(os.path.join(self.temp_dir, 'cache'), 2500)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def add_file(self, key, size):
+        staging_dir = self.cache.make_staging_dir()
+        path = os.path.join(staging_dir, 'file')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size))
+        self.cache.add([(key, path)])
+        shutil.rmtree(staging_dir)
+
+    def test_key(self):
+        key = fetchcache.get_key('host', '/data', 'a/b', 100, 1000)
+        self.assertEqual(key, fetchcache.get_key('host', '/data', 'a/b', 100, 1000))
+        # changed files have different keys.
+        self.assertNotEqual(key, fetchcache.get_key('host', '/data', 'a/b', 100, 1001))
+        self.assertNotEqual(key, fetchcache.get_key('host', '/data', 'a/b', 101, 1000))
+
+    def test_lru(self):
+        stats_old = fetchcache.get_stats()
+        for key in ['a', 'b']:
+            self.add_file(key, 1000)
+        dst = os.path.join(self.temp_dir, 'dst')
+        # use 'a', so 'b' is evicted first.
+        self.assertEqual(self.cache.checkout([('a', dst + '_a'), ('c', dst + '_c')], hardlink=True), [True, False])
+        self.add_file('c', 1000)
+        self.assertEqual(self.cache.get_usage(), 2000)
+        self.assertEqual(self.cache.checkout([('a', dst), ('b', dst), ('c', dst)]), [True, False, True])
+        # files larger than budget are not cached.
+        self.add_file('d', 3000)
+        self.assertEqual(self.cache.checkout([('d', dst)]), [False])
+        # hard linked files survive eviction.
+        self.add_file('e', 2000)
+        self.assertEqual(self.cache.checkout([('a', dst)]), [False])
+        self.assertEqual(os.path.getsize(dst + '_a'), 1000)
+        stats = fetchcache.get_stats()
+        self.assertEqual(stats['hits'] - stats_old['hits'], 3)
+        self.assertEqual(stats['misses'] - stats_old['misses'], 4)
+        self.assertEqual(stats['evictions'] - stats_old['evictions'], 3)
+
+    def test_checkout_unlocked(self):
+        self.add_file('a', 1000)
+        dst = os.path.join(self.temp_dir, 'dst')
+        copy_file = datasmart.core.util.localcopy.copy_file
+
+        def copy_and_evict(src, dst, **kwargs):
+            # the index is not locked while copying, and evicting the file doesn't break the copy.
+            self.add_file('b', 2000)
+            self.assertEqual(self.cache.get_usage(), 2000)
+            return copy_file(src, dst, **kwargs)
+
+        with mock.patch('datasmart.core.util.localcopy.copy_file', side_effect=copy_and_evict):
+            self.assertEqual(self.cache.checkout([('a', dst)]), [True])
+        self.assertEqual(os.path.getsize(dst), 1000)
+        self.assertEqual(os.listdir(os.path.join(self.cache.cache_dir, 'tmp')), [])
+
+
+if __name__ == '__main__':
+    unittest.main(failfast=True)
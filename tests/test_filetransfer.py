@@ -2,11 +2,17 @@
 
 it's asssumed that datajoin package can be found now, probably by playing with PYTHONPATH.
 """
+import filecmp
 import itertools
 import os
 import shutil
+import subprocess
+import sys
+import threading
+import time
 import unittest
 from copy import deepcopy
+from unittest import mock
 
 import datasmart.core.filetransfer
 import datasmart.core.util.git
@@ -75,6 +81,434 @@ class TestFileTransferLocal(unittest.TestCase):
                 self.local_fetch(subdirs_this=subdirs_this, relative=relative)
                 file_util.rm_dirs_from_dir_list([self.local_data_dir, self.external_site])
 
+    def test_fetch_hardlink(self):
+        print('test fetch hardlink')
+        config_this = deepcopy(self.filetransfer.config)
+        config_this['local_fetch_hardlink'] = True
+        filetransfer = datasmart.core.filetransfer.FileTransfer(config_this)
+        self.filelist = file_util.gen_filelist(10, abs_path=False)
+        file_util.create_dirs_from_dir_list([self.local_data_dir, self.external_site])
+        file_util.create_files_from_filelist(self.filelist, self.external_site)
+        ret = filetransfer.fetch(filelist=self.filelist, src_site={'path': self.external_site, 'local': True},
+                                 relative=True)
+        self.assertEqual(ret['filelist'], datasmart.core.util.path.normalize_filelist_relative(self.filelist))
+        for file in self.filelist:
+            self.assertTrue(os.path.samefile(os.path.join(self.external_site, file),
+                                             os.path.join(self.local_data_dir, file)))
+        # missing files are caught even for dry run.
+        with self.assertRaises(AssertionError):
+            filetransfer.fetch(filelist=self.filelist + ['non_existent_file'],
+                               src_site={'path': self.external_site, 'local': True}, dryrun=True)
+        file_util.rm_dirs_from_dir_list([self.local_data_dir, self.external_site])
+
+    def test_fetch_cache(self):
+        print('test fetch cache')
+        config_this = deepcopy(self.filetransfer.config)
+        config_this['fetch_cache_dir'] = os.path.abspath(self.default_site_path)
+        filetransfer = datasmart.core.filetransfer.FileTransfer(config_this)
+        self.filelist = datasmart.core.util.path.normalize_filelist_relative(file_util.gen_filelist(10, abs_path=False))
+        file_util.create_dirs_from_dir_list([self.local_data_dir, self.external_site])
+        file_util.create_files_from_filelist(self.filelist, self.external_site)
+        # a local site standing for a remote one, as everything works the same way.
+        src_site = {'path': os.path.abspath(self.external_site), 'local': True, 'prefix': ''}
+        stats_old = filetransfer.get_fetch_cache_stats()
+        for subdir in file_util.gen_filenames(2):
+            dest_site = {'path': os.path.abspath(os.path.join(self.local_data_dir, subdir)), 'local': True}
+            ret_filelist, stats = filetransfer._fetch_cached(src_site, dest_site, self.filelist,
+                                                             {'relative': True, 'dryrun': False})
+            self.assertEqual(ret_filelist, self.filelist)
+            for file in self.filelist:
+                self.assertTrue(filecmp.cmp(os.path.join(self.external_site, file),
+                                            os.path.join(dest_site['path'], file), shallow=False))
+        # the second fetch is all served from the cache.
+        self.assertTrue(all(x['skipped'] for x in stats['files']))
+        stats_new = filetransfer.get_fetch_cache_stats()
+        self.assertEqual(stats_new['hits'] - stats_old['hits'], 10)
+        self.assertEqual(stats_new['misses'] - stats_old['misses'], 10)
+        file_util.rm_dirs_from_dir_list([self.local_data_dir, self.external_site, self.default_site_path])
+
+    def test_fetch_lazy(self):
+        print('test fetch lazy')
+        self.filelist = file_util.gen_filelist(20, abs_path=False)
+        file_util.create_dirs_from_dir_list([self.local_data_dir, self.external_site])
+        file_util.create_files_from_filelist(self.filelist, self.external_site)
+        src_site = {'path': self.external_site, 'local': True}
+        ret = self.filetransfer.fetch(filelist=self.filelist, src_site=src_site, relative=True, dryrun=True)
+        with self.filetransfer.fetch_lazy(self.filelist, src_site=src_site, relative=True, workers=2) as lazy_fetch:
+            # same canonical filelist as fetch, and nothing is fetched yet.
+            self.assertEqual(list(lazy_fetch), ret['filelist'])
+            self.assertFalse(any(handle.fetched for handle in lazy_fetch.values()))
+            self.assertFalse(os.path.exists(os.path.join(self.local_data_dir, ret['filelist'][0])))
+            # fetched on first open.
+            with lazy_fetch[ret['filelist'][0]].open() as f:
+                with open(os.path.join(self.external_site, self.filelist[0]), 'rb') as f_src:
+                    self.assertEqual(f.read(), f_src.read())
+            self.assertEqual(sum(handle.fetched for handle in lazy_fetch.values()), 1)
+            # then the rest in background.
+            futures = lazy_fetch.prefetch(batch_size=5)
+            self.assertEqual(len(futures), len(self.filelist))
+            lazy_fetch.wait()
+            for file, handle in lazy_fetch.items():
+                self.assertTrue(handle.fetched)
+                self.assertTrue(filecmp.cmp(handle.fetch(), os.path.join(self.local_data_dir, file),
+                                            shallow=False))
+            self.assertEqual(lazy_fetch.stats['transfers'], 5)
+            self.assertEqual(lazy_fetch.stats['files'], len(self.filelist))
+        file_util.rm_dirs_from_dir_list([self.local_data_dir])
+        # opening a file queued for a background fetch not started yet fetches it right away.
+        gate = threading.Event()
+        fetch = self.filetransfer.fetch
+
+        def slow_fetch(*args, **kwargs):
+            if threading.current_thread() is not threading.main_thread():
+                gate.wait()
+            return fetch(*args, **kwargs)
+
+        with mock.patch.object(self.filetransfer, 'fetch', side_effect=slow_fetch):
+            with self.filetransfer.fetch_lazy(self.filelist, src_site=src_site, relative=True,
+                                              workers=1) as lazy_fetch:
+                lazy_fetch.prefetch(batch_size=5)
+                threading.Timer(0.2, gate.set).start()
+                handle = lazy_fetch[ret['filelist'][-1]]
+                self.assertTrue(filecmp.cmp(handle.fetch(), os.path.join(self.external_site, handle.path),
+                                            shallow=False))
+                lazy_fetch.wait()
+                # the last batch skips the file taken over.
+                self.assertEqual(lazy_fetch.stats['transfers'], 5)
+                self.assertEqual(lazy_fetch.stats['files'], len(self.filelist))
+        # errors show up on open.
+        with self.filetransfer.fetch_lazy(['non_existent_file'], src_site=src_site) as lazy_fetch:
+            with self.assertRaises(AssertionError):
+                lazy_fetch['non_existent_file'].open()
+        file_util.rm_dirs_from_dir_list([self.local_data_dir, self.external_site])
+
+    def test_stat(self):
+        print('test stat')
+        self.filelist = file_util.gen_filelist(10, abs_path=False)
+        file_util.create_dirs_from_dir_list([self.external_site])
+        file_util.create_files_from_filelist(self.filelist, self.external_site)
+        site = {'path': os.path.abspath(self.external_site), 'local': True}
+        filelist = self.filelist + ['non_existent_file']
+        ret = self.filetransfer.stat(filelist, site=site)
+        self.assertEqual([x['path'] for x in ret], datasmart.core.util.path.normalize_filelist_relative(filelist))
+        self.assertEqual([x['exists'] for x in ret], [True] * len(self.filelist) + [False])
+        for x in ret[:-1]:
+            self.assertEqual(x['size'], os.path.getsize(os.path.join(self.external_site, x['path'])))
+        self.assertIsNone(ret[-1]['size'])
+        # cached result, until a push or removal.
+        file_util.create_files_from_filelist(['non_existent_file'], self.external_site)
+        self.assertFalse(self.filetransfer.stat(filelist, site=site)[-1]['exists'])
+        self.assertTrue(self.filetransfer.stat(filelist, site=site, use_cache=False)[-1]['exists'])
+        # the script used for remote sites gives the same result.
+        result = self.filetransfer._run_site_script(site, datasmart.core.filetransfer._STAT_FILES_SCRIPT,
+                                                    [x['path'] for x in ret] + ['no_such_file'])
+        lines = result.stdout.decode().splitlines()
+        self.assertEqual(lines[-1], '-')
+        for x, line in zip(ret[:-1], lines):
+            self.assertEqual(int(line.split()[0]), x['size'])
+        file_util.rm_dirs_from_dir_list([self.external_site])
+
+    def test_transfer_queue(self):
+        print('test transfer queue')
+        self.filelist = file_util.gen_filelist(10, abs_path=False)
+        file_util.create_dirs_from_dir_list([self.local_data_dir, self.default_site_path])
+        file_util.create_files_from_filelist(self.filelist, self.local_data_dir)
+        append_prefixes = file_util.gen_filenames(5)
+        with datasmart.core.filetransfer.TransferQueue(self.filetransfer, max_pending=2) as queue:
+            futures = [queue.push(self.filelist, dest_append_prefix=[append_prefix])
+                       for append_prefix in append_prefixes]
+            # errors are raised from the future of the failed push only.
+            future_bad = queue.push(self.filelist + ['non_existent_file'], dest_append_prefix=['bad'])
+            with self.assertRaises(AssertionError):
+                future_bad.result()
+        for future, append_prefix in zip(futures, append_prefixes):
+            ret = future.result()
+            self.assertEqual(ret['dest']['append_prefix'], append_prefix)
+            for file in ret['filelist']:
+                self.assertTrue(os.path.exists(os.path.join(self.default_site_path, file)))
+        file_util.rm_dirs_from_dir_list([self.local_data_dir, self.default_site_path])
+
+    def test_dest_dir(self):
+        print('test dest dir')
+        self.filelist = file_util.gen_filelist(5, abs_path=False)
+        file_util.create_dirs_from_dir_list([self.local_data_dir, self.default_site_path])
+        file_util.create_files_from_filelist(self.filelist, self.local_data_dir)
+        # like rsync, the last level of the dest dir is created, and parents of files under it.
+        ret = self.filetransfer.push(self.filelist, dest_append_prefix=['a'])
+        for file in ret['filelist']:
+            self.assertTrue(os.path.exists(os.path.join(self.default_site_path, file)))
+        # but not those above the dest dir.
+        with self.assertRaises(FileNotFoundError):
+            self.filetransfer.push(self.filelist, dest_append_prefix=['b', 'c'])
+        self.assertFalse(os.path.exists(os.path.join(self.default_site_path, 'b')))
+        file_util.rm_dirs_from_dir_list([self.local_data_dir, self.default_site_path])
+
+    def test_relay(self):
+        print('test relay')
+        self.filelist = [os.path.join('strip', p) for p in file_util.gen_filelist(10, abs_path=False)]
+        file_util.create_dirs_from_dir_list([self.external_site, self.default_site_path])
+        file_util.create_files_from_filelist(self.filelist, self.external_site)
+        src_site = datasmart.core.util.path.normalize_site({'path': os.path.abspath(self.external_site),
+                                                            'local': True})
+        dest_site = datasmart.core.util.path.normalize_site({'path': os.path.abspath(self.default_site_path),
+                                                             'local': True})
+        # between local sites, it's an ordinary transfer.
+        append_prefix = file_util.gen_filenames(1)[0]
+        ret = self.filetransfer.relay(self.filelist, src_site, dest_site, dest_append_prefix=[append_prefix])
+        self.assertEqual(ret['dest']['append_prefix'], append_prefix)
+        for file_from, file_to in zip(self.filelist, ret['filelist']):
+            self.assertTrue(filecmp.cmp(os.path.join(self.external_site, file_from),
+                                        os.path.join(self.default_site_path, file_to), shallow=False))
+        # the tar stream used between remote sites gives the same result as rsync.
+        for relative, strip_prefix in [(True, ''), (True, 'strip'), (False, '')]:
+            with self.subTest(relative=relative, strip_prefix=strip_prefix):
+                # a leading '-' must not be taken as an option.
+                append_prefix = '-' + file_util.gen_filenames(1)[0]
+                options = self.filetransfer._process_default_pars_transfer(
+                    {'relative': relative, 'dryrun': False, 'strip_prefix': strip_prefix,
+                     'dest_append_prefix': append_prefix}, src_site, dest_site)
+                filelist_from, filelist_to = datasmart.core.util.path.get_rsync_filelist(self.filelist, options)
+                self.filetransfer._make_dest_dir(dest_site, append_prefix)
+                bytes_list = self.filetransfer._relay_tar(src_site, dest_site, filelist_from, filelist_to, options,
+                                                          None)
+                ret_filelist, _ = self.filetransfer._transfer(src_site, dest_site, self.filelist,
+                                                              dict(options, dest_append_prefix=append_prefix + '_'))
+                for file_from, file_to, file_rsync, num_bytes in zip(self.filelist, filelist_to, ret_filelist,
+                                                                     bytes_list):
+                    path_to = os.path.join(self.default_site_path, append_prefix, file_to)
+                    self.assertEqual(os.path.join(append_prefix + '_', file_to), file_rsync)
+                    self.assertTrue(filecmp.cmp(os.path.join(self.external_site, file_from), path_to, shallow=False))
+                    self.assertEqual(num_bytes, os.path.getsize(path_to))
+        file_util.rm_dirs_from_dir_list([self.external_site, self.default_site_path])
+
+    def test_bundles(self):
+        print('test bundles')
+        config_this = deepcopy(self.filetransfer.config)
+        config_this['remote_site_config'] = {'remote': {'ssh_username': 'test', 'ssh_port': 22,
+                                                        'bundle_threshold': 1000, 'bundle_chunk_size': 2500}}
+        filetransfer = datasmart.core.filetransfer.FileTransfer(config_this)
+        file_util.create_dirs_from_dir_list([self.local_data_dir])
+        filelist = file_util.gen_filenames(7)
+        for file, size in zip(filelist, [10, 2000, 900, 900, 900, 5000, 100]):
+            with open(os.path.join(self.local_data_dir, file), 'wb') as f:
+                f.write(os.urandom(size))
+        src_site = {'path': os.path.abspath(self.local_data_dir), 'local': True}
+        remote_site = {'path': 'remote', 'local': False, 'prefix': '/data'}
+        options = {'dryrun': False, 'dest_append_prefix': 'prefix'}
+        with mock.patch.object(filetransfer, '_stat_remote', side_effect=lambda site, paths: [None] * len(paths)):
+            self.assertEqual(filetransfer._get_bundles(src_site, remote_site, filelist, filelist, options),
+                             ([[0, 2, 3], [4, 6]], [1, 5]))
+        # small files up to date on the dest are left out.
+        up_to_date = {os.path.join('prefix', filelist[idx]): os.stat(os.path.join(self.local_data_dir, filelist[idx]))
+                      for idx in (2, 4)}
+        with mock.patch.object(filetransfer, '_stat_remote', side_effect=lambda site, paths: [
+                (up_to_date[p].st_size, int(up_to_date[p].st_mtime)) if p in up_to_date else None for p in paths]):
+            self.assertEqual(filetransfer._get_bundles(src_site, remote_site, filelist, filelist, options),
+                             ([[0, 3, 6]], [1, 5]))
+        # no bundling for dry run, or sites without bundle_threshold.
+        self.assertEqual(filetransfer._get_bundles(src_site, remote_site, filelist, filelist,
+                                                   dict(options, dryrun=True)), ([], list(range(7))))
+        self.assertEqual(self.filetransfer._get_bundles(src_site, src_site, filelist, filelist, options),
+                         ([], list(range(7))))
+        file_util.rm_dirs_from_dir_list([self.local_data_dir])
+
+    def test_shards(self):
+        print('test shards')
+        config_this = deepcopy(self.filetransfer.config)
+        config_this['remote_site_config'] = {'remote': {'ssh_username': 'test', 'ssh_port': 22, 'ssh_multiplex': False,
+                                                        'rsync_parallel': 3}}
+        filetransfer = datasmart.core.filetransfer.FileTransfer(config_this)
+        file_util.create_dirs_from_dir_list([self.local_data_dir])
+        filelist = file_util.gen_filenames(7)
+        for file, size in zip(filelist, [5000, 100, 3000, 2000, 100, 1000, 900]):
+            with open(os.path.join(self.local_data_dir, file), 'wb') as f:
+                f.write(os.urandom(size))
+        src_site = {'path': os.path.abspath(self.local_data_dir), 'local': True}
+        remote_site = {'path': 'remote', 'local': False, 'prefix': '/data'}
+        # largest first into the lightest shard, ties to the first shard.
+        shards = filetransfer._get_transfer_shards(src_site, remote_site, filelist)
+        self.assertEqual(shards, [[0], [2, 6], [1, 3, 4, 5]])
+        self.assertEqual(filetransfer._get_transfer_shards(src_site, remote_site, filelist), shards)
+        # by count for remote sources, and never more shards than files.
+        self.assertEqual(filetransfer._get_transfer_shards(remote_site, src_site, filelist),
+                         [[0, 3, 6], [1, 4], [2, 5]])
+        self.assertEqual(filetransfer._get_transfer_shards(src_site, remote_site, filelist[:2]), [[0], [1]])
+        # missing files are left to rsync to report.
+        self.assertEqual(filetransfer._get_transfer_shards(src_site, remote_site, filelist + ['missing']),
+                         [[0], [2, 6], [1, 3, 4, 5, 7]])
+
+        # the canonical filelist and stats are in the original order, however files are sharded.
+        rsync_calls = []
+
+        def fake_rsync(rsync_command, rsync_filelist_from, rsync_filelist_to, max_attempts, backoff):
+            rsync_calls.append(list(rsync_filelist_from))
+            return {'files': {p: os.path.getsize(os.path.join(self.local_data_dir, p)) for p in rsync_filelist_to},
+                    'wire_bytes': 0, 'literal_bytes': 0}
+
+        with mock.patch.object(filetransfer, '_run_rsync', side_effect=fake_rsync), \
+                mock.patch.object(filetransfer, '_make_dest_dir'), \
+                mock.patch.object(filetransfer, '_get_compression_groups',
+                                  side_effect=lambda src, dest, files: [([], [False] * len(files),
+                                                                         list(range(len(files))))]):
+            ret_filelist, stats = filetransfer._transfer(src_site, remote_site, filelist,
+                                                         {'relative': True, 'dryrun': False})
+        self.assertEqual(sorted(rsync_calls), sorted([filelist[i] for i in shard] for shard in shards))
+        self.assertEqual(ret_filelist, filelist)
+        self.assertEqual([x['path'] for x in stats['files']], filelist)
+        self.assertEqual([x['bytes'] for x in stats['files']], [5000, 100, 3000, 2000, 100, 1000, 900])
+        file_util.rm_dirs_from_dir_list([self.local_data_dir])
+
+    def test_rsync_retry(self):
+        print('test rsync retry')
+        counter_path = os.path.abspath(file_util.gen_unique_local_paths(1)[0])
+        # a fake rsync, which fails with exit code in argv[1] after transferring the first file for the first time.
+        fake_rsync = [sys.executable, '-c', '\n'.join([
+            'import os, sys',
+            'assert sys.argv[3] == "--files-from=-"',
+            'files = [x.strip()[1:] for x in sys.stdin]',
+            'first = not os.path.exists(sys.argv[2])',
+            'open(sys.argv[2], "at").write(" ".join(files) + "\\n")',
+            'for f in files[:1] if first else files:',
+            '    print("{} >f+++++++++ 10 {}".format(datasmart_prefix, f))',
+            'sys.exit(int(sys.argv[1]) if first else 0)',
+        ]).replace('datasmart_prefix', repr(datasmart.core.filetransfer._RSYNC_STAT_PREFIX.strip()))]
+        filelist = ['a', 'b', 'c']
+        stats = self.filetransfer._run_rsync(fake_rsync + ['12', counter_path, 'src', 'dest'], filelist, filelist,
+                                             max_attempts=3, backoff=0)
+        self.assertEqual(stats['retries'], 1)
+        self.assertEqual(stats['attempts'], {'b': 2, 'c': 2})
+        self.assertEqual(stats['files'], {'a': 10, 'b': 10, 'c': 10})
+        # only files not done are run again.
+        with open(counter_path) as f:
+            self.assertEqual(f.read().splitlines(), ['a b c', 'b c'])
+        os.remove(counter_path)
+        # fatal errors are not retried.
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.filetransfer._run_rsync(fake_rsync + ['1', counter_path, 'src', 'dest'], filelist, filelist,
+                                         max_attempts=3, backoff=0)
+        with open(counter_path) as f:
+            self.assertEqual(len(f.read().splitlines()), 1)
+        os.remove(counter_path)
+
+    def test_tar_retry(self):
+        print('test tar retry')
+        site = {'path': os.path.abspath(self.local_data_dir), 'local': True}
+        filelist = ['a', 'b']
+        with mock.patch.object(self.filetransfer, '_relay_tar',
+                               side_effect=[subprocess.CalledProcessError(255, 'ssh'), [3, 4]]) as relay_tar:
+            stats = self.filetransfer._run_tar(site, site, filelist, filelist, {}, None, max_attempts=3, backoff=0)
+        self.assertEqual(relay_tar.call_count, 2)
+        self.assertEqual(stats['files'], {'a': 3, 'b': 4})
+        self.assertEqual((stats['retries'], stats['attempts']), (1, {'a': 2, 'b': 2}))
+        # fatal errors are not retried.
+        with mock.patch.object(self.filetransfer, '_relay_tar',
+                               side_effect=subprocess.CalledProcessError(2, 'tar')) as relay_tar:
+            with self.assertRaises(subprocess.CalledProcessError):
+                self.filetransfer._run_tar(site, site, filelist, filelist, {}, None, max_attempts=3, backoff=0)
+        self.assertEqual(relay_tar.call_count, 1)
+
+    def test_content_store(self):
+        print('test content store')
+        file_util.create_dirs_from_dir_list([self.local_data_dir, self.default_site_path])
+        filelist = ['a/x.txt', 'a/y.txt', 'b/z.txt']
+        for file, content in zip(filelist, [b'same', b'same', b'other']):
+            os.makedirs(os.path.dirname(os.path.join(self.local_data_dir, file)), exist_ok=True)
+            with open(os.path.join(self.local_data_dir, file), 'wb') as f:
+                f.write(content)
+        src_site = datasmart.core.util.path.normalize_site({'path': os.path.abspath(self.local_data_dir),
+                                                            'local': True})
+        dest_site = datasmart.core.util.path.normalize_site({'path': os.path.abspath(self.default_site_path),
+                                                             'local': True})
+        store_dir = os.path.join(self.default_site_path, datasmart.core.filetransfer._CONTENT_STORE_NAME)
+
+        def push(append_prefix):
+            ret_filelist, stats = self.filetransfer._push_content_addressed(
+                src_site, dest_site, filelist, {'relative': True, 'dryrun': False, 'dest_append_prefix': append_prefix})
+            self.assertEqual(ret_filelist, [os.path.join(append_prefix, file) for file in filelist])
+            return [os.path.join(self.default_site_path, p) for p in ret_filelist], stats
+
+        paths, stats = push('first')
+        # same content is stored and transferred once, and hard linked into place, read only.
+        store_files = [os.path.join(d, f) for d, _, files in os.walk(store_dir) for f in files]
+        self.assertEqual(len(store_files), 2)
+        self.assertEqual([x['skipped'] for x in stats['files']], [False, True, False])
+        self.assertTrue(os.path.samefile(paths[0], paths[1]))
+        self.assertFalse(os.path.samefile(paths[0], paths[2]))
+        self.assertTrue(any(os.path.samefile(paths[2], x) for x in store_files))
+        self.assertEqual(os.stat(paths[0]).st_mode & 0o222, 0)
+        for file, path in zip(filelist, paths):
+            self.assertTrue(filecmp.cmp(os.path.join(self.local_data_dir, file), path, shallow=False))
+        # nothing is transferred again. links are reference counts.
+        paths_second, stats = push('second')
+        self.assertTrue(all(x['skipped'] for x in stats['files']))
+        self.assertEqual((os.stat(paths[0]).st_nlink, os.stat(paths[2]).st_nlink), (5, 3))
+        self.assertEqual(([x['attempts'] for x in stats['files']], stats['retries']), ([1, 1, 1], 0))
+        # retries of the transfer into the store are counted for files with new content.
+        transfer = self.filetransfer._transfer
+
+        def transfer_retried(*args):
+            ret_filelist, stats_this = transfer(*args)
+            for stat_this in stats_this['files']:
+                stat_this['attempts'] = 2
+            stats_this['retries'] = 1
+            return ret_filelist, stats_this
+
+        with open(os.path.join(self.local_data_dir, 'b/z.txt'), 'wb') as f:
+            f.write(b'new')
+        with mock.patch.object(self.filetransfer, '_transfer', side_effect=transfer_retried):
+            _, stats = push('third')
+        self.assertEqual(([x['attempts'] for x in stats['files']], stats['retries']), ([1, 1, 2], 1))
+        self.filetransfer.remove_dir(dict(dest_site, append_prefix='third'))
+
+        # garbage is content no longer referenced, after a grace period.
+        self.filetransfer.remove_dir(dict(dest_site, append_prefix='first'))
+        os.remove(paths_second[2])
+        self.assertEqual(self.filetransfer.collect_content_store_garbage(dest_site), 0)
+        time.sleep(1.1)
+        with mock.patch('datasmart.core.filetransfer._CONTENT_STORE_GC_GRACE', 0):
+            self.assertEqual(self.filetransfer.collect_content_store_garbage(dest_site), 2)
+        self.assertEqual(len([f for _, _, files in os.walk(store_dir) for f in files]), 1)
+        self.assertEqual(os.stat(paths_second[0]).st_nlink, 3)
+        file_util.rm_dirs_from_dir_list([self.local_data_dir, self.default_site_path])
+
+    def test_use_content_store(self):
+        print('test use content store')
+        config_this = deepcopy(self.filetransfer.config)
+        config_this['remote_site_config'] = {'nas': {'ssh_username': 'test', 'ssh_port': 22, 'content_store': True},
+                                             'other': {'ssh_username': 'test', 'ssh_port': 22}}
+        filetransfer = datasmart.core.filetransfer.FileTransfer(config_this)
+        nas, other = [{'path': x, 'local': False, 'prefix': '/data'} for x in ('nas', 'other')]
+        mount = {'path': '/mnt/nas', 'local': True}
+        # by the actual site, or by the site itself if it's mapped to a local mount of it.
+        self.assertTrue(filetransfer._use_content_store(nas, nas))
+        self.assertFalse(filetransfer._use_content_store(nas, other))
+        self.assertTrue(filetransfer._use_content_store(other, nas))
+        self.assertTrue(filetransfer._use_content_store(nas, mount))
+        self.assertFalse(filetransfer._use_content_store(mount, mount))
+
+    def test_remove_dirs(self):
+        print('test remove dirs')
+        file_util.create_dirs_from_dir_list([self.default_site_path, self.external_site])
+        append_prefixes = file_util.gen_filenames(5)
+        sites = []
+        for site_path in (self.default_site_path, self.external_site):
+            for append_prefix in append_prefixes:
+                file_util.create_files_from_filelist(file_util.gen_filelist(5, abs_path=False),
+                                                     os.path.join(site_path, append_prefix))
+                sites.append({'local': True, 'path': os.path.abspath(site_path), 'append_prefix': append_prefix})
+        self.assertEqual(self.filetransfer.remove_dirs(sites[:-1]), [])
+        for site in sites[:-1]:
+            self.assertFalse(os.path.exists(os.path.join(site['path'], site['append_prefix'])))
+        self.assertTrue(os.path.exists(os.path.join(sites[-1]['path'], sites[-1]['append_prefix'])))
+        # removing an already removed directory is fine.
+        self.filetransfer.remove_dir(sites[0])
+        # can't escape the site, or remove the whole site.
+        for bad_prefix in ('..', '.', os.path.join('..', append_prefixes[0])):
+            with self.assertRaises(AssertionError):
+                self.filetransfer.remove_dirs([{'local': True, 'path': os.path.abspath(self.default_site_path),
+                                                'append_prefix': bad_prefix}])
+        file_util.rm_dirs_from_dir_list([self.default_site_path, self.external_site])
+
     def local_fetch(self, subdirs_this=None, relative=True):
         # test local fetch, so create external and local data dir
         # ok. Now time to create files in external.
@@ -87,7 +521,7 @@ class TestFileTransferLocal(unittest.TestCase):
         ret2 = self.filetransfer.fetch(filelist=self.filelist, src_site={'path': self.external_site, 'local': True},
                                        relative=relative,
                                        subdirs=subdirs_this, dryrun=True)
-        self.assertEqual(ret, ret2)
+        self.check_dryrun_result(ret, ret2)
 
     def local_push(self, subdirs_this=None, relative=True, dest_append_prefix=None):
         if dest_append_prefix is None:
@@ -106,7 +540,16 @@ class TestFileTransferLocal(unittest.TestCase):
         # check dry run.
         ret2 = self.filetransfer.push(filelist=self.filelist, relative=relative, subdirs=subdirs_this,
                                       dest_append_prefix=dest_append_prefix, dryrun=True)
+        self.check_dryrun_result(ret, ret2)
+
+    def check_dryrun_result(self, ret, ret2):
+        # same result, except that everything is up to date for dry run.
+        stats = ret.pop('stats')
+        stats2 = ret2.pop('stats')
         self.assertEqual(ret, ret2)
+        self.assertEqual([x['path'] for x in stats['files']], [x['path'] for x in stats2['files']])
+        self.assertTrue(all(x['skipped'] for x in stats2['files']))
+        self.assertEqual(stats2['total_bytes'], 0)
 
     def check_local_push_fetch_result(self, fetch_flag, ret, external_site,
                                       subdirs_this=None, relative=True, dest_append_prefix=None):
@@ -169,6 +612,13 @@ class TestFileTransferLocal(unittest.TestCase):
             with open(dest_file, 'rb') as f1, open(src_file, 'rb') as f2:
                 self.assertEqual(f1.read(), f2.read())
 
+        # check stats.
+        self.assertEqual([x['path'] for x in ret['stats']['files']], ret['filelist'])
+        self.assertFalse(any(x['skipped'] for x in ret['stats']['files']))
+        for stat_this, file in zip(ret['stats']['files'], ret['filelist']):
+            self.assertEqual(stat_this['bytes'], os.path.getsize(os.path.join(ret['dest']['path'], file)))
+        self.assertEqual(ret['stats']['total_bytes'], sum(x['bytes'] for x in ret['stats']['files']))
+
 
 if __name__ == '__main__':
     unittest.main(failfast=True)
@@ -0,0 +1,64 @@
+""" test script for the registry of normalized configs in datasmart.core.filetransfer.
+"""
+import json
+import os
+import unittest
+
+import datasmart.core.filetransfer
+import datasmart.core.util.git
+from datasmart.test_util import env_util, file_util
+
+
+class TestFileTransferConfigRegistry(unittest.TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        # check git is clean
+        datasmart.core.util.git.check_git_repo_clean()
+
+    @classmethod
+    def setUpClass(cls):
+        # check git is clean
+        datasmart.core.util.git.check_git_repo_clean()
+
+    def setUp(self):
+        self.dirs_to_cleanup = file_util.gen_unique_local_paths(2)
+        self.config_this = {
+            "local_data_dir": os.path.abspath(self.dirs_to_cleanup[0]),
+            "site_mapping_push": [],
+            "site_mapping_fetch": [],
+            "remote_site_config": {},
+            "default_site": {'local': True, 'path': os.path.abspath(self.dirs_to_cleanup[1])},
+            "quiet": True,
+            "local_fetch_option": "copy"
+        }
+        env_util.setup_local_config(datasmart.core.filetransfer.FileTransfer.config_path,
+                                    json.dumps(self.config_this))
+
+    def tearDown(self):
+        env_util.teardown_local_config()
+        file_util.rm_dirs_from_dir_list([self.dirs_to_cleanup[0]])
+
+    def test_shared(self):
+        filetransfer_1 = datasmart.core.filetransfer.FileTransfer()
+        filetransfer_2 = datasmart.core.filetransfer.FileTransfer()
+        self.assertIs(filetransfer_1.config, filetransfer_2.config)
+        self.assertEqual(filetransfer_1.config, self.config_this)
+
+    def test_invalidate(self):
+        filetransfer_1 = datasmart.core.filetransfer.FileTransfer()
+        self.assertTrue(filetransfer_1.config['quiet'])
+        # change the config on disk. without invalidation, the old one is still used.
+        self.config_this['quiet'] = False
+        with open(os.path.join('config', *datasmart.core.filetransfer.FileTransfer.config_path, 'config.json'),
+                  'wt') as f:
+            f.write(json.dumps(self.config_this))
+        self.assertTrue(datasmart.core.filetransfer.FileTransfer().config['quiet'])
+        datasmart.core.filetransfer.FileTransfer.invalidate_config()
+        filetransfer_2 = datasmart.core.filetransfer.FileTransfer()
+        self.assertIsNot(filetransfer_1.config, filetransfer_2.config)
+        self.assertFalse(filetransfer_2.config['quiet'])
+
+
+if __name__ == '__main__':
+    unittest.main(failfast=True)
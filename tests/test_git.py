@@ -0,0 +1,101 @@
+""" test script for reading git metadata in datasmart.core.util.git.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+import datasmart.core.util.git as git
+
+
+def run_git(args, cwd):
+    return subprocess.check_output(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com'] + args,
+                                   cwd=cwd, stderr=subprocess.DEVNULL).decode().strip()
+
+
+class TestGit(unittest.TestCase):
+
+    def setUp(self):
+        git.clear_cache()
+        self.temp_dir = tempfile.mkdtemp()
+        self.remote_path = os.path.join(self.temp_dir, 'remote.git')
+        self.repo_path = os.path.join(self.temp_dir, 'repo')
+        run_git(['init', '-q', '--bare', self.remote_path], self.temp_dir)
+        run_git(['init', '-q', self.repo_path], self.temp_dir)
+        run_git(['checkout', '-q', '-b', 'master'], self.repo_path)
+        run_git(['remote', 'add', 'origin', self.remote_path], self.repo_path)
+        self.commit('first')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def commit(self, message):
+        run_git(['commit', '-q', '--allow-empty', '-m', message], self.repo_path)
+        return run_git(['rev-parse', 'HEAD'], self.repo_path)
+
+    def check_hash(self, path=None):
+        self.assertEqual(git.get_git_repo_hash(path or self.repo_path), run_git(['rev-parse', 'HEAD'], self.repo_path))
+
+    def test_url(self):
+        # read without running git.
+        with mock.patch('datasmart.core.util.git.get_cmd_output', side_effect=AssertionError):
+            self.assertEqual(git.get_git_repo_url(self.repo_path), self.remote_path)
+        run_git(['remote', 'set-url', 'origin', 'https://git.example.com/repo.git'], self.repo_path)
+        self.assertEqual(git.get_git_repo_url(self.repo_path), 'https://git.example.com/repo.git')
+        # not in config, left to git.
+        self.assertEqual(git.get_git_repo_url(self.repo_path, 'unknown'), 'unknown')
+
+    def test_hash(self):
+        self.check_hash()
+        with mock.patch('datasmart.core.util.git.get_cmd_output', side_effect=AssertionError):
+            self.check_hash()
+        os.makedirs(os.path.join(self.repo_path, 'subdir'))
+        self.check_hash(os.path.join(self.repo_path, 'subdir'))
+        # a new commit on the branch is picked up.
+        self.commit('second')
+        self.check_hash()
+        # so are packed refs, a detached HEAD, and another branch.
+        run_git(['pack-refs', '--all'], self.repo_path)
+        self.check_hash()
+        run_git(['checkout', '-q', 'HEAD~1'], self.repo_path)
+        self.check_hash()
+        run_git(['checkout', '-q', '-b', 'another'], self.repo_path)
+        self.commit('third')
+        self.check_hash()
+        # a linked worktree.
+        worktree_path = os.path.join(self.temp_dir, 'worktree')
+        run_git(['worktree', 'add', '-q', worktree_path, 'master'], self.repo_path)
+        self.assertEqual(git.get_git_repo_hash(worktree_path), run_git(['rev-parse', 'master'], self.repo_path))
+
+    def test_changed_while_reading(self):
+        read_file = git._read_file
+        new_commits = []
+
+        def read_file_and_commit(path, files_read):
+            content = read_file(path, files_read)
+            if path.endswith(os.path.join('refs', 'heads', 'master')) and not new_commits:
+                new_commits.append(self.commit('second'))
+            return content
+
+        with mock.patch('datasmart.core.util.git._read_file', side_effect=read_file_and_commit):
+            self.assertNotEqual(git.get_git_repo_hash(self.repo_path), new_commits[0])
+        # the old hash read is not cached under the signature of the new commit.
+        with mock.patch('datasmart.core.util.git.get_cmd_output', side_effect=AssertionError):
+            self.assertEqual(git.get_git_repo_hash(self.repo_path), new_commits[0])
+
+    def test_commits_in_remote(self):
+        first = run_git(['rev-parse', 'HEAD'], self.repo_path)
+        run_git(['push', '-q', 'origin', 'master'], self.repo_path)
+        second = self.commit('second')
+        commits = [first, second, '0' * 40]
+        self.assertEqual(git.check_commits_in_remote(self.repo_path, commits), [True, False, False])
+        self.assertEqual(git.check_commits_in_remote(self.repo_path, []), [])
+        self.assertEqual([git.check_commit_in_remote(self.repo_path, x) for x in commits[:2]], [True, False])
+        with self.assertRaises(AssertionError):
+            git.check_commits_in_remote(self.repo_path, ['HEAD'])
+
+
+if __name__ == '__main__':
+    unittest.main(failfast=True)
@@ -0,0 +1,96 @@
+""" test script for incremental installation in datasmart.core.util.install.
+"""
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+import datasmart.core.util.install as install
+
+
+class TestInstall(unittest.TestCase):
+
+    def setUp(self):
+        self.root = os.path.join(tempfile.mkdtemp(), 'project')
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.root))
+
+    def read(self, relpath):
+        with open(os.path.join(self.root, relpath), 'rb') as f:
+            return f.read()
+
+    def test_incremental(self):
+        files = [(os.path.join('config', 'a', 'config.json'), b'{"a": 1}', False),
+                 (os.path.join('config', 'b', 'config.json'), b'{"b": 1}', False),
+                 ('start.sh', b'echo start', True)]
+        statuses = install.install_files(self.root, files)
+        self.assertEqual(set(statuses.values()), {'created'})
+        self.assertTrue(os.stat(os.path.join(self.root, 'start.sh')).st_mode & stat.S_IEXEC)
+        mtime = os.stat(os.path.join(self.root, 'start.sh')).st_mtime_ns
+        # a file not installed, like prepare results, and a config filled out by the user.
+        with open(os.path.join(self.root, 'prepare_result.p'), 'wb') as f:
+            f.write(b'prepared')
+        with open(os.path.join(self.root, files[0][0]), 'wb') as f:
+            f.write(b'{"a": 2}')
+
+        # same files again, except that the default config of ``a`` changes.
+        files[0] = (files[0][0], b'{"a": 3}', False)
+        statuses = install.install_files(self.root, files)
+        self.assertEqual(statuses, {files[0][0]: 'kept', files[1][0]: 'unchanged', 'start.sh': 'unchanged'})
+        self.assertEqual(os.stat(os.path.join(self.root, 'start.sh')).st_mtime_ns, mtime)
+        self.assertEqual(self.read(files[0][0]), b'{"a": 2}')
+        # removing the user's change makes it installed again.
+        os.remove(os.path.join(self.root, files[0][0]))
+        statuses = install.install_files(self.root, files)
+        self.assertEqual(statuses[files[0][0]], 'created')
+        self.assertEqual(self.read(files[0][0]), b'{"a": 3}')
+        files[2] = ('start.sh', b'echo start again', True)
+        self.assertEqual(install.install_files(self.root, files)['start.sh'], 'updated')
+        self.assertEqual(self.read('start.sh'), b'echo start again')
+
+        # files no longer installed are removed, along with their empty directories.
+        statuses = install.install_files(self.root, files[:1])
+        self.assertEqual(statuses, {files[0][0]: 'unchanged', files[1][0]: 'removed', 'start.sh': 'removed'})
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'config', 'b')))
+        self.assertEqual(self.read('prepare_result.p'), b'prepared')
+        summary = install.format_summary(statuses)
+        self.assertIn('1 unchanged', summary)
+        self.assertIn('2 removed', summary)
+
+    def test_confirm_remove(self):
+        files = [('a.txt', b'a', False), ('b.txt', b'b', False)]
+        install.install_files(self.root, files)
+        asked = []
+        # not confirmed, so they stay installed.
+        statuses = install.install_files(self.root, files[:1], confirm_remove=lambda x: asked.append(x) or False)
+        self.assertEqual(asked, [['b.txt']])
+        self.assertEqual(statuses, {'a.txt': 'unchanged', 'b.txt': 'unchanged'})
+        self.assertEqual(self.read('b.txt'), b'b')
+        statuses = install.install_files(self.root, files[:1], confirm_remove=lambda x: True)
+        self.assertEqual(statuses['b.txt'], 'removed')
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'b.txt')))
+        # nothing to ask about.
+        install.install_files(self.root, files[:1], confirm_remove=self.fail)
+
+    def test_adopt(self):
+        # installed by an older version, without manifest.
+        os.makedirs(self.root)
+        for name, content in [('a.txt', b'old a'), ('b.txt', b'b')]:
+            with open(os.path.join(self.root, name), 'wb') as f:
+                f.write(content)
+        files = [('a.txt', b'new a', False), ('b.txt', b'b', False)]
+        self.assertEqual(install.install_files(self.root, files), {'a.txt': 'kept', 'b.txt': 'unchanged'})
+        self.assertEqual(install.install_files(self.root, files, adopt=True),
+                         {'a.txt': 'updated', 'b.txt': 'unchanged'})
+        self.assertEqual(self.read('a.txt'), b'new a')
+        # files in the manifest changed by the user are still kept.
+        with open(os.path.join(self.root, 'a.txt'), 'wb') as f:
+            f.write(b'user a')
+        self.assertEqual(install.install_files(self.root, files, adopt=True)['a.txt'], 'kept')
+        self.assertEqual(self.read('a.txt'), b'user a')
+
+
+if __name__ == '__main__':
+    unittest.main(failfast=True)
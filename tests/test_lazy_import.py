@@ -0,0 +1,49 @@
+""" test that heavy dependencies and config reads are deferred until first use, and the registry of actions.
+"""
+import subprocess
+import sys
+import unittest
+
+import datasmart.core.util.registry
+
+# jsl is not in the list, as schemas are declared as jsl documents at module level.
+_check_script = """
+import sys
+import {module}
+heavy = sorted(m for m in sys.modules if m.split('.')[0] in ('pymongo', 'bson', 'jsonschema', 'pytz',
+                                                           'strict_rfc3339'))
+print(','.join(heavy))
+"""
+
+
+class TestLazyImport(unittest.TestCase):
+    def check_no_heavy_import(self, module):
+        result = subprocess.check_output([sys.executable, '-c', _check_script.format(module=module)]).decode()
+        self.assertEqual(result.strip(), '', "{} imports heavy modules eagerly".format(module))
+
+    def test_core(self):
+        for module in ('datasmart.core.util.datetime', 'datasmart.core.filetransfer', 'datasmart.core.action',
+                       'datasmart.core.util.registry'):
+            with self.subTest(module=module):
+                self.check_no_heavy_import(module)
+
+    def test_datetime_config_on_first_use(self):
+        script = ("import datasmart.core.util.datetime as d\n"
+                  "assert d._local_tz is None\n"
+                  "d.now_rfc3339_local()\n"
+                  "assert d._local_tz is not None\n")
+        subprocess.check_call([sys.executable, '-c', script])
+
+    def test_registry(self):
+        actions = datasmart.core.util.registry.list_actions()
+        self.assertEqual(actions, sorted(actions))
+        for action in ('demo/file_download', 'demo/file_upload', 'demo/school_grade_input'):
+            self.assertIn(action, actions)
+        registry = datasmart.core.util.registry.get_action_registry()
+        self.assertEqual(registry['demo/file_upload']['module'], 'datasmart.actions.demo.file_upload')
+        action_class = datasmart.core.util.registry.load_action('demo/file_upload')
+        self.assertEqual(action_class.__name__, registry['demo/file_upload']['meta']['action_name'])
+
+
+if __name__ == '__main__':
+    unittest.main(failfast=True)
@@ -0,0 +1,158 @@
+""" test script for native local copy in datasmart.core.util.localcopy.
+"""
+import errno
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from unittest import mock
+
+import datasmart.core.util.localcopy as localcopy
+
+
+class TestLocalCopy(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.temp_dir, 'src')
+        self.content = os.urandom(3 * 1024 * 1024 + 100)
+        with open(self.src, 'wb') as f:
+            f.write(self.content)
+        os.chmod(self.src, 0o640)
+        os.utime(self.src, ns=(1000000000123456789, 1000000000123456789))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def path(self, *names):
+        return os.path.join(self.temp_dir, *names)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_fallback(self):
+        unsupported = OSError(errno.EOPNOTSUPP, 'not supported')
+        cross_device = OSError(errno.EXDEV, 'cross device')
+        # reflink not supported, then copy_file_range (faked, as it's only in Python 3.8 or later).
+        with mock.patch('fcntl.ioctl', side_effect=unsupported), \
+                mock.patch('os.copy_file_range', side_effect=lambda src, dst, count: os.write(dst, os.read(src, count)),
+                           create=True) as copy_file_range, \
+                mock.patch('os.sendfile', side_effect=os.sendfile) as sendfile:
+            localcopy._copy_data(self.src, self.path('dst_1'))
+        self.assertTrue(copy_file_range.called)
+        self.assertFalse(sendfile.called)
+        self.assertEqual(self.read(self.path('dst_1')), self.content)
+        # then sendfile.
+        with mock.patch('fcntl.ioctl', side_effect=unsupported), \
+                mock.patch('os.copy_file_range', side_effect=cross_device, create=True), \
+                mock.patch('os.sendfile', side_effect=os.sendfile) as sendfile, \
+                mock.patch('shutil.copyfileobj', side_effect=shutil.copyfileobj) as copyfileobj:
+            localcopy._copy_data(self.src, self.path('dst_2'))
+        self.assertTrue(sendfile.called)
+        self.assertFalse(copyfileobj.called)
+        self.assertEqual(self.read(self.path('dst_2')), self.content)
+        # then plain read and write.
+        with mock.patch('fcntl.ioctl', side_effect=unsupported), \
+                mock.patch('os.copy_file_range', side_effect=cross_device, create=True), \
+                mock.patch('os.sendfile', side_effect=OSError(errno.ENOSYS, 'no sendfile')), \
+                mock.patch('shutil.copyfileobj', side_effect=shutil.copyfileobj) as copyfileobj:
+            localcopy._copy_data(self.src, self.path('dst_3'))
+        self.assertTrue(copyfileobj.called)
+        self.assertEqual(self.read(self.path('dst_3')), self.content)
+        # other errors are not hidden.
+        with mock.patch('fcntl.ioctl', side_effect=unsupported), \
+                mock.patch('os.copy_file_range', side_effect=OSError(errno.EIO, 'I/O error'), create=True):
+            with self.assertRaises(OSError):
+                localcopy._copy_data(self.src, self.path('dst_4'))
+        # a reflink copies everything by itself.
+        with mock.patch('fcntl.ioctl') as ioctl, mock.patch('os.sendfile') as sendfile:
+            localcopy._copy_data(self.src, self.path('dst_5'))
+        self.assertTrue(ioctl.called)
+        self.assertFalse(sendfile.called)
+
+    def test_throttle(self):
+        throttled = []
+        with mock.patch('fcntl.ioctl', side_effect=OSError(errno.EOPNOTSUPP, 'not supported')):
+            self.assertEqual(localcopy.copy_file(self.src, self.path('dst'), throttle=throttled.append),
+                             len(self.content))
+        self.assertEqual(sum(throttled), len(self.content))
+        self.assertTrue(all(x <= localcopy._THROTTLE_CHUNK_SIZE for x in throttled))
+        self.assertEqual(self.read(self.path('dst')), self.content)
+
+    def test_up_to_date(self):
+        dst = self.path('dst')
+        self.assertFalse(localcopy.is_up_to_date(self.src, dst))
+        # metadata is kept, and a second copy is skipped.
+        self.assertEqual(localcopy.copy_file(self.src, dst), len(self.content))
+        self.assertEqual(stat.S_IMODE(os.stat(dst).st_mode), 0o640)
+        self.assertEqual(os.stat(dst).st_mtime_ns, os.stat(self.src).st_mtime_ns)
+        self.assertTrue(localcopy.is_up_to_date(self.src, dst))
+        self.assertIsNone(localcopy.copy_file(self.src, dst))
+        # a copy is not up to date for hard links.
+        self.assertFalse(localcopy.is_up_to_date(self.src, dst, hardlink=True))
+        self.assertEqual(localcopy.copy_file(self.src, dst, hardlink=True), 0)
+        self.assertTrue(os.path.samefile(self.src, dst))
+        self.assertTrue(localcopy.is_up_to_date(self.src, dst, hardlink=True))
+        # same size, different time.
+        os.remove(dst)
+        localcopy.copy_file(self.src, dst)
+        os.utime(dst, ns=(0, 0))
+        self.assertFalse(localcopy.is_up_to_date(self.src, dst))
+        self.assertEqual(localcopy.copy_file(self.src, dst), len(self.content))
+
+    def test_link_dest(self):
+        old = self.path('old', 'src')
+        localcopy.copy_file(self.src, old)
+        self.assertIsNone(localcopy.copy_file(self.src, self.path('new', 'src'), link_dest=old))
+        self.assertTrue(os.path.samefile(old, self.path('new', 'src')))
+        # not up to date with link_dest, so copied.
+        os.utime(old, ns=(0, 0))
+        self.assertEqual(localcopy.copy_file(self.src, self.path('newer', 'src'), link_dest=old), len(self.content))
+        self.assertFalse(os.path.samefile(old, self.path('newer', 'src')))
+
+    def test_symlink(self):
+        link = self.path('link')
+        os.symlink('src', link)
+        # copied as a symlink, not followed.
+        self.assertEqual(localcopy.copy_file(link, self.path('sub', 'link')), 0)
+        self.assertTrue(os.path.islink(self.path('sub', 'link')))
+        self.assertEqual(os.readlink(self.path('sub', 'link')), 'src')
+        # a dangling one as well.
+        os.symlink('missing', self.path('dangling'))
+        localcopy.copy_file(self.path('dangling'), self.path('sub', 'dangling'))
+        self.assertEqual(os.readlink(self.path('sub', 'dangling')), 'missing')
+        # replacing a file.
+        localcopy.copy_file(self.src, self.path('sub', 'file'))
+        localcopy.copy_file(link, self.path('sub', 'file'))
+        self.assertTrue(os.path.islink(self.path('sub', 'file')))
+
+    def test_atomic(self):
+        dst = self.path('sub', 'dst')
+        os.makedirs(self.path('sub'))
+        with open(dst, 'wb') as f:
+            f.write(b'old')
+
+        def fail_midway(src, tmp, throttle=None):
+            with open(tmp, 'wb') as f:
+                f.write(self.content[:100])
+            raise OSError(errno.EIO, 'I/O error')
+
+        with mock.patch.object(localcopy, '_copy_data', side_effect=fail_midway):
+            with self.assertRaises(OSError):
+                localcopy.copy_file(self.src, dst)
+        # the old file is intact, and no temp file is left.
+        self.assertEqual(self.read(dst), b'old')
+        self.assertEqual(os.listdir(self.path('sub')), ['dst'])
+        # errors of copy_files are raised after all copies.
+        os.symlink('src', self.path('link'))
+        with mock.patch.object(localcopy, '_copy_data', side_effect=fail_midway):
+            with self.assertRaises(OSError):
+                localcopy.copy_files([(self.src, self.path('a')), (self.path('link'), self.path('b'))], workers=2)
+        self.assertFalse(os.path.lexists(self.path('a')))
+        self.assertTrue(os.path.islink(self.path('b')))
+
+
+if __name__ == '__main__':
+    unittest.main(failfast=True)
@@ -0,0 +1,53 @@
+""" test script for path utilities in datasmart.core.util.path.
+"""
+import os
+import unittest
+
+from datasmart.core.util import path
+from datasmart.test_util import file_util
+
+
+def normalize_filelist_relative_reference(filelist, prefix=''):
+    # the straightforward implementation, one path at a time.
+    ret_filelist = [path.joinpath_norm(prefix, p) for p in filelist]
+    for p in ret_filelist:
+        path.filename_more_check(p)
+    return ret_filelist
+
+
+class TestPath(unittest.TestCase):
+
+    def test_normalize_filelist_relative(self):
+        filelist = file_util.gen_filelist(1000, abs_path=False) + [
+            'a//b', './a', 'a/./b', 'a/../b', 'a/b/', 'a/.b', 'a/..b', '.a', '..a/b', '../a', 'a b', ' a/b ', '']
+        for prefix in ['', '.', 'prefix', 'prefix/sub/', '..', 'a/..']:
+            for p in filelist:
+                with self.subTest(prefix=prefix, p=p):
+                    try:
+                        expected = normalize_filelist_relative_reference([p], prefix)
+                    except AssertionError:
+                        with self.assertRaises(AssertionError):
+                            path.normalize_filelist_relative([p], prefix)
+                    else:
+                        self.assertEqual(path.normalize_filelist_relative([p], prefix), expected)
+
+    def test_invalid(self):
+        for filelist in [['a', 'b\tc'], ['a', 'b\nc'], ['a', '/b'], ['a', 'b/..'], ['a', 'é']]:
+            with self.subTest(filelist=filelist):
+                with self.assertRaises(AssertionError):
+                    path.normalize_filelist_relative(filelist)
+
+    def test_rsync_filelist(self):
+        filelist = ['strip/a/b', 'strip/c']
+        self.assertEqual(path.get_rsync_filelist(filelist, {'relative': True, 'strip_prefix': 'strip'}),
+                         (['strip/./a/b', 'strip/./c'], ['a/b', 'c']))
+        self.assertEqual(path.get_rsync_filelist(filelist, {'relative': False}), (filelist, ['b', 'c']))
+        # strip prefix must be a whole directory.
+        with self.assertRaises(AssertionError):
+            path.get_rsync_filelist(filelist, {'relative': True, 'strip_prefix': 'str'})
+        with self.assertRaises(RuntimeError):
+            path.get_rsync_filelist(['a/b', 'c/b'], {'relative': False})
+
+
+if __name__ == '__main__':
+    unittest.main(failfast=True)
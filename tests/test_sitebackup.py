@@ -0,0 +1,146 @@
+""" test script for snapshots of files referenced by records, in datasmart.core.sitebackup.
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import datasmart.core.filetransfer
+import datasmart.core.sitebackup as sitebackup
+from datasmart.test_util import env_util
+
+
+class TestSiteBackup(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.site_dirs = [os.path.join(self.temp_dir, x) for x in ('site_a', 'site_b')]
+        self.backup_root = os.path.join(self.temp_dir, 'backup')
+        env_util.setup_local_config(datasmart.core.filetransfer.FileTransfer.config_path, json.dumps({
+            "local_data_dir": os.path.join(self.temp_dir, 'data'),
+            "site_mapping_push": [],
+            "site_mapping_fetch": [],
+            "remote_site_config": {},
+            "default_site": {'local': True, 'path': self.site_dirs[0]},
+            "quiet": True,
+            "local_fetch_option": "copy"
+        }))
+        datasmart.core.filetransfer.FileTransfer.invalidate_config()
+        self.filetransfer = datasmart.core.filetransfer.FileTransfer()
+        self.files = {('a', 'table/1/x.txt'): b'x', ('a', 'table/1/sub/y.txt'): b'y', ('b', 'table/2/z.txt'): b'z'}
+        for (site, p), content in self.files.items():
+            self.write_file(site, p, content)
+        self.records = [
+            {'_id': 1, 'uploaded_files': {
+                'site': {'local': True, 'path': self.site_dirs[0], 'append_prefix': 'table/1'},
+                'filelist': ['table/1/x.txt', 'table/1/sub/y.txt']}},
+            {'_id': 2, 'results': [{'name': 'z', 'files': {
+                'site': {'local': True, 'path': self.site_dirs[1]},
+                'filelist': ['table/2/z.txt', 'table/2/gone.txt']}}]},
+            {'_id': 3, 'uploaded_files': {
+                'site': {'local': True, 'path': self.site_dirs[0]}, 'filelist': ['table/1/x.txt']}},
+            {'_id': 4, 'notes': 'no files'},
+        ]
+
+    def tearDown(self):
+        env_util.teardown_local_config()
+        datasmart.core.filetransfer.FileTransfer.invalidate_config()
+        shutil.rmtree(self.temp_dir)
+
+    def write_file(self, site, p, content):
+        path = os.path.join(self.site_dirs[0 if site == 'a' else 1], p)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def get_snapshot_path(self, name, site, p):
+        key = sitebackup.get_site_key({'local': True, 'path': self.site_dirs[0 if site == 'a' else 1]})
+        return os.path.join(self.backup_root, name, key, p)
+
+    def test_site_key(self):
+        key = sitebackup.get_site_key({'local': True, 'path': self.site_dirs[0]})
+        self.assertEqual(key, sitebackup.get_site_key({'local': True, 'path': self.site_dirs[0],
+                                                       'append_prefix': 'table/1'}))
+        self.assertNotEqual(key, sitebackup.get_site_key({'local': True, 'path': self.site_dirs[1]}))
+        # same readable part, different sites.
+        key_1 = sitebackup.get_site_key({'local': False, 'path': 'host', 'prefix': '/a_b'})
+        key_2 = sitebackup.get_site_key({'local': False, 'path': 'host', 'prefix': '/a/b'})
+        self.assertNotEqual(key_1, key_2)
+        self.assertEqual(key_1.rsplit('-', 1)[0], key_2.rsplit('-', 1)[0])
+
+    def test_collect(self):
+        site_files = sitebackup.collect_site_files(self.records)
+        self.assertEqual(len(site_files), 2)
+        entry_a = site_files[sitebackup.get_site_key({'local': True, 'path': self.site_dirs[0]})]
+        self.assertEqual(entry_a['filelist'], ['table/1/sub/y.txt', 'table/1/x.txt'])
+        self.assertNotIn('append_prefix', entry_a['site'])
+        entry_b = site_files[sitebackup.get_site_key({'local': True, 'path': self.site_dirs[1]})]
+        self.assertEqual(entry_b['filelist'], ['table/2/gone.txt', 'table/2/z.txt'])
+
+    def test_snapshot(self):
+        site_files = sitebackup.collect_site_files(self.records)
+        manifest = sitebackup.snapshot_sites(site_files, self.backup_root, 'first', filetransfer=self.filetransfer,
+                                             extra={'db_backup': 'first'})
+        self.assertEqual(sitebackup.list_snapshots(self.backup_root), ['first'])
+        self.assertEqual(sitebackup.load_manifest(self.backup_root, 'first'), manifest)
+        self.assertIsNone(manifest['link_dest'])
+        self.assertEqual(manifest['db_backup'], 'first')
+        for (site, p), content in self.files.items():
+            with open(self.get_snapshot_path('first', site, p), 'rb') as f:
+                self.assertEqual(f.read(), content)
+        self.assertEqual(sorted(x['missing'] for x in manifest['sites'].values()), [[], ['table/2/gone.txt']])
+
+        # change one file, and add another one, which is not referenced by records, so not backed up.
+        path_changed = self.write_file('a', 'table/1/x.txt', b'x changed')
+        os.utime(path_changed, (0, 0))
+        self.write_file('a', 'table/1/new.txt', b'new')
+        manifest = sitebackup.snapshot_sites(site_files, self.backup_root, 'second', filetransfer=self.filetransfer)
+        self.assertEqual(manifest['link_dest'], 'first')
+        self.assertFalse(os.path.exists(self.get_snapshot_path('second', 'a', 'table/1/new.txt')))
+        with open(self.get_snapshot_path('second', 'a', 'table/1/x.txt'), 'rb') as f:
+            self.assertEqual(f.read(), b'x changed')
+        with open(self.get_snapshot_path('first', 'a', 'table/1/x.txt'), 'rb') as f:
+            self.assertEqual(f.read(), b'x')
+        # unchanged files are shared with the first snapshot.
+        for site, p in [('a', 'table/1/sub/y.txt'), ('b', 'table/2/z.txt')]:
+            self.assertTrue(os.path.samefile(self.get_snapshot_path('first', site, p),
+                                             self.get_snapshot_path('second', site, p)))
+        stats_a = manifest['sites'][sitebackup.get_site_key({'local': True, 'path': self.site_dirs[0]})]['stats']
+        self.assertEqual(stats_a['skipped'], 1)
+        self.assertEqual(stats_a['total_bytes'], len(b'x changed'))
+        self.assertIn('second', sitebackup.format_summary(manifest))
+        with self.assertRaises(AssertionError):
+            sitebackup.snapshot_sites(site_files, self.backup_root, 'second', filetransfer=self.filetransfer)
+
+    def test_failed_snapshot(self):
+        site_files = sitebackup.collect_site_files(self.records)
+        with mock.patch.object(self.filetransfer, 'relay', side_effect=RuntimeError('transfer failed')):
+            with self.assertRaises(RuntimeError):
+                sitebackup.snapshot_sites(site_files, self.backup_root, 'first', filetransfer=self.filetransfer)
+        self.assertEqual(os.listdir(self.backup_root), [])
+        # a partial snapshot left by a killed run doesn't stop it either.
+        os.makedirs(os.path.join(self.backup_root, '.first.partial', 'stale'))
+        sitebackup.snapshot_sites(site_files, self.backup_root, 'first', filetransfer=self.filetransfer)
+        self.assertEqual(os.listdir(self.backup_root), ['first'])
+        self.assertFalse(os.path.exists(os.path.join(self.backup_root, 'first', 'stale')))
+
+    def test_check(self):
+        result = sitebackup.check_records([(('db.records', x['_id']), x) for x in self.records],
+                                          filetransfer=self.filetransfer)
+        self.assertEqual((result['num_records'], result['num_files']), (4, 4))
+        self.assertEqual(result['mismatches'], [{'owner': ('db.records', 2), 'path': 'table/2/gone.txt',
+                                                 'site': {'local': True, 'path': self.site_dirs[1]}}])
+        # a file referenced by two records is reported for both.
+        os.remove(os.path.join(self.site_dirs[0], 'table/1/x.txt'))
+        result = sitebackup.check_records([(('db.records', x['_id']), x) for x in self.records],
+                                          filetransfer=self.filetransfer)
+        self.assertEqual(sorted((x['owner'][1], x['path']) for x in result['mismatches']),
+                         [(1, 'table/1/x.txt'), (2, 'table/2/gone.txt'), (3, 'table/1/x.txt')])
+        self.assertIn('3 missing', sitebackup.format_check_summary(result))
+
+
+if __name__ == '__main__':
+    unittest.main(failfast=True)
@@ -0,0 +1,113 @@
+""" test script for persistent ssh connections in datasmart.core.util.ssh, without actually running ssh.
+"""
+import os
+import subprocess
+import threading
+import unittest
+from unittest import mock
+
+import datasmart.core.util.ssh as ssh
+
+
+class TestSSH(unittest.TestCase):
+
+    def setUp(self):
+        # a fake ssh, which creates the control socket when asked to start a master.
+        self.commands = []
+        patcher = mock.patch('subprocess.run', side_effect=self.fake_run)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(ssh._stats.clear)
+        self.addCleanup(ssh.close_all_masters)
+
+    def fake_run(self, command, **kwargs):
+        self.commands.append(command)
+        if 'ControlMaster=yes' in command:
+            control_path = command[command.index('-o', command.index('ControlMaster=yes')) + 1][len('ControlPath='):]
+            open(control_path, 'w').close()
+        elif '-O' in command:
+            os.remove(command[command.index('-o') + 1][len('ControlPath='):])
+        return subprocess.CompletedProcess(command, 0)
+
+    def test_args(self):
+        self.assertEqual(ssh.get_ssh_args('user', 'host', 2222, multiplex=False), ['ssh', '-p', '2222'])
+        self.assertEqual(self.commands, [])
+        args = ssh.get_ssh_args('user', 'host', 2222, control_persist=60)
+        # the master is started in batch mode, in background, without a command.
+        master_command, = self.commands
+        self.assertEqual(master_command[:3], ['ssh', '-p', '2222'])
+        self.assertEqual(master_command[-3:], ['-f', '-N', 'user@host'])
+        for option in ['BatchMode=yes', 'ConnectTimeout={}'.format(ssh._CONNECT_TIMEOUT), 'ControlMaster=yes',
+                       'ControlPersist=60']:
+            self.assertEqual(master_command[master_command.index(option) - 1], '-o')
+        control_path = args[args.index('-o', args.index('ControlMaster=no')) + 1][len('ControlPath='):]
+        self.assertEqual(args, ['ssh', '-p', '2222', '-o', 'ControlMaster=no', '-o', 'ControlPath=' + control_path])
+        self.assertIn('ControlPath=' + control_path, master_command)
+        self.assertEqual(ssh.get_ssh_command('user', 'host', 2222), args + ['user@host'])
+        self.assertEqual(ssh.get_rsync_rsh(['ssh', '-o', 'ControlPath=/a b']), "ssh -o 'ControlPath=/a b'")
+
+    def test_reuse(self):
+        args = ssh.get_ssh_args('user', 'host', 22)
+        self.assertEqual(ssh.get_ssh_args('user', 'host', 22), args)
+        # another user or port is another master.
+        args_other = ssh.get_ssh_args('other', 'host', 22)
+        self.assertNotEqual(args_other, args)
+        self.assertEqual(len(self.commands), 2)
+        self.assertEqual(ssh.get_ssh_stats(), {'user@host:22': {'started': 1, 'reused': 1},
+                                               'other@host:22': {'started': 1, 'reused': 0}})
+        # a master that has quit is started again.
+        os.remove(args[-1][len('ControlPath='):])
+        self.assertEqual(ssh.get_ssh_args('user', 'host', 22), args)
+        self.assertEqual(ssh.get_ssh_stats()['user@host:22'], {'started': 2, 'reused': 1})
+
+    def test_start_failure(self):
+        with mock.patch('subprocess.run', side_effect=subprocess.CalledProcessError(255, 'ssh')) as run:
+            self.assertEqual(ssh.get_ssh_args('user', 'host', 22), ['ssh', '-p', '22'])
+            # the failure is remembered for a while, so later calls don't wait for ssh again.
+            self.assertEqual(ssh.get_ssh_args('user', 'host', 22), ['ssh', '-p', '22'])
+            self.assertEqual(run.call_count, 1)
+        self.assertEqual(ssh._masters, {})
+        # tried again after that.
+        with mock.patch('datasmart.core.util.ssh._FAILED_START_BACKOFF', 0):
+            args = ssh.get_ssh_args('user', 'host', 22)
+        self.assertIn('ControlMaster=no', args)
+        self.assertEqual(ssh._failed_starts, {})
+
+    def test_start_per_host(self):
+        # while the master of one host is starting, other hosts are not blocked.
+        started = threading.Event()
+        release = threading.Event()
+        fake_run = self.fake_run
+
+        def slow_run(command, **kwargs):
+            if 'user@slow' in command:
+                started.set()
+                release.wait(10)
+            return fake_run(command, **kwargs)
+
+        with mock.patch('subprocess.run', side_effect=slow_run):
+            thread = threading.Thread(target=ssh.get_ssh_args, args=('user', 'slow', 22))
+            thread.start()
+            self.assertTrue(started.wait(10))
+            self.assertIn('ControlMaster=no', ssh.get_ssh_args('user', 'fast', 22))
+            self.assertTrue(thread.is_alive())
+            release.set()
+            thread.join()
+        self.assertEqual(ssh.get_ssh_stats()['user@slow:22'], {'started': 1, 'reused': 0})
+
+    def test_close_all_masters(self):
+        args = ssh.get_ssh_args('user', 'host', 22)
+        ssh.get_ssh_args('other', 'host', 22)
+        control_dir = os.path.dirname(args[-1][len('ControlPath='):])
+        ssh.close_all_masters()
+        exit_commands = [x for x in self.commands if '-O' in x]
+        self.assertEqual(sorted(x[-1] for x in exit_commands), ['other@host', 'user@host'])
+        self.assertTrue(all(x[x.index('-O') + 1] == 'exit' for x in exit_commands))
+        self.assertFalse(os.path.exists(control_dir))
+        self.assertEqual(ssh._masters, {})
+        # masters are started again afterwards.
+        self.assertNotEqual(ssh.get_ssh_args('user', 'host', 22), args)
+
+
+if __name__ == '__main__':
+    unittest.main(failfast=True)